@@ -0,0 +1,332 @@
+'''
+    DESCRIPTION:
+        Benchmarks for the EE 90 hot paths:
+            I2C driver paths on the simulated bus (hw_backend.SimBackend), with
+            bus transactions per call:
+                CAT5132.wiper get/set
+                CAT5132 set_default() per pot against bulk_program()
+                config_sine() four-pot update (set_sine_pots)
+                adc_print() three ADC reads (adc_read)
+            Lab2 conversion math, per call and in bulk:
+                calc_temperature, pid_controller, cond_dac_control
+                thermal_model.ModelController tick (feedforward plus Smith predictor)
+            Analysis kernels:
+                nonlinear.py load-and-fit on the Rigol captures
+                waveform.py features of a stack of captures, per capture
+                waveform.extract_many on a warm result cache (common/result_cache.py)
+            Telemetry summary pyramid (common/summary_pyramid.py) on a day of 1 Hz samples:
+                build, +-0.1 K band violations and a 1000 pixel zoom, against a plain scan
+
+        Results are written as JSON so runs can be compared between versions.
+        Benchmarks whose dependencies are missing are recorded as skipped.
+
+    USAGE:
+        python bench/bench.py                       run, save to bench/results/
+        python bench/bench.py -o out.json           run, save to out.json
+        python bench/bench.py --compare old.json    run and print the ratio to an older run
+'''
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('final', 'lab2', 'common'):
+    sys.path.append(os.path.join(ROOT, folder))
+
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+BULK_SIZE = 10000
+WAVEFORM_STACK = 500    # 1000-point channels per waveform.features() call
+TRACE_SIZE = 86400      # 1 Hz samples per pyramid benchmark trace, a day
+
+
+def time_call(func, number, repeat):
+    '''
+    Runs func number times per repeat.
+    RETURNS
+    list of seconds per call, one entry per repeat
+    '''
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        runs.append((time.perf_counter() - start) / number)
+    return runs
+
+
+def bench(name, func, number, repeat, bus=None, items=1):
+    '''
+    Times func and, if a simulated bus is given, counts its transactions per call.
+    items: work items per call, used for the per-item time of bulk benchmarks
+    '''
+    transactions = None
+    if bus is not None:
+        before = bus.transactions
+        func()
+        transactions = bus.transactions - before
+    runs = time_call(func, number, repeat)
+    result = {
+        'name': name,
+        'number': number,
+        'repeat': repeat,
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'per_item': min(runs) / items,
+    }
+    if transactions is not None:
+        result['transactions'] = transactions
+    return result
+
+
+def skipped(name, err):
+    return {'name': name, 'skipped': f"{type(err).__name__}: {err}"}
+
+
+def cat5132_benchmarks(number, repeat):
+    import final
+    from hw_backend import SimBackend, SimCAT5132Driver
+
+    results = []
+    # CAT5132 on the sine mux channel, real driver if the adafruit stack is installed
+    backend = SimBackend(pot_type='cat5132')
+    bus = backend.i2c()
+    sin_bus = backend.tca9548a(bus)[final.CHAN_SIN]
+    try:
+        from CAT5132 import CAT5132 as make_pot
+        driver = 'CAT5132.py'
+    except ImportError:
+        make_pot = SimCAT5132Driver
+        driver = 'hw_backend.SimCAT5132Driver'
+    pot = make_pot(sin_bus, final.ADDR_AMP)
+
+    def wiper_get():
+        return pot.wiper
+
+    def wiper_set():
+        pot.wiper = 42
+
+    for name, func in (('cat5132_wiper_get', wiper_get), ('cat5132_wiper_set', wiper_set)):
+        result = bench(name, func, number, repeat, bus)
+        result['driver'] = driver
+        results.append(result)
+
+    # Commissioning all six pots with the 5 ms DCR write cycle modelled:
+    # set_default() + wiper write per pot, against one bulk_program() sweep
+    backend = SimBackend(pot_type='cat5132', nv_write_time=0.005)
+    bus = backend.i2c()
+    tca = backend.tca9548a(bus)
+    pots = [make_pot(tca[channel], address) for channel, address in backend.pots]
+    try:
+        from CAT5132 import bulk_program
+    except ImportError as err:
+        results.append(skipped('cat5132_bulk_program_x6', err))
+        return results
+
+    def program_each():
+        for pot in pots:
+            pot.set_default(100)
+            pot.wiper = 42
+
+    def program_bulk():
+        bulk_program([(pot, 42, 100) for pot in pots])
+
+    for name, func in (('cat5132_program_each_x6', program_each), ('cat5132_bulk_program_x6', program_bulk)):
+        result = bench(name, func, max(1, number // 100), repeat, bus)
+        result['driver'] = driver
+        results.append(result)
+    return results
+
+
+def ds3502_benchmarks(number, repeat):
+    import final
+    from hw_backend import SimBackend
+
+    results = []
+    # DS3502 pots and ADS as final.py main() builds them
+    backend = SimBackend()
+    bus = backend.i2c()
+    tca = backend.tca9548a(bus)
+    sin_bus = tca[final.CHAN_SIN]
+    rc_pots = [backend.ds3502(sin_bus, address) for address in (final.ADDR_SIN1, final.ADDR_SIN2, final.ADDR_SIN3)]
+    amp_pot = backend.ds3502(sin_bus, final.ADDR_AMP)
+    ads = backend.ads1115(bus, final.ADS_GAIN)
+    results.append(bench('config_sine_pot_update',
+                         lambda: final.set_sine_pots(rc_pots, amp_pot, 64, 32), number, repeat, bus))
+    results.append(bench('adc_print_reads', lambda: final.adc_read(ads, backend), number, repeat, bus))
+    return results
+
+
+def lab2_benchmarks(number, repeat):
+    names = ('calc_temperature', 'pid_controller', 'cond_dac_control', 'model_controller')
+    try:
+        import lab2
+        import thermal_model
+    except ImportError as err:
+        return [skipped(name, err) for name in names]
+
+    results = []
+    vcc = 3.287
+    vt = 1.6
+    results.append(bench('calc_temperature',
+                         lambda: lab2.calc_temperature(lab2.RB, lab2.RT0, lab2.T0_C, lab2.BR, vcc, vt),
+                         number, repeat))
+    results.append(bench('pid_controller',
+                         lambda: lab2.pid_controller(300.0, 300.5, lab2.KP, lab2.KI, lab2.KD, 0.1, 5.0, 1.0),
+                         number, repeat))
+    results.append(bench('cond_dac_control',
+                         lambda: lab2.cond_dac_control(1.7, lab2.DAC_LIMIT, lab2.DAC_BITS),
+                         number, repeat))
+    controller = thermal_model.ModelController(thermal_model.FOPDTModel(), [300.0] * BULK_SIZE, lab2.DT)
+    results.append(bench('model_controller', lambda: controller.update(10, 300.5, 1.0), number, repeat))
+
+    # Bulk: a whole log's worth of samples through each stage
+    vts = [1.2 + 0.8 * i / BULK_SIZE for i in range(BULK_SIZE)]
+    temps = [lab2.calc_temperature(lab2.RB, lab2.RT0, lab2.T0_C, lab2.BR, vcc, v) for v in vts]
+
+    def bulk_temperature():
+        for v in vts:
+            lab2.calc_temperature(lab2.RB, lab2.RT0, lab2.T0_C, lab2.BR, vcc, v)
+
+    def bulk_pid():
+        error = 0.0
+        integral = 0.0
+        for temp in temps:
+            control, error, integral = lab2.pid_controller(
+                300.0, temp, lab2.KP, lab2.KI, lab2.KD, error, integral, 1.0)
+            lab2.cond_dac_control(control, lab2.DAC_LIMIT, lab2.DAC_BITS)
+
+    bulk_repeat = max(1, repeat // 2)
+    results.append(bench('calc_temperature_bulk', bulk_temperature, 1, bulk_repeat, items=BULK_SIZE))
+    results.append(bench('pid_and_dac_bulk', bulk_pid, 1, bulk_repeat, items=BULK_SIZE))
+    return results
+
+
+def analysis_benchmarks(repeat):
+    try:
+        import nonlinear
+    except ImportError as err:
+        return [skipped(name, err) for name in ('nonlinear_load_fit', 'waveform_extract_many', 'waveform_features',
+                                                'waveform_extract_many_cached')]
+
+    results = []
+    # The captures and edge windows nonlinear.py analyses
+    for frequency in nonlinear.frequencies:
+        # Timed without the result cache, this is the analysis itself
+        def load_fit():
+            time_s, ch2v = nonlinear.load_capture(frequency['file_path'])
+            nonlinear.fit_edge(time_s, ch2v, frequency['fall_edge_start'], frequency['fall_edge_end'])
+            nonlinear.fit_edge(time_s, ch2v, frequency['rise_edge_start'], frequency['rise_edge_end'])
+
+        file_name = os.path.basename(frequency['file_path'])
+        results.append(bench(f'nonlinear_load_fit[{file_name}]', load_fit, 1, repeat))
+
+    import numpy as np
+    import waveform
+    from result_cache import ResultCache
+    captures = waveform.find_captures([os.path.join(ROOT, 'final', 'square_tri')])
+    results.append(bench('waveform_extract_many', lambda: waveform.extract_many(captures, cache=None), 1, repeat,
+                         items=len(captures)))
+    dt, channels = waveform.load_rigol(captures[0])
+    stack = np.vstack([channels[name] for name in channels] * (WAVEFORM_STACK // len(channels)))
+    results.append(bench(f'waveform_features_x{len(stack)}', lambda: waveform.features(stack, dt), 1, repeat,
+                         items=len(stack)))
+
+    # Re-run on unchanged captures, every capture a hit in a private cache
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory, enabled=True)
+        waveform.extract_many(captures, cache=cache)
+        results.append(bench('waveform_extract_many_cached', lambda: waveform.extract_many(captures, cache=cache),
+                             1, repeat, items=len(captures)))
+    return results
+
+
+def pyramid_benchmarks(repeat):
+    from summary_pyramid import SummaryPyramid
+
+    # A held setpoint: ADC noise on the error, and a disturbance every 2 hours it takes a few minutes to reject
+    rng = random.Random(0)
+    times = [float(index) for index in range(TRACE_SIZE)]
+    errors = [0.02 * rng.gauss(0.0, 1.0) + (0.5 * math.exp(-(index % 7200) / 120) if index % 7200 < 1200 else 0.0)
+              for index in range(TRACE_SIZE)]
+    pyramid = SummaryPyramid(times, errors)
+
+    def scan():
+        return [index for index, error in enumerate(errors) if not -0.1 <= error <= 0.1]
+
+    return [
+        bench('pyramid_build', lambda: SummaryPyramid(times, errors), 1, max(1, repeat // 2), items=TRACE_SIZE),
+        bench('pyramid_violations', lambda: pyramid.violations(-0.1, 0.1), 1, repeat),
+        bench('scan_violations', scan, 1, repeat),
+        bench('pyramid_zoom_1000', lambda: pyramid.zoom(None, None, 1000), 1, repeat),
+    ]
+
+
+def run_all(number=1000, repeat=5):
+    results = []
+    # Keep driver prints out of the timing
+    with contextlib.redirect_stdout(io.StringIO()):
+        results += cat5132_benchmarks(number, repeat)
+        results += ds3502_benchmarks(number, repeat)
+        results += lab2_benchmarks(number * 10, repeat)
+        results += analysis_benchmarks(repeat)
+        results += pyramid_benchmarks(repeat)
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def print_results(report, baseline=None):
+    old = {}
+    if baseline is not None:
+        old = {r['name']: r for r in baseline['results'] if 'skipped' not in r}
+    print(f"{'benchmark':<44}{'min us':>11}{'median us':>11}{'I2C tx':>8}{'vs old':>9}")
+    for result in report['results']:
+        if 'skipped' in result:
+            print(f"{result['name']:<44}  skipped ({result['skipped']})")
+            continue
+        tx = result.get('transactions', '')
+        ratio = ''
+        if result['name'] in old:
+            ratio = f"{result['min'] / old[result['name']]['min']:.2f}x"
+        print(f"{result['name']:<44}{result['min'] * 1e6:>11.2f}{result['median'] * 1e6:>11.2f}{tx:>8}{ratio:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EE 90 benchmark suite")
+    parser.add_argument('-o', '--output', help="JSON results file (default: bench/results/<date>.json)")
+    parser.add_argument('--compare', help="earlier JSON results file to compare against")
+    parser.add_argument('-n', '--number', type=int, default=1000, help="calls per repeat for the I2C paths")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="repeats per benchmark")
+    args = parser.parse_args(argv)
+
+    report = run_all(args.number, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+    print_results(report, baseline)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.now().strftime("bench_%Y_%m_%d_%H_%M_%S.json"))
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# loop_profiler.py
+#
+# Lightweight per-stage timing for the lab control loops, EE90
+#
+# Usage inside a loop:
+#   profiler = LoopProfiler(period=DT)
+#   for step in range(num_steps):
+#       profiler.start()
+#       vt = chan1.voltage
+#       profiler.lap('adc')
+#       ...
+#       profiler.lap('dac')
+#       profiler.end()          # records the whole step, counts overruns
+#   profiler.print_report()
+#
+# Every stage keeps a fixed-size histogram with log-spaced bins, so recording
+# costs one perf_counter() call and one bin increment regardless of run length.
+
+import json
+import math
+from time import perf_counter
+
+HIST_MIN = 1e-6             # Smallest resolved duration, seconds
+HIST_DECADES = 7            # Bins cover 1 us to 10 s
+HIST_BINS_PER_DECADE = 20   # ~12% bin width
+
+
+class StageHistogram:
+    '''
+    Fixed-size log-binned histogram of durations in seconds.
+    Percentiles are read from the bin edges, so they are accurate to a bin width.
+    '''
+    def __init__(self, budget=None):
+        self.bins = [0] * (HIST_DECADES * HIST_BINS_PER_DECADE + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.budget = budget
+        self.overruns = 0
+
+    def record(self, duration):
+        if duration > HIST_MIN:
+            index = int(math.log10(duration / HIST_MIN) * HIST_BINS_PER_DECADE)
+            if index >= len(self.bins):
+                index = len(self.bins) - 1
+        else:
+            index = 0
+        self.bins[index] += 1
+        self.count += 1
+        self.total += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        if self.budget is not None and duration > self.budget:
+            self.overruns += 1
+
+    def percentile(self, p):
+        '''
+        Duration below which a fraction p (0-1) of the samples fall, seconds.
+        '''
+        if self.count == 0:
+            return 0.0
+        target = p * self.count
+        seen = 0
+        for index, num in enumerate(self.bins):
+            seen += num
+            if seen >= target and num:
+                upper = HIST_MIN * 10 ** ((index + 1) / HIST_BINS_PER_DECADE)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p99': self.percentile(0.99),
+            'min': self.min if self.count else 0.0,
+            'max': self.max,
+            'total': self.total,
+            'overruns': self.overruns,
+        }
+
+
+class LoopProfiler:
+    '''
+    Per-stage timing for a periodic loop.
+    start() opens a step, lap(name) closes the stage that ran since the last mark,
+    end() records the whole step against the period budget.
+    A disabled profiler keeps the same calls but records nothing.
+    '''
+    def __init__(self, period=None, enabled=True, stage_budgets=None):
+        '''
+        period: loop period budget in seconds, steps longer than this are overruns
+        enabled: set False to turn the instrumentation into no-ops
+        stage_budgets: optional {stage name: budget in seconds}
+        '''
+        self.period = period
+        self.enabled = enabled
+        self.stage_budgets = stage_budgets or {}
+        self.stages = {}
+        self.step = StageHistogram(period)
+        self._step_start = 0.0
+        self._mark = 0.0
+
+    def _stage(self, name):
+        hist = self.stages.get(name)
+        if hist is None:
+            hist = self.stages[name] = StageHistogram(self.stage_budgets.get(name))
+        return hist
+
+    def start(self):
+        if self.enabled:
+            self._step_start = self._mark = perf_counter()
+
+    def lap(self, name):
+        if self.enabled:
+            now = perf_counter()
+            self._stage(name).record(now - self._mark)
+            self._mark = now
+
+    def end(self):
+        if self.enabled:
+            self.step.record(perf_counter() - self._step_start)
+
+    def report(self):
+        '''
+        RETURNS
+        {stage name: summary dict}, with the whole step under 'step'
+        '''
+        report = {name: hist.summary() for name, hist in self.stages.items()}
+        report['step'] = self.step.summary()
+        return report
+
+    def print_report(self):
+        report = self.report()
+        step_total = report['step']['total'] or 1.0
+        print(f"{'stage':<18}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'share':>8}{'overrun':>9}")
+        for name, stats in report.items():
+            share = stats['total'] / step_total * 100
+            print(f"{name:<18}{stats['count']:>7}{stats['p50'] * 1e3:>10.3f}{stats['p99'] * 1e3:>10.3f}"
+                  f"{stats['max'] * 1e3:>10.3f}{share:>7.1f}%{stats['overruns']:>9}")
+        if self.period is not None:
+            print(f"Period budget {self.period * 1e3:.1f} ms, {report['step']['overruns']} overruns")
+
+    def save(self, file_path):
+        '''
+        Writes the report to a JSON file.
+        '''
+        with open(file_path, 'w') as file:
+            json.dump({'period': self.period, 'stages': self.report()}, file, indent=2)
@@ -0,0 +1,187 @@
+# result_cache.py
+#
+# On-disk memoization of analysis results, EE90
+#
+# A result is stored under the SHA-256 of the analysis name and version, the
+# contents of its input files and its parameters (edge windows, fit order,
+# ...), so re-running an analysis on unchanged captures and settings loads
+# the pickled result instead of re-parsing and re-fitting. Editing a CSV,
+# changing a parameter or bumping the version simply misses.
+#
+# Entries are one pickle file each. A hit touches the file, so file mtimes
+# order the entries by last use and eviction drops the least recently used
+# ones once the cache is over CACHE_MAX_BYTES or CACHE_MAX_ENTRIES.
+#
+# Cached analyses: the nonlinearity edge fits (final/nonlinear.py), the Bode
+# sweep metrics (lab1/bode.py), the PID log metrics and pyramids
+# (lab2/pid_log.py) and the waveform features (final/waveform.py). The only
+# spectral analysis in the tree is the FFT frequency estimate in the waveform
+# features, cached with them. The FFT captures in data/ have no analysis
+# script yet, one would be wired in with memoize() the same way.
+#
+# Usage:
+#   from result_cache import memoize
+#   fits = memoize('nonlinear.edges', lambda: fit(file_path, windows),
+#                  files=[file_path], params={'windows': windows})
+#
+# EE90_CACHE=0 disables the cache, EE90_CACHE_DIR moves it.
+
+import hashlib
+import json
+import os
+import pickle
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.environ.get('EE90_CACHE_DIR', os.path.join(ROOT, '.cache', 'results'))
+CACHE_ENABLED = os.environ.get('EE90_CACHE', '1') != '0'
+CACHE_MAX_BYTES = 64 * 2**20
+CACHE_MAX_ENTRIES = 4096
+ENTRY_SUFFIX = '.pkl'
+
+# (path, size, mtime) -> content hash, so a file is only hashed once per process
+_file_hashes = {}
+
+
+def file_hash(file_path):
+    '''
+    SHA-256 of a file's contents.
+    '''
+    stat = os.stat(file_path)
+    stamp = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_hashes.get(stamp)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = _file_hashes[stamp] = sha.hexdigest()
+    return digest
+
+
+class ResultCache:
+    '''
+    Content-addressed, size-bounded LRU store of pickled results.
+    '''
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES,
+                 enabled=CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, name, files=(), params=None, version=1):
+        text = json.dumps([name, version, [file_hash(path) for path in files], params],
+                          sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        '''
+        RETURNS
+        (True, value) on a hit, (False, None) on a miss
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+            # Mark as recently used
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, value
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def memoize(self, name, compute, files=(), params=None, version=1):
+        '''
+        Returns the cached result of compute() for these inputs, computing
+        and storing it on a miss.
+        INPUTS
+        name: analysis name, keeps different analyses of the same file apart
+        compute: function() producing the result, must be picklable
+        files: input files, hashed by content
+        params: JSON-serialisable analysis parameters
+        version: bump when the analysis code changes its results
+        '''
+        if not self.enabled:
+            return compute()
+        key = self.key(name, files, params, version)
+        hit, value = self.get(key)
+        if hit:
+            return value
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def _entries(self):
+        try:
+            scan = list(os.scandir(self.directory))
+        except OSError:
+            return []
+        entries = []
+        for entry in scan:
+            if entry.name.endswith(ENTRY_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        '''
+        Removes least recently used entries until the cache is within its bounds.
+        '''
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            count -= 1
+            self.evictions += 1
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'directory': self.directory,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+# Cache shared by all the analyses
+default_cache = ResultCache()
+
+
+def memoize(name, compute, files=(), params=None, version=1):
+    return default_cache.memoize(name, compute, files, params, version)
@@ -0,0 +1,94 @@
+# stream_stats.py
+#
+# Constant-memory running statistics for sampled signals, EE90
+#
+# RunningStats keeps count, mean and variance (Welford's update), min, max
+# and an exponentially weighted moving average, updated per sample in O(1)
+# time and memory. Windows are summarised by resetting a RunningStats at the
+# window boundary and merging it into a lifetime RunningStats first:
+#
+#   window = RunningStats(alpha=0.1)
+#   total = RunningStats()
+#   for sample in samples:
+#       window.add(sample)
+#       if window.count == WINDOW:
+#           total.merge(window)
+#           log(window.summary())
+#           window.reset()
+
+import math
+
+
+class RunningStats:
+    '''
+    Count, mean, variance, min, max and EWMA of a stream of samples.
+    '''
+    __slots__ = ('alpha', 'count', 'mean', 'm2', 'min', 'max', 'ewma')
+
+    def __init__(self, alpha=0.1):
+        '''
+        INPUTS
+        alpha: EWMA weight of a new sample, 0-1
+        '''
+        if not 0 < alpha <= 1:
+            raise ValueError("EWMA alpha must be between 0 and 1.")
+        self.alpha = alpha
+        self.ewma = None
+        self.reset()
+
+    def reset(self):
+        '''
+        Starts a new window. The EWMA carries over, it already forgets old samples.
+        '''
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.ewma = value if self.ewma is None else self.ewma + self.alpha * (value - self.ewma)
+
+    def merge(self, other):
+        '''
+        Adds another RunningStats' samples, as if they had been added here
+        (Chan et al. pairwise update). The EWMA follows the other, newer stream.
+        '''
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if other.ewma is not None:
+            self.ewma = other.ewma
+
+    @property
+    def variance(self):
+        # Sample variance, zero until there are two samples
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'std': self.std,
+            'min': self.min if self.count else 0.0,
+            'max': self.max if self.count else 0.0,
+            'ewma': self.ewma if self.ewma is not None else 0.0,
+        }
@@ -0,0 +1,172 @@
+# summary_pyramid.py
+#
+# Multi-resolution min/max/mean summary of a long sampled trace, EE90
+#
+# Level k of the pyramid holds the min, max and sum of every aligned block of
+# 2**k samples, level 0 being the samples themselves. Appending a sample
+# completes at most one block per level, so the pyramid is built as the data
+# is logged in amortised O(1) time per sample, with about twice the memory of
+# the raw trace.
+#
+# Any sample range is covered by O(log n) aligned blocks, so:
+#   summary()     min/max/mean of a time window in O(log n)
+#   zoom()        one min/max/mean per pixel, O(pixels log n) whatever the
+#                 window length, for plots at any zoom level
+#   violations()  the time intervals a trace spent outside a band; blocks
+#                 entirely inside the band are skipped and blocks entirely
+#                 outside it taken whole, so the cost follows the number of
+#                 band crossings, not the number of samples
+#
+# Usage:
+#   pyramid = SummaryPyramid()
+#   for time_s, temp in samples:
+#       pyramid.append(time_s, temp)
+#   pyramid.violations(309.96, 310.16)   # [(first time, last time, worst value)]
+
+from bisect import bisect_left, bisect_right
+
+SCAN_LEVEL = 4      # mixed blocks of up to 2**SCAN_LEVEL samples are scanned, not split
+
+
+class SummaryPyramid:
+    '''
+    Min/max/sum pyramid over a trace of (time, value) samples, times non-decreasing.
+    '''
+    def __init__(self, times=(), values=()):
+        self.times = []
+        self.values = []
+        # mins[k][i], maxs[k][i], sums[k][i] summarise samples i*2**k to (i+1)*2**k - 1,
+        # level 0 is the sample list itself
+        self.mins = [self.values]
+        self.maxs = [self.values]
+        self.sums = [self.values]
+        for time_s, value in zip(times, values):
+            self.append(time_s, value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, time_s, value):
+        self.times.append(time_s)
+        self.values.append(value)
+        count = len(self.values)
+        # A block of 2**level samples completes whenever the count is a multiple of it
+        level = 1
+        while count % (1 << level) == 0:
+            if level == len(self.mins):
+                self.mins.append([])
+                self.maxs.append([])
+                self.sums.append([])
+            below = level - 1
+            left = 2 * (count >> level) - 2
+            mins, maxs, sums = self.mins[below], self.maxs[below], self.sums[below]
+            self.mins[level].append(min(mins[left], mins[left + 1]))
+            self.maxs[level].append(max(maxs[left], maxs[left + 1]))
+            self.sums[level].append(sums[left] + sums[left + 1])
+            level += 1
+
+    def _indices(self, start, end):
+        '''
+        Sample index range [lo, hi) of the time window, None for either end of the trace.
+        '''
+        lo = 0 if start is None else bisect_left(self.times, start)
+        hi = len(self.times) if end is None else bisect_right(self.times, end)
+        return lo, max(lo, hi)
+
+    def _cover(self, lo, hi):
+        '''
+        The fewest aligned blocks exactly covering samples [lo, hi), as (level, index).
+        '''
+        top = len(self.mins) - 1
+        while lo < hi:
+            level = min((hi - lo).bit_length() - 1, top)
+            if lo:
+                level = min(level, (lo & -lo).bit_length() - 1)
+            yield level, lo >> level
+            lo += 1 << level
+
+    def _combine(self, lo, hi):
+        '''
+        (min, max, mean) of samples [lo, hi), lo < hi.
+        '''
+        low = high = None
+        total = 0.0
+        for level, index in self._cover(lo, hi):
+            block_min = self.mins[level][index]
+            block_max = self.maxs[level][index]
+            low = block_min if low is None or block_min < low else low
+            high = block_max if high is None or block_max > high else high
+            total += self.sums[level][index]
+        return low, high, total / (hi - lo)
+
+    def summary(self, start=None, end=None):
+        '''
+        RETURNS
+        (min, max, mean) of the samples in the time window, None if it is empty
+        '''
+        lo, hi = self._indices(start, end)
+        if lo == hi:
+            return None
+        return self._combine(lo, hi)
+
+    def zoom(self, start=None, end=None, pixels=1000):
+        '''
+        Decimated trace for plotting the time window at pixels columns.
+        RETURNS
+        list of (time of first sample, min, max, mean), one per column, or one
+        per sample if the window has fewer samples than columns
+        '''
+        lo, hi = self._indices(start, end)
+        count = hi - lo
+        if count <= pixels:
+            return [(self.times[index], self.values[index], self.values[index], self.values[index])
+                    for index in range(lo, hi)]
+        columns = []
+        for column in range(pixels):
+            first = lo + count * column // pixels
+            last = lo + count * (column + 1) // pixels
+            columns.append((self.times[first],) + self._combine(first, last))
+        return columns
+
+    def violations(self, low, high, start=None, end=None):
+        '''
+        Intervals the trace spent outside [low, high] in the time window.
+        RETURNS
+        list of (time of first sample outside, time of last sample outside,
+        value furthest outside) in time order, consecutive samples outside
+        the band merged into one interval
+        '''
+        intervals = []
+        values = self.values
+
+        def add(first, last, worst):
+            if intervals and intervals[-1][1] == first - 1:
+                previous = intervals[-1]
+                previous[1] = last
+                if (low - worst if worst < low else worst - high) > \
+                        (low - previous[2] if previous[2] < low else previous[2] - high):
+                    previous[2] = worst
+            else:
+                intervals.append([first, last, worst])
+
+        # Depth first, left to right, so intervals come out in time order
+        stack = list(reversed(list(self._cover(*self._indices(start, end)))))
+        while stack:
+            level, index = stack.pop()
+            block_min = self.mins[level][index]
+            block_max = self.maxs[level][index]
+            if block_min >= low and block_max <= high:
+                continue
+            first = index << level
+            if block_max < low or block_min > high:
+                add(first, first + (1 << level) - 1, block_min if block_max < low else block_max)
+            elif level <= SCAN_LEVEL:
+                # Small mixed block, cheaper to scan than to split
+                for position in range(first, first + (1 << level)):
+                    value = values[position]
+                    if not low <= value <= high:
+                        add(position, position, value)
+            else:
+                stack.append((level - 1, 2 * index + 1))
+                stack.append((level - 1, 2 * index))
+        return [(self.times[first], self.times[last], worst) for first, last, worst in intervals]
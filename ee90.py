@@ -0,0 +1,283 @@
+'''
+    DESCRIPTION:
+        Single entry point for the EE 90 lab scripts.
+
+        Only argparse is loaded up front. Each subcommand imports its own
+        modules when it runs, and the board/adafruit drivers and matplotlib
+        are only imported once a subcommand opens the hardware or plots, so
+        the analysis commands run on machines without the MCP2221 stack.
+
+    USAGE:
+        python ee90.py sin [--backend sim] [--monitor]
+                                                    configure the sine wave
+        python ee90.py sq_tri [--backend sim] [--monitor]
+                                                    configure the square and triangle wave
+        python ee90.py amp VPK [MODE ...] [--backend sim] [--hold]
+                                                    regulate the sine amplitude in each freq mode,
+                                                    then hold it across freq mode changes, --hold
+                                                    also corrects drift in the background
+        python ee90.py tests [--backend sim]        final project bring-up tests
+        python ee90.py batch SCRIPT|- [--backend sim] [-o LOG] [--monitor]
+                                                    run a configurator script, '-' for stdin
+        python ee90.py pid [--sim] [--profile FILE | --long] [--model [--model-file FILE]]
+                                                    lab2 thermal PID or model-based run
+        python ee90.py analyze [--plot]             triangle wave nonlinearity fits
+        python ee90.py analyze features [PATH ...] [-o TABLE]
+                                                    measure Rigol captures, rebuild the calibration table
+        python ee90.py analyze bode [PATH ...]      lab1 Bode sweep metrics
+        python ee90.py analyze pid_log LOG ... [--violations] [--zoom PIXELS]
+                                                    lab2 log tracking metrics, out of band intervals
+        python ee90.py analyze model LOG [-o FILE]  identify the lab2 plant model from a log
+        python ee90.py cache [stats|clear]          analysis result cache
+        python ee90.py bench [bench.py options]     benchmark suite
+        python ee90.py fleet sweep SCRIPT|pid [fleet.py options]
+                                                    run a campaign on all boards concurrently
+'''
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKENDS = ('hardware', 'sim')
+# Subcommands whose options are parsed by the script they run
+PASSTHROUGH_COMMANDS = ('bench', 'fleet')
+
+
+def _add_paths(*folders):
+    for folder in folders:
+        path = os.path.join(ROOT, folder)
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+def cmd_generator(args):
+    _add_paths('final', 'common')
+    import final
+    gen = final.setup(args.backend)
+    if args.monitor:
+        final.start_health(gen)
+    try:
+        if args.command == 'sin':
+            final.run_sine(gen)
+        else:
+            final.run_sq_tri(gen)
+    finally:
+        if args.monitor:
+            final.stop_health(gen)
+
+
+def cmd_amp(args):
+    _add_paths('final', 'common')
+    import final
+    gen = final.setup(args.backend)
+    regulator = gen['amp_regulator']
+    if args.hold:
+        regulator.start()
+    try:
+        if args.vpk is None:
+            final.run_amp(gen)
+            return
+        for mode in args.modes or ['low']:
+            if mode not in final.sine_freq_map:
+                sys.exit(f"Unknown freq mode '{mode}', must be low, mid or high.")
+            final.set_sine_amplitude(regulator, args.vpk, mode, gen['gpios']['G0'], gen['gpios']['G1'], gen['state'])
+        if args.hold:
+            print("Holding the amplitude, Ctrl-C to stop.")
+            while True:
+                time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.hold:
+            regulator.stop()
+            print(f"{regulator.corrections} background corrections, {regulator.errors} read errors.")
+
+
+def cmd_batch(args):
+    _add_paths('final', 'common')
+    import final
+    if args.script == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.script, 'r') as file:
+            lines = file.readlines()
+    gen = final.setup(args.backend)
+    if args.monitor:
+        final.start_health(gen)
+    try:
+        final.run_batch(gen, lines, args.output)
+    except ValueError as err:
+        sys.exit(str(err))
+    finally:
+        if args.monitor:
+            final.stop_health(gen)
+
+
+def cmd_tests(args):
+    _add_paths('final', 'common')
+    import final
+    gen = final.setup(args.backend)
+    final.run_all_tests(gen['i2c'], gen['backend'], args.gpio)
+
+
+def cmd_pid(args):
+    _add_paths('lab2', 'common')
+    import lab2
+    hardware = None
+    if args.sim:
+        import thermal_sim
+        hardware = thermal_sim.SimulatedHardware()
+    if args.model_file:
+        lab2.MODEL_FILE = args.model_file
+    mode = 'model' if args.model else None
+    if args.profile or args.long:
+        lab2.long_test(args.profile, hardware, mode)
+    else:
+        lab2.pid_test(hardware, mode)
+
+
+def cmd_analyze(args):
+    _add_paths('final', 'lab1', 'lab2', 'common')
+    if args.no_cache:
+        import result_cache
+        result_cache.default_cache.enabled = False
+    if args.kind == 'bode':
+        import bode
+        bode.main(args.paths)
+        return
+    if args.kind == 'model':
+        if len(args.paths) != 1:
+            sys.exit("analyze model needs one log file.")
+        import thermal_model
+        thermal_model.main(args.paths + (['-o', args.output] if args.output else []))
+        return
+    if args.kind == 'pid_log':
+        if not args.paths:
+            sys.exit("analyze pid_log needs at least one log file.")
+        import pid_log
+        argv = list(args.paths)
+        if args.violations:
+            argv.append('--violations')
+        if args.zoom:
+            argv += ['--zoom', str(args.zoom)]
+        pid_log.main(argv)
+        return
+    if args.kind == 'features':
+        import waveform
+        argv = list(args.paths)
+        if args.output:
+            argv += ['-o', args.output]
+        waveform.main(argv)
+        return
+    import nonlinear
+    nonlinear.main(plot=args.plot)
+
+
+def cmd_cache(args):
+    _add_paths('common')
+    from result_cache import default_cache
+    if args.action == 'clear':
+        default_cache.clear()
+    stats = default_cache.stats()
+    print(f"{stats['directory']}: {stats['entries']} entries, {stats['bytes'] / 2**20:.2f} MiB")
+
+
+def cmd_bench(args):
+    _add_paths('bench')
+    import bench
+    bench.main(args.passthrough_args)
+
+
+def cmd_fleet(args):
+    _add_paths('fleet')
+    import fleet
+    fleet.main(args.passthrough_args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='ee90', description="EE 90 lab scripts")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    default_backend = os.environ.get('EE90_BACKEND', 'hardware')
+    for name, help_text in (('sin', "configure the sine wave"),
+                            ('sq_tri', "configure the square and triangle wave")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--backend', choices=BACKENDS, default=default_backend,
+                             help="board or simulated I2C bus (default: %(default)s)")
+        command.add_argument('--monitor', action='store_true', help="run the supply health monitor alongside")
+        command.set_defaults(func=cmd_generator)
+
+    command = commands.add_parser('tests', help="final project bring-up tests")
+    command.add_argument('--backend', choices=BACKENDS, default=default_backend,
+                         help="board or simulated I2C bus (default: %(default)s)")
+    command.add_argument('--gpio', default=None, metavar='BITS', help="GPIO test bits G0-G3, e.g. 1010 (default: ask)")
+    command.set_defaults(func=cmd_tests)
+
+    command = commands.add_parser('amp', help="regulate the sine amplitude to a target peak voltage")
+    command.add_argument('vpk', type=float, nargs='?', help="target peak voltage (default: ask)")
+    command.add_argument('modes', nargs='*', metavar='MODE',
+                         help="freq modes to regulate in, in order (default: low)")
+    command.add_argument('--backend', choices=BACKENDS, default=default_backend,
+                         help="board or simulated I2C bus (default: %(default)s)")
+    command.add_argument('--hold', action='store_true',
+                         help="keep regulating the target in the background, until Ctrl-C")
+    command.set_defaults(func=cmd_amp)
+
+    command = commands.add_parser('batch', help="run a sin/sq_tri configurator script")
+    command.add_argument('script', help="script file, '-' reads stdin (see final/batch_script.py)")
+    command.add_argument('--backend', choices=BACKENDS, default=default_backend,
+                         help="board or simulated I2C bus (default: %(default)s)")
+    command.add_argument('-o', '--output', help="measurement CSV (default: batch_data_<date>.csv)")
+    command.add_argument('--monitor', action='store_true', help="run the supply health monitor alongside")
+    command.set_defaults(func=cmd_batch)
+
+    command = commands.add_parser('pid', help="lab2 thermal PID run")
+    command.add_argument('--sim', action='store_true', help="run against thermal_sim instead of the board")
+    command.add_argument('--profile', help="setpoint profile file, see lab2/profiles")
+    command.add_argument('--long', action='store_true', help="built-in 2 hour two-step test")
+    command.add_argument('--model', action='store_true',
+                         help="model-based control, feedforward plus Smith predictor (see lab2/thermal_model.py)")
+    command.add_argument('--model-file', help="identified plant model JSON (see 'analyze model')")
+    command.set_defaults(func=cmd_pid)
+
+    command = commands.add_parser('analyze', help="capture analysis: nonlinearity fits, waveform features, "
+                                                  "Bode sweeps or PID logs")
+    command.add_argument('kind', nargs='?', choices=('nonlinear', 'features', 'bode', 'pid_log', 'model'), default='nonlinear',
+                         help="analysis to run (default: %(default)s)")
+    command.add_argument('paths', nargs='*', help="features/bode: files or folders (default: stored data), "
+                                                  "pid_log/model: log files")
+    command.add_argument('--plot', action='store_true', help="nonlinear: plot the fits (needs matplotlib)")
+    command.add_argument('-o', '--output', help="features: calibration table CSV, model: model JSON")
+    command.add_argument('--violations', action='store_true', help="pid_log: list the intervals out of +-0.1 K")
+    command.add_argument('--zoom', type=int, metavar='PIXELS', help="pid_log: print the temperature decimated to PIXELS rows")
+    command.add_argument('--no-cache', action='store_true', help="recompute instead of using cached results")
+    command.set_defaults(func=cmd_analyze)
+
+    command = commands.add_parser('cache', help="analysis result cache size, or clear it")
+    command.add_argument('action', nargs='?', choices=('stats', 'clear'), default='stats')
+    command.set_defaults(func=cmd_cache)
+
+    # Options after 'bench' and 'fleet', -h included, are left for bench.py and fleet.py to parse
+    command = commands.add_parser('bench', help="benchmark suite, options are passed to bench.py", add_help=False)
+    command.set_defaults(func=cmd_bench)
+
+    command = commands.add_parser('fleet', help="campaign on several boards at once, options are passed to fleet.py",
+                                  add_help=False)
+    command.set_defaults(func=cmd_fleet)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command in PASSTHROUGH_COMMANDS:
+        args.passthrough_args = extra
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 #I2C driver for CAT5132 digipot 
-from time import sleep
+from time import monotonic
 from micropython import const
 from adafruit_bus_device.i2c_device import I2CDevice
 from adafruit_register.i2c_struct import UnaryStruct
+from i2c_retry import NAK_RETRIES, NAK_RETRY_DELAY, retry
 
 __version__ = "0.0.1"
 
@@ -16,6 +17,9 @@ _DCR_DR_DATA_ADDRESS = const(0x00)    # Data address for DCR after selection by
 _SELECT_WCR_COMMAND = const(0x80)     # Value to write to AR to select Wiper Control Register
 _SELECT_DCR_COMMAND = const(0x00)     # Value to write to AR to select Default Control Register
 
+# The part NAKs while a non-volatile DCR write is in progress, transfers are
+# retried with i2c_retry.retry()
+
 class CAT5132:
     """
     Driver for the CAT5132 I2C Digital Potentiometer. EE 90-2025  
@@ -35,6 +39,13 @@ class CAT5132:
         """
         self.i2c_device = I2CDevice(i2c_bus, address)
 
+    @property
+    def address(self):
+        """
+        The I2C address of the device.
+        """
+        return self.i2c_device.device_address
+
     @property
     def wiper(self):
         """
@@ -72,9 +83,9 @@ class CAT5132:
             raise ValueError("Default value must be between 0 and 127.")
         self._access_register_selector = _SELECT_DCR_COMMAND
         self._default_register_data = value
-        #now verify a valid value was written by reading back the register 
-        self._access_register_selector = _SELECT_DCR_COMMAND
-        read_value = self._default_register_data
+        #now verify a valid value was written by reading back the register, AR still selects the DCR.
+        #The part NAKs until its non-volatile write cycle is done, so retry the read.
+        read_value = retry(lambda: self._default_register_data)
         if read_value != value:
             raise RuntimeError(f"Failed to set default value. Expected {value}, got {read_value}.")
         
@@ -88,4 +99,78 @@ class CAT5132:
         """
         self._access_register_selector = _SELECT_DCR_COMMAND
         raw_value = self._default_register_data
-        return raw_value & 0x7F  # Ensure value is 7-bit, as MSB is ignored/0
\ No newline at end of file
+        return raw_value & 0x7F  # Ensure value is 7-bit, as MSB is ignored/0
+
+
+def bulk_program(settings, retries=NAK_RETRIES, retry_delay=NAK_RETRY_DELAY):
+    """
+    Programs the wiper and/or default registers of many CAT5132 devices in one sweep.
+
+    The writes go out one register at a time across all devices, so the
+    non-volatile DCR writes run on every part at once instead of one after the
+    other, then all read-backs are verified together. NAKs are retried, and
+    registers that read back wrong are rewritten, up to retries times.
+
+    :param settings: list of (CAT5132, wiper, default) tuples, None skips a register.
+    :param int retries: retries per transfer and rewrite passes for mismatches.
+    :param float retry_delay: seconds to wait before retrying a NAK'd transfer.
+    :return: dict with the number of transfers, retries and elapsed seconds.
+    """
+    for _, wiper, default in settings:
+        for value in (wiper, default):
+            if value is not None and not 0 <= value <= 127:
+                raise ValueError("Wiper and default values must be between 0 and 127.")
+
+    stats = {"transfers": 0, "retries": 0, "elapsed": 0.0}
+    start = monotonic()
+    # Access register selection per device, so redundant selects are skipped
+    selected = {}
+
+    def select(pot, command):
+        if selected.get(id(pot)) != command:
+            def write_ar():
+                pot._access_register_selector = command
+            retry(write_ar, retries, retry_delay, stats)
+            selected[id(pot)] = command
+
+    def write(pot, command, value):
+        select(pot, command)
+        def write_data():
+            if command == _SELECT_WCR_COMMAND:
+                pot._wiper_register_data = value
+            else:
+                pot._default_register_data = value
+        retry(write_data, retries, retry_delay, stats)
+
+    def read(pot, command):
+        select(pot, command)
+        if command == _SELECT_WCR_COMMAND:
+            return retry(lambda: pot._wiper_register_data, retries, retry_delay, stats) & 0x7F
+        return retry(lambda: pot._default_register_data, retries, retry_delay, stats) & 0x7F
+
+    pending = []
+    for pot, wiper, default in settings:
+        if default is not None:
+            pending.append((pot, _SELECT_DCR_COMMAND, default))
+    for pot, wiper, default in settings:
+        if wiper is not None:
+            pending.append((pot, _SELECT_WCR_COMMAND, wiper))
+
+    for _ in range(retries + 1):
+        # DCR writes first so their write cycles overlap the WCR writes
+        for pot, command, value in pending:
+            write(pot, command, value)
+        # Verify, reading whichever register each device has selected first
+        pending.sort(key=lambda item: selected.get(id(item[0])) != item[1])
+        pending = [(pot, command, value) for pot, command, value in pending
+                   if read(pot, command) != value]
+        if not pending:
+            break
+    stats["elapsed"] = monotonic() - start
+
+    if pending:
+        failed = ", ".join(
+            f"{hex(pot.address)} {'WCR' if command == _SELECT_WCR_COMMAND else 'DCR'}={value}"
+            for pot, command, value in pending)
+        raise RuntimeError(f"Failed to program CAT5132 registers after {retries} retries: {failed}")
+    return stats
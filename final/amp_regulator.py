@@ -0,0 +1,295 @@
+'''
+    DESCRIPTION:
+        Closed-loop amplitude regulation of the sine output. PEAK_IN (the
+        peak detector on ADS_CHAN_PEAK) is sampled and the amplitude pot
+        (ADDR_AMP) is adjusted until the peak is at the target.
+
+        Each frequency mode has its own cached code-to-amplitude line, fitted
+        to the points measured while regulating. A new target, or a switch to
+        a mode that was regulated before, starts with one feedforward write to
+        the code the line predicts. The remaining error is taken out with a
+        velocity-form PI law in pot codes, scaled by the line's slope:
+
+            code += (KI * e[k] + KP * (e[k] - e[k-1])) / slope
+
+        With KI = 1 that is a Newton step on the cached line, so the loop
+        settles in one or two writes once the line is known.
+
+        The pot code is read back at the start of every regulate(), as the
+        configurators and batch scripts write the amplitude pot directly.
+        The last target is held: hold() regulates to it again after a
+        capacitor bank (frequency mode) change, and release() drops it when
+        a different amplitude code is set by hand.
+
+        start() runs the hold in the background as well: a daemon thread
+        samples the peak every AMP_HOLD_PERIOD seconds and regulates again
+        when it has drifted out of tolerance. regulate() and the thread hold
+        the regulator's lock, and code writing the amplitude pot or the sine
+        capacitor bank holds it too, so the thread never acts on a half
+        applied configuration.
+
+    EXPECTED:
+        regulate() returns the code, peak, error, whether it converged, the
+        pot writes and peak samples used and the time taken. The peak and
+        error are None if no measurement was taken (max_steps 0).
+'''
+import threading
+import time
+
+AMP_KP = 0.2
+AMP_KI = 1.0
+AMP_TOLERANCE = 0.02    # V, error accepted as converged (or half a code step, if larger)
+AMP_SETTLE_TIME = 0.02  # s, peak detector settling after a pot write
+AMP_SAMPLES = 4         # peak samples averaged per measurement
+AMP_MAX_STEPS = 10      # measurements before regulate() gives up
+AMP_MODEL_POINTS = 8    # measured points kept per frequency mode
+AMP_HOLD_PERIOD = 0.5   # s between peak checks of the background hold
+
+# busio raises OSError for a NAK, the MCP2221 bridge RuntimeError
+_NAK_ERRORS = (OSError, RuntimeError)
+# V per code used until a mode has a measured point away from code 0
+AMP_DEFAULT_SLOPE = 3.0 / 127
+
+
+class AmplitudeModel:
+    '''
+    Cached code-to-amplitude lines, one per frequency mode.
+    '''
+    def __init__(self, points=None, max_points=AMP_MODEL_POINTS):
+        # freq mode -> [[code, vpk], ...], newest last
+        self.points = {mode: [list(point) for point in pts] for mode, pts in (points or {}).items()}
+        self.max_points = max_points
+
+    def add(self, mode, code, vpk):
+        points = [point for point in self.points.get(mode, []) if point[0] != code]
+        points.append([code, vpk])
+        self.points[mode] = points[-self.max_points:]
+
+    def fit(self, mode):
+        '''
+        RETURNS
+        (slope, intercept) of the line through the mode's points, None if
+        there are none. A single point is taken as a line through zero.
+        '''
+        points = self.points.get(mode)
+        if not points:
+            return None
+        if len(points) == 1:
+            code, vpk = points[0]
+            if code == 0 or vpk <= 0:
+                return None
+            return vpk / code, 0.0
+        n = len(points)
+        mean_code = sum(point[0] for point in points) / n
+        mean_vpk = sum(point[1] for point in points) / n
+        sxx = sum((point[0] - mean_code) ** 2 for point in points)
+        sxy = sum((point[0] - mean_code) * (point[1] - mean_vpk) for point in points)
+        if sxx == 0 or sxy <= 0:
+            return None
+        slope = sxy / sxx
+        return slope, mean_vpk - slope * mean_code
+
+    def code_for(self, mode, target, code_min=0, code_max=127):
+        line = self.fit(mode)
+        if line is None:
+            return None
+        slope, intercept = line
+        return min(max(round((target - intercept) / slope), code_min), code_max)
+
+    def to_dict(self):
+        return {mode: [list(point) for point in points] for mode, points in self.points.items()}
+
+
+class AmplitudeRegulator:
+    '''
+    Drives the amplitude pot until the peak detector reads the target.
+    INPUTS
+    amp_pot: pot driver with .wiper
+    peak_in: ADC channel with .voltage on PEAK_IN
+    model: AmplitudeModel to start from, e.g. restored from the generator state
+    target: Vpk to hold, e.g. restored from the generator state, None for none
+    mode: frequency mode the capacitor bank is in, for the background hold
+    on_correct: function(result) called from the hold thread after a correction
+    '''
+    def __init__(self, amp_pot, peak_in, model=None, target=None, mode=None, kp=AMP_KP, ki=AMP_KI,
+                 tolerance=AMP_TOLERANCE, settle_time=AMP_SETTLE_TIME, samples=AMP_SAMPLES,
+                 max_steps=AMP_MAX_STEPS, code_min=0, code_max=127, hold_period=AMP_HOLD_PERIOD,
+                 on_correct=None, clock=time.monotonic, sleep=time.sleep):
+        self.amp_pot = amp_pot
+        self.peak_in = peak_in
+        self.model = model if model is not None else AmplitudeModel()
+        self.kp = kp
+        self.ki = ki
+        self.tolerance = tolerance
+        self.settle_time = settle_time
+        self.samples = samples
+        self.max_steps = max_steps
+        self.code_min = code_min
+        self.code_max = code_max
+        self.clock = clock
+        self.sleep = sleep
+        # Code in the pot, read at the start of each regulate() and tracked during it
+        self.code = None
+        # Vpk held across frequency mode changes, None when not holding, and the mode it is held in
+        self.target = target
+        self.mode = mode
+        self.hold_period = hold_period
+        self.on_correct = on_correct
+        # Totals over all regulate() calls, and background hold corrections and read errors
+        self.writes = 0
+        self.samples_taken = 0
+        self.corrections = 0
+        self.errors = 0
+        # Re-entrant, callers holding it across a configuration change may regulate inside it
+        self.lock = threading.RLock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _write(self, code):
+        self.amp_pot.wiper = code
+        self.code = code
+        self.writes += 1
+
+    def measure(self):
+        '''
+        Mean of the peak samples after the detector has settled.
+        '''
+        if self.settle_time:
+            self.sleep(self.settle_time)
+        total = 0.0
+        for _ in range(self.samples):
+            total += self.peak_in.voltage
+        self.samples_taken += self.samples
+        return total / self.samples
+
+    def regulate(self, target, mode):
+        '''
+        Brings the peak to target Vpk in the given frequency mode. The
+        capacitor bank must already be switched to that mode.
+        '''
+        with self.lock:
+            return self._regulate(target, mode)
+
+    def _regulate(self, target, mode):
+        start = self.clock()
+        writes = self.writes
+        samples = self.samples_taken
+        self.target = target
+        self.mode = mode
+        # Other code writes the pot too, never trust a code from an earlier call
+        self.code = self.amp_pot.wiper
+
+        # Feedforward from the cached line
+        code = self.model.code_for(mode, target, self.code_min, self.code_max)
+        if code is not None and code != self.code:
+            self._write(code)
+
+        converged = False
+        previous_error = None
+        vpk = error = None
+        for _ in range(self.max_steps):
+            vpk = self.measure()
+            self.model.add(mode, self.code, vpk)
+            error = target - vpk
+            line = self.model.fit(mode)
+            slope = line[0] if line is not None else AMP_DEFAULT_SLOPE
+            if abs(error) <= max(self.tolerance, slope / 2):
+                converged = True
+                break
+            delta = self.ki * error
+            if previous_error is not None:
+                delta += self.kp * (error - previous_error)
+            previous_error = error
+            code = min(max(round(self.code + delta / slope), self.code_min), self.code_max)
+            if code == self.code:
+                # Pot at its end stop, the target is out of range in this mode
+                break
+            self._write(code)
+
+        return {
+            'target': target,
+            'mode': mode,
+            'code': self.code,
+            'vpk': vpk,
+            'error': error,
+            'converged': converged,
+            'writes': self.writes - writes,
+            'samples': self.samples_taken - samples,
+            'time': self.clock() - start,
+        }
+
+    def hold(self, mode):
+        '''
+        Regulates to the held target after a switch to mode.
+        RETURNS
+        regulate() result, None if no target is held
+        '''
+        with self.lock:
+            if self.target is None:
+                self.mode = mode
+                return None
+            return self._regulate(self.target, mode)
+
+    def release(self):
+        '''
+        Stops holding the target, for when the amplitude code is set by hand.
+        '''
+        with self.lock:
+            self.target = None
+
+    def check(self):
+        '''
+        One step of the background hold: samples the peak and regulates again
+        if it has drifted out of tolerance. Called by the hold thread, or
+        directly to hold without one.
+        RETURNS
+        regulate() result if it corrected, None otherwise
+        '''
+        with self.lock:
+            if self.target is None or self.mode is None:
+                return None
+            vpk = self.measure()
+            line = self.model.fit(self.mode)
+            slope = line[0] if line is not None else AMP_DEFAULT_SLOPE
+            if abs(self.target - vpk) <= max(self.tolerance, slope / 2):
+                return None
+            self.corrections += 1
+            return self._regulate(self.target, self.mode)
+
+    def _run(self):
+        while not self._stop.wait(self.hold_period):
+            try:
+                result = self.check()
+            except _NAK_ERRORS:
+                self.errors += 1
+                continue
+            if result is not None and self.on_correct is not None:
+                self.on_correct(result)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='amp_hold', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+def print_result(result):
+    if result['vpk'] is None:
+        print(f"\tAMP not measured (target {result['target']:.3f}, {result['mode']}), code {result['code']}")
+        return
+    status = 'converged' if result['converged'] else 'NOT converged'
+    print(f"\tAMP {status}: {result['vpk']:.3f} Vpk (target {result['target']:.3f}, {result['mode']}) "
+          f"at code {result['code']} in {result['time'] * 1e3:.1f} ms, "
+          f"{result['writes']} pot writes, {result['samples']} peak samples")
@@ -0,0 +1,205 @@
+'''
+    DESCRIPTION:
+        Batch mode for the function generator configurators. A script (a file
+        or stdin) is a list of commands, one per line, '#' starts a comment:
+
+            sq_tri <rc> <fdbk> <freq>   same as a config_sq_tri() input line
+            sin <rc> <amp> <freq>       same as a config_sine() input line
+            pot <name> <code>           one pot, by its final.POTS name
+            freq <sin|sq_tri> <freq>    capacitor bank only, freq is low, mid or high
+            dwell <seconds>             wait, dwells add up from the start of the run
+            measure [label]             read the ADS and log the voltages, the rest
+                                        of the line is the label
+
+        The whole script is parsed and checked before anything is written, so
+        a typo on the last line does not leave the board half configured.
+        Writes between two dwell/measure lines are then coalesced: only the
+        last code per pot or pin is kept, codes the device already holds are
+        dropped, and the pots are written with one mux channel select per
+        channel (generator_state.write_wipers).
+
+        Dwells are scheduled against absolute deadlines from the start of the
+        run, so bus and ADC time does not accumulate into the sequence timing.
+
+    EXPECTED:
+        One CSV row per measure: script line, label, scheduled and actual time
+        since the start in seconds, V_REG_IN, I_REG_IN and PEAK_IN.
+'''
+import csv
+import time
+
+# Last part of a dwell is spun instead of slept, sleep() overshoots by ~1 ms
+SPIN_TIME = 0.002
+
+
+def parse_script(lines, pot_names, configurators, freq_pins, pot_min=0, pot_max=127):
+    '''
+    Parses and checks a whole script.
+    INPUTS
+    lines: script text lines
+    pot_names: valid pot names for 'pot'
+    configurators: {name: (first pot names, second pot names)} for the
+                   'sin' and 'sq_tri' shorthand lines
+    freq_pins: {configurator name: {freq mode: {GPIO pin name: bit}}}
+    pot_min, pot_max: wiper code range
+    RETURNS
+    list of commands, each a tuple starting with the script line number:
+        (line, 'pot', name, code)
+        (line, 'pin', pin, bit)
+        (line, 'freq', configurator, freq mode)
+        (line, 'dwell', seconds)
+        (line, 'measure', label)
+    Raises ValueError listing every bad line.
+    '''
+    commands = []
+    errors = []
+
+    def code(text, what):
+        value = int(text)
+        if not pot_min <= value <= pot_max:
+            raise ValueError(f"{what} must be between {pot_min} and {pot_max}")
+        return value
+
+    def freq(mode, text):
+        if text not in freq_pins[mode]:
+            raise ValueError(f"freq mode must be one of {', '.join(freq_pins[mode])}")
+        return [(line_num, 'pin', pin, bit) for pin, bit in freq_pins[mode][text].items()] + \
+            [(line_num, 'freq', mode, text)]
+
+    for line_num, line in enumerate(lines, start=1):
+        parts = line.split('#', 1)[0].split()
+        if not parts:
+            continue
+        command, args = parts[0].lower(), parts[1:]
+        try:
+            if command in configurators:
+                if len(args) != 3:
+                    raise ValueError(f"expected: {command} <rc> <pot> <freq>")
+                first, second = configurators[command]
+                rc_code = code(args[0], 'rc pot')
+                second_code = code(args[1], 'second pot')
+                pins = freq(command, args[2])
+                commands += [(line_num, 'pot', name, rc_code) for name in first]
+                commands += [(line_num, 'pot', name, second_code) for name in second]
+                commands += pins
+            elif command == 'pot':
+                if len(args) != 2:
+                    raise ValueError("expected: pot <name> <code>")
+                if args[0] not in pot_names:
+                    raise ValueError(f"unknown pot '{args[0]}', must be one of {', '.join(pot_names)}")
+                commands.append((line_num, 'pot', args[0], code(args[1], 'pot code')))
+            elif command == 'freq':
+                if len(args) != 2 or args[0] not in freq_pins:
+                    raise ValueError(f"expected: freq <{'|'.join(freq_pins)}> <freq>")
+                commands += freq(args[0], args[1])
+            elif command == 'dwell':
+                if len(args) != 1:
+                    raise ValueError("expected: dwell <seconds>")
+                seconds = float(args[0])
+                if seconds < 0:
+                    raise ValueError("dwell time cannot be negative")
+                commands.append((line_num, 'dwell', seconds))
+            elif command == 'measure':
+                commands.append((line_num, 'measure', ' '.join(args)))
+            else:
+                raise ValueError(f"unknown command '{command}'")
+        except ValueError as err:
+            errors.append(f"line {line_num} '{line.strip()}': {err}")
+
+    if errors:
+        raise ValueError("Script has errors:\n\t" + "\n\t".join(errors))
+    return commands
+
+
+def plan_script(commands, current=None):
+    '''
+    Coalesces the writes between dwell/measure lines.
+    INPUTS
+    commands: list from parse_script()
+    current: {('pot' or 'pin', name): value} already in the devices, if known
+    RETURNS
+    list of steps:
+        ('apply', {pot name: code}, {pin: bit}, {configurator: freq mode})
+    the freq modes in the order last set, so the last one is the configurator
+    the step leaves active,
+        ('dwell', seconds, line)
+        ('measure', label, line)
+    and the number of writes the script asked for
+    '''
+    current = dict(current or {})
+    steps = []
+    pending = {}
+    freq_modes = {}
+    requested = 0
+
+    def flush():
+        writes = {key: value for key, value in pending.items() if current.get(key) != value}
+        current.update(writes)
+        if writes or freq_modes:
+            pots = {name: value for (kind, name), value in writes.items() if kind == 'pot'}
+            pins = {name: value for (kind, name), value in writes.items() if kind == 'pin'}
+            steps.append(('apply', pots, pins, dict(freq_modes)))
+        pending.clear()
+        freq_modes.clear()
+
+    for command in commands:
+        line_num, kind = command[0], command[1]
+        if kind in ('pot', 'pin'):
+            pending[(kind, command[2])] = command[3]
+            requested += 1
+        elif kind == 'freq':
+            # Re-inserted so the dict keeps the order the modes were last set
+            freq_modes.pop(command[2], None)
+            freq_modes[command[2]] = command[3]
+        else:
+            flush()
+            steps.append((kind, command[2], line_num))
+    flush()
+    return steps, requested
+
+
+def wait_until(deadline, clock=time.perf_counter, sleep=time.sleep):
+    remaining = deadline - clock()
+    if remaining > SPIN_TIME:
+        sleep(remaining - SPIN_TIME)
+    while clock() < deadline:
+        pass
+
+
+def run_plan(steps, apply, measure, log=None, clock=time.perf_counter, sleep=time.sleep):
+    '''
+    Runs a plan from plan_script().
+    INPUTS
+    apply: function(pots, pins, freq_modes) writing one coalesced step
+    measure: function() returning (v_reg, i_reg, peak)
+    log: open file for the measurement CSV, or None
+    RETURNS
+    dict with the pot and pin writes issued, measurements taken, the
+    worst lateness of a dwell deadline and the total run time, in seconds
+    '''
+    stats = {'pot_writes': 0, 'pin_writes': 0, 'measurements': 0, 'max_late': 0.0, 'run_time': 0.0}
+    writer = None
+    if log is not None:
+        # Labels are free text, the csv writer quotes commas and quotes in them
+        writer = csv.writer(log, lineterminator='\n')
+        writer.writerow(['Line', 'Label', 'Scheduled', 'Time', 'V_REG_IN', 'I_REG_IN', 'PEAK_IN'])
+    start = clock()
+    scheduled = 0.0
+    for step in steps:
+        kind = step[0]
+        if kind == 'apply':
+            apply(step[1], step[2], step[3])
+            stats['pot_writes'] += len(step[1])
+            stats['pin_writes'] += len(step[2])
+        elif kind == 'dwell':
+            scheduled += step[1]
+            wait_until(start + scheduled, clock, sleep)
+            stats['max_late'] = max(stats['max_late'], clock() - start - scheduled)
+        else:
+            now = clock() - start
+            v_reg, i_reg, peak = measure()
+            stats['measurements'] += 1
+            if writer is not None:
+                writer.writerow([step[2], step[1], scheduled, now, v_reg, i_reg, peak])
+    stats['run_time'] = clock() - start
+    return stats
@@ -1,12 +1,16 @@
-import board
-import busio
-import digitalio
-import time
+import contextlib
+import os
 import sys
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
-import adafruit_ds3502
-import adafruit_tca9548a
+import threading
+from datetime import datetime
+from hw_backend import get_backend
+import generator_state
+import batch_script
+import amp_regulator
+import health_monitor
+# Shared helpers live in ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from loop_profiler import LoopProfiler
 
 ''' NOTE: YOU might need to run the following commands:
     See: https://learn.adafruit.com/circuitpython-libraries-on-any-computer-with-mcp2221/windows
@@ -34,15 +38,45 @@ ADDR_SIN3 =         0x2A
 ADDR_AMP =          0x2B
 CHAN_SIN =          1
 
+# Pot name: (mux channel, address), names are used in the saved generator state
+POTS = {
+    'sq_tri_rc':    (CHAN_SQR_TRI, ADDR_SQ_TRI_RC),
+    'sq_tri_fbk':   (CHAN_SQR_TRI, ADDR_SQ_TRI_FBK),
+    'sin1':         (CHAN_SIN, ADDR_SIN1),
+    'sin2':         (CHAN_SIN, ADDR_SIN2),
+    'sin3':         (CHAN_SIN, ADDR_SIN3),
+    'amp':          (CHAN_SIN, ADDR_AMP),
+}
+
 POT_MIN_BIT = 0
 POT_MAX_BIT = 127
 V_REG_OFFSET = 0.25
 V_REG_MULT = 2
 ADS_GAIN = 2 / 3
 
-ADS_CHAN_V_REG = ADS.P0
-ADS_CHAN_I_REG = ADS.P1
-ADS_CHAN_PEAK  = ADS.P2
+# ADS single-ended inputs, same values as ADS.P0 - ADS.P3
+ADS_CHAN_V_REG = 0
+ADS_CHAN_I_REG = 1
+ADS_CHAN_PEAK  = 2
+ADS_CHAN_UNUSED = 3
+
+# 'hardware' for the MCP2221 board, 'sim' for the in-memory simulated board
+BACKEND = os.environ.get('EE90_BACKEND', 'hardware')
+
+PROFILE_CONFIG = True   # Time each configurator command, report on 'exit'
+RESTORE_STATE = True    # Restore the last applied configuration on startup
+HEALTH_MONITOR = False  # Watch V_REG_IN and I_REG_IN in the background from the start, else on 'health'
+AMP_HOLD = False        # Keep a held sine target Vpk regulated in the background while the menu runs
+
+# Supply limits for the health monitor alerts: 5V +-5%, current sensor range in A
+HEALTH_LIMITS = {
+    'v_reg':    (4.75, 5.25),
+    'i_reg':    (-1.0, 1.0),
+}
+
+# ADS conversions are a config write then a result read, hold this around
+# them so the health monitor thread and the configurators do not interleave
+ADC_LOCK = threading.Lock()
 
 '''
     DESCRIPTION:
@@ -53,9 +87,10 @@ ADS_CHAN_PEAK  = ADS.P2
 def curr_sens_conv(curr_volt):
     vs = 3.3
     s = 0.2
-    return (curr_volt - (vs * 0.5) / s)
+    # Zero current sits at VS/2, then S V/A
+    return (curr_volt - vs * 0.5) / s
 
-def test_adc(i2c):
+def test_adc(i2c, backend):
     '''
     DESCRIPTION:
         Tests the ADC by reading in the channel voltages.
@@ -70,13 +105,12 @@ def test_adc(i2c):
     '''
     
     # ADS setup
-    ads = ADS.ADS1115(i2c)
-    ads.gain = ADS_GAIN
-    # Channel read
-    chan0 = AnalogIn(ads, ADS_CHAN_V_REG)
-    chan1 = AnalogIn(ads, ADS_CHAN_I_REG)
-    chan2 = AnalogIn(ads, ADS_CHAN_PEAK)
-    chan3 = AnalogIn(ads, ADS.P3)
+    ads = backend.ads1115(i2c, ADS_GAIN)
+    # Channel read, each conversion under ADC_LOCK so the health monitor does not interleave
+    chan0 = LockedAnalogIn(backend.analog_in(ads, ADS_CHAN_V_REG))
+    chan1 = LockedAnalogIn(backend.analog_in(ads, ADS_CHAN_I_REG))
+    chan2 = LockedAnalogIn(backend.analog_in(ads, ADS_CHAN_PEAK))
+    chan3 = LockedAnalogIn(backend.analog_in(ads, ADS_CHAN_UNUSED))
     print((
         "ADC readings:\n"
         f"\tA0 - V_REG_IN: {chan0.voltage * V_REG_MULT}\n"
@@ -85,15 +119,48 @@ def test_adc(i2c):
         f"\tA3 - UNUSED:    {chan3.voltage}\n"
     ))
 
+'''
+    DESCRIPTION:
+        Reads the three used channel voltages from the ADS.
+        Returns V_REG_IN (scaled back up by V_REG_MULT), the raw I_REG_IN
+        sensor voltage and PEAK_IN.
+'''
+def adc_read(ads, backend):
+    with ADC_LOCK:
+        v_reg = backend.analog_in(ads, ADS_CHAN_V_REG).voltage * V_REG_MULT
+        i_reg = backend.analog_in(ads, ADS_CHAN_I_REG).voltage
+        peak = backend.analog_in(ads, ADS_CHAN_PEAK).voltage 
+    return v_reg, i_reg, peak
+
+'''
+    DESCRIPTION:
+        Reads V_REG_IN in V and I_REG_IN in A, for the health monitor.
+'''
+def supply_read(ads, backend):
+    with ADC_LOCK:
+        v_reg = backend.analog_in(ads, ADS_CHAN_V_REG).voltage * V_REG_MULT
+        i_reg = curr_sens_conv(backend.analog_in(ads, ADS_CHAN_I_REG).voltage)
+    return v_reg, i_reg
+
+class LockedAnalogIn:
+    '''
+    ADC channel whose reads hold ADC_LOCK.
+    '''
+    def __init__(self, channel):
+        self.channel = channel
+
+    @property
+    def voltage(self):
+        with ADC_LOCK:
+            return self.channel.voltage
+
 '''
     DESCRPITION:
         Prints out all three channel values from the ADS.
 '''
-def adc_print(ads):
+def adc_print(ads, backend):
     # Channel read
-    v_reg = AnalogIn(ads, ADS_CHAN_V_REG).voltage * V_REG_MULT
-    i_reg = AnalogIn(ads, ADS_CHAN_I_REG).voltage
-    peak = AnalogIn(ads, ADS_CHAN_PEAK).voltage 
+    v_reg, i_reg, peak = adc_read(ads, backend)
     print((
         f"A0 - V_REG_IN: {v_reg}\n"
         f"A1 - I_REG_IN: {curr_sens_conv(i_reg)}\n"
@@ -107,7 +174,7 @@ def adc_print(ads):
 def is_valid_binary_input(user_input):
     return len(user_input) == 4 and all(char in ('0', '1') for char in user_input)
 
-def test_gpio():
+def test_gpio(backend, bits=None):
     '''
     DESCRIPTION:
         Tests MCP2221 GPIO Pins by initializing and writing all pins HIGH
@@ -129,19 +196,20 @@ def test_gpio():
     
         SINBIT0 should modify SIN_CAP1_0, SIN_CAP2_0, SIN_CAP3_0
         SINBIT1 should modify SIN_CAP1_1, SIN_CAP2_1, SIN_CAP3_1
+
+        Pass bits (e.g. '1010') to skip the prompt when running headless.
     '''
     # Setup GPIO
-    gpio0 = digitalio.DigitalInOut(board.G0)
-    gpio1 = digitalio.DigitalInOut(board.G1)
-    gpio2 = digitalio.DigitalInOut(board.G2)
-    gpio3 = digitalio.DigitalInOut(board.G3)
-    gpio0.direction = digitalio.Direction.OUTPUT
-    gpio1.direction = digitalio.Direction.OUTPUT
-    gpio2.direction = digitalio.Direction.OUTPUT
-    gpio3.direction = digitalio.Direction.OUTPUT
-
-    print("Enter GPIO 0 - 3 binary digits (0 or 1). Press Ctrl+C to quit.")
-    user_input = input("Input:").strip()
+    gpio0 = backend.gpio_output('G0')
+    gpio1 = backend.gpio_output('G1')
+    gpio2 = backend.gpio_output('G2')
+    gpio3 = backend.gpio_output('G3')
+
+    if bits is None:
+        print("Enter GPIO 0 - 3 binary digits (0 or 1). Press Ctrl+C to quit.")
+        user_input = input("Input:").strip()
+    else:
+        user_input = bits
     if is_valid_binary_input(user_input):
         vals = [int(bit) for bit in user_input]
         # Write to the GPIO.
@@ -176,14 +244,14 @@ def test_gpio():
             Channel 0: 0x28, 0x29
             Channel 1: 0x28, 0x29, 0x2A, 0x2B
 '''
-def test_i2c(i2c):
+def test_i2c(i2c, backend):
     # Scan i2c addresses on the MCP2221 
     # Should find 0x48 (ADS), 0x70 (TCA)
     if i2c.try_lock():
         print("MCP2221 found addresses:", [hex(addr) for addr in i2c.scan()])
         i2c.unlock()
     
-    tca = adafruit_tca9548a.TCA9548A(i2c)
+    tca = backend.tca9548a(i2c)
     # Now scan addresses on each channel.
     if tca[CHAN_SQR_TRI].try_lock():
         print(f"\tMux channel {CHAN_SQR_TRI} found:", end="")
@@ -198,7 +266,7 @@ def test_i2c(i2c):
         tca[CHAN_SIN].unlock()
     print("\n")
 
-def test_pot_old(i2c):
+def test_pot_old(i2c, backend):
     '''
     DESCRIPTION:
         Tests the digital pots by initializing and writing all pot values to 64
@@ -211,17 +279,17 @@ def test_pot_old(i2c):
         Should check input to pots if the addresses are correct.
     '''
     # Mux setup
-    tca = adafruit_tca9548a.TCA9548A(i2c)
+    tca = backend.tca9548a(i2c)
     # Get the buses
     sq_tri_bus = tca[CHAN_SQR_TRI]
     sin_bus = tca[CHAN_SIN]
     # Setup potentiometer connection
-    pot_sq_tri_rc =     adafruit_ds3502.DS3502(sq_tri_bus, address=ADDR_SQ_TRI_RC)
-    pot_sq_tr_fbk =     adafruit_ds3502.DS3502(sq_tri_bus, address=ADDR_SQ_TRI_FBK)
-    pot_sin1 =          adafruit_ds3502.DS3502(sin_bus, address=ADDR_SIN1)
-    pot_sin2 =          adafruit_ds3502.DS3502(sin_bus, address=ADDR_SIN2)
-    pot_sin3 =          adafruit_ds3502.DS3502(sin_bus, address=ADDR_SIN3)
-    pot_amp  =          adafruit_ds3502.DS3502(sin_bus, address=ADDR_AMP)
+    pot_sq_tri_rc =     backend.ds3502(sq_tri_bus, ADDR_SQ_TRI_RC)
+    pot_sq_tr_fbk =     backend.ds3502(sq_tri_bus, ADDR_SQ_TRI_FBK)
+    pot_sin1 =          backend.ds3502(sin_bus, ADDR_SIN1)
+    pot_sin2 =          backend.ds3502(sin_bus, ADDR_SIN2)
+    pot_sin3 =          backend.ds3502(sin_bus, ADDR_SIN3)
+    pot_amp  =          backend.ds3502(sin_bus, ADDR_AMP)
     # Set the potentiometer value
     pot_sq_tri_rc.wiper = 64
     pot_sq_tr_fbk.wiper = 64
@@ -236,15 +304,28 @@ sq_tri_freq_map =  {
     'high': [0,0]
 }
 
-def config_sq_tri(sw_pot, fdbk_pot, sq_tri_cap0, sq_tri_cap1, ads):
+'''
+    DESCRIPTION:
+        Writes the square/triangle RC and feedback pots.
+'''
+def set_sq_tri_pots(sw_pot, fdbk_pot, sw_pot_val, fdbk_pot_val):
+    sw_pot.wiper = sw_pot_val
+    fdbk_pot.wiper = fdbk_pot_val
+
+def config_sq_tri(sw_pot, fdbk_pot, sq_tri_cap0, sq_tri_cap1, ads, backend, state=None):
     '''
     Tests the square and triangle wave outputs.
+    Applied settings are saved to state, if given.
     '''
+    profiler = LoopProfiler(enabled=PROFILE_CONFIG)
     while True:
         try:
             user_input = input("Sq/Tri configurator: Enter RC pot (0–127), FDBK pot (0-127), Freq mode (low, mid, high) or 'exit': ").strip()
+            profiler.start()
             if user_input.lower() == 'exit':
                 print("Exiting.")
+                if PROFILE_CONFIG:
+                    profiler.print_report()
                 break
 
             # Split and parse the input
@@ -274,15 +355,24 @@ def config_sq_tri(sw_pot, fdbk_pot, sq_tri_cap0, sq_tri_cap1, ads):
             
             cap0 = sq_tri_freq_map[freq_mode][0]
             cap1 = sq_tri_freq_map[freq_mode][1]
+            profiler.lap('parse')
 
             # Set values
-            sw_pot.wiper = sw_pot_val
-            fdbk_pot.wiper = fdbk_pot_val
+            set_sq_tri_pots(sw_pot, fdbk_pot, sw_pot_val, fdbk_pot_val)
+            profiler.lap('pot_write')
             sq_tri_cap0.value = cap0
             sq_tri_cap1.value = cap1
+            profiler.lap('gpio_write')
+            if state is not None:
+                generator_state.record(state, 'sq_tri', freq_mode,
+                                       pots={'sq_tri_rc': sw_pot_val, 'sq_tri_fbk': fdbk_pot_val},
+                                       caps={'G2': cap0, 'G3': cap1})
+                profiler.lap('save_state')
             # Print updated values and ADS readings.
             print(f"\tSW_POT: {sw_pot_val} \n\tFDBK_POT:{fdbk_pot_val} \n\tCAP1: {cap1} \n\tCAP0: {cap0}\n")
-            adc_print(ads)
+            adc_print(ads, backend)
+            profiler.lap('adc_print')
+            profiler.end()
         # Handle faulty output
         except ValueError:
             print("Invalid input. Format: <RC_POT 0–127> <FBK_POT 0-127> <Freq mode (low/mid/high)")
@@ -293,14 +383,27 @@ sine_freq_map = {
     'high': [0,1]
 }
 
-def config_sine(rc_pots, amp_pot, sine_cap0, sine_cap1,ads):
+'''
+    DESCRIPTION:
+        Writes the three sine RC pots to the same value, then the amplitude pot.
+'''
+def set_sine_pots(rc_pots, amp_pot, rc_pot_val, amp_pot_val):
+    for rc_pot in rc_pots:
+        rc_pot.wiper = rc_pot_val
+    amp_pot.wiper = amp_pot_val
+
+def config_sine(rc_pots, amp_pot, sine_cap0, sine_cap1, ads, backend, state=None, regulator=None):
+    profiler = LoopProfiler(enabled=PROFILE_CONFIG)
     while True:
         try:
             # Get main user input
             user_input = input("Sin configurator: Enter RC pot (0-127), Amp pot (0-127), and freq mode (low, mid, high) or 'exit': ").strip()
+            profiler.start()
 
             if user_input.lower() == 'exit':
                 print("Exiting.")
+                if PROFILE_CONFIG:
+                    profiler.print_report()
                 break
 
             else:
@@ -322,57 +425,259 @@ def config_sine(rc_pots, amp_pot, sine_cap0, sine_cap1,ads):
                 
                 cap0 = sine_freq_map[freq_mode][0]
                 cap1 = sine_freq_map[freq_mode][1]
-
-                for rc_pot in rc_pots:
-                    rc_pot.wiper = rc_pot_val
-                amp_pot.wiper = amp_pot_val
-                sine_cap0.value = cap0
-                sine_cap1.value = cap1
+                profiler.lap('parse')
+
+                # The regulator's lock keeps its background hold off a half applied configuration
+                with regulator.lock if regulator is not None else contextlib.nullcontext():
+                    set_sine_pots(rc_pots, amp_pot, rc_pot_val, amp_pot_val)
+                    profiler.lap('pot_write')
+                    sine_cap0.value = cap0
+                    sine_cap1.value = cap1
+                    profiler.lap('gpio_write')
+                    if regulator is not None:
+                        # A new amp code set by hand ends a held target Vpk, otherwise it is held in the new mode
+                        if amp_pot_val != regulator.code:
+                            regulator.release()
+                        result = regulator.hold(freq_mode)
+                        if result is not None:
+                            amp_regulator.print_result(result)
+                            amp_pot_val = result['code']
+                        profiler.lap('amp_hold')
+                if state is not None:
+                    if regulator is not None:
+                        state['amp_model'] = regulator.model.to_dict()
+                        state['amp_target'] = regulator.target
+                    else:
+                        state['amp_target'] = None
+                    generator_state.record(state, 'sin', freq_mode,
+                                           pots={'sin1': rc_pot_val, 'sin2': rc_pot_val, 'sin3': rc_pot_val,
+                                                 'amp': amp_pot_val},
+                                           caps={'G0': cap0, 'G1': cap1})
+                    profiler.lap('save_state')
                 print(f"\tRC_POT: {rc_pot_val} \n\tAMP_POT: {amp_pot.wiper} \n\tCAP_1: {cap1} \n\tCAP_0: {cap0}\n")
                 
-                adc_print(ads)
+                adc_print(ads, backend)
+                profiler.lap('adc_print')
+                profiler.end()
 
         # Handle faulty output
         except ValueError:
             print("Invalid input. Format: <RC_POT 0–127> <AMP_POT 0-127> <Freq mode (low/mid/high)")
         
-def run_all_tests(i2c):
-    test_gpio()
-    test_i2c(i2c)
-    test_pot_old(i2c)
-    test_adc(i2c)
+'''
+    DESCRIPTION:
+        Switches the sine capacitor bank and regulates the peak to target Vpk,
+        which the regulator then holds across frequency mode changes. The code,
+        target and amplitude model are saved to state, if given.
+'''
+def set_sine_amplitude(regulator, target, freq_mode, sine_cap0, sine_cap1, state=None):
+    cap0 = sine_freq_map[freq_mode][0]
+    cap1 = sine_freq_map[freq_mode][1]
+    sine_cap0.value = cap0
+    sine_cap1.value = cap1
+    result = regulator.regulate(target, freq_mode)
+    amp_regulator.print_result(result)
+    if state is not None:
+        state['amp_model'] = regulator.model.to_dict()
+        state['amp_target'] = target
+        generator_state.record(state, 'sin', freq_mode, pots={'amp': result['code']},
+                               caps={'G0': cap0, 'G1': cap1})
+    return result
+
+def config_amp(regulator, sine_cap0, sine_cap1, state=None):
+    '''
+    Holds the sine amplitude at a target peak voltage across frequency modes.
+    '''
+    while True:
+        try:
+            user_input = input("Amp regulator: Enter target Vpk and freq mode (low, mid, high) or 'exit': ").strip()
+            if user_input.lower() == 'exit':
+                print(f"Exiting. {regulator.writes} pot writes, {regulator.samples_taken} peak samples in total.")
+                break
 
-def main():
-    #I2C 
-    i2c = board.I2C()
+            parts = user_input.split()
+            if len(parts) != 2:
+                print("Please enter values: target_vpk freq_mode")
+                continue
+            target = float(parts[0])
+            freq_mode = parts[1]
+            if target <= 0:
+                print("Target Vpk must be positive.")
+                continue
+            if freq_mode not in sine_freq_map:
+                print("Freq mode must be: low, mid, or high.")
+                continue
+            set_sine_amplitude(regulator, target, freq_mode, sine_cap0, sine_cap1, state)
+        # Handle faulty output
+        except ValueError:
+            print("Invalid input. Format: <Target Vpk> <Freq mode (low/mid/high)>")
 
-    # Comment this out to stop setup tests.
-    # run_all_tests(i2c)
+# Batch script shorthands: configurator -> (RC pot names, FDBK/AMP pot names)
+BATCH_CONFIGURATORS = {
+    'sq_tri':   (('sq_tri_rc',), ('sq_tri_fbk',)),
+    'sin':      (('sin1', 'sin2', 'sin3'), ('amp',)),
+}
+# Configurator -> {freq mode: {GPIO pin: bit}}, CAP0/CAP1 as in the configurators
+BATCH_FREQ_PINS = {
+    'sq_tri':   {mode: {'G2': bits[0], 'G3': bits[1]} for mode, bits in sq_tri_freq_map.items()},
+    'sin':      {mode: {'G0': bits[0], 'G1': bits[1]} for mode, bits in sine_freq_map.items()},
+}
+
+def run_batch(gen, lines, log_path=None):
+    '''
+    DESCRIPTION:
+        Runs a configurator script, see batch_script.py for the commands.
+        The script is checked before anything is written, the measurements
+        are logged to a CSV and the final configuration is saved to the state.
+        A target Vpk held by the amp regulator is regulated again after each
+        sine frequency mode change, until the script sets the amp pot itself.
+    EXPECTED:
+        dict with the writes requested and issued, measurements and timing
+    '''
+    commands = batch_script.parse_script(lines, list(POTS), BATCH_CONFIGURATORS, BATCH_FREQ_PINS,
+                                         POT_MIN_BIT, POT_MAX_BIT)
+    state = gen['state']
+    # setup() has brought the pots and pins to the saved state
+    current = {('pot', name): code for name, code in state['pots'].items()}
+    current.update({('pin', pin): bit for pin, bit in state['caps'].items()})
+    regulator = gen['amp_regulator']
+    if regulator.target is not None:
+        # Holding moves the amp pot behind the plan, so always issue its first write
+        current.pop(('pot', 'amp'), None)
+    steps, requested = batch_script.plan_script(commands, current)
+
+    applied = {'pots': {}, 'caps': {}, 'freq_mode': {}, 'mode': None}
+    def apply(pots, pins, freq_modes):
+        # The regulator's lock keeps its background hold off a half applied step
+        with regulator.lock:
+            failed = generator_state.write_wipers(gen['buses'], POTS, pots) if pots else []
+            for pin, bit in pins.items():
+                gen['gpios'][pin].value = bit
+            # A new amp code ends a held target Vpk, otherwise it is held in the new mode
+            if 'amp' in pots and pots['amp'] != regulator.code:
+                regulator.release()
+            result = regulator.hold(freq_modes['sin']) if 'sin' in freq_modes else None
+        if failed:
+            print(f"\tPots did not answer, not applied: {', '.join(failed)}")
+        applied['pots'].update({name: code for name, code in pots.items() if name not in failed})
+        applied['caps'].update(pins)
+        applied['freq_mode'].update(freq_modes)
+        if freq_modes:
+            # Modes come in the order they were set, the last is the active configurator
+            applied['mode'] = list(freq_modes)[-1]
+        if result is not None:
+            amp_regulator.print_result(result)
+            applied['pots']['amp'] = result['code']
+
+    if log_path is None:
+        log_path = 'batch_data' + datetime.now().strftime("_%Y_%m_%d_%H_%M_%S") + '.csv'
+    with open(log_path, 'w') as log:
+        stats = batch_script.run_plan(steps, apply, lambda: adc_read(gen['ads'], gen['backend']), log)
+
+    state['pots'].update(applied['pots'])
+    state['caps'].update(applied['caps'])
+    state['freq_mode'].update(applied['freq_mode'])
+    if applied['mode'] is not None:
+        state['mode'] = applied['mode']
+    state['amp_model'] = regulator.model.to_dict()
+    state['amp_target'] = regulator.target
+    generator_state.save_state(state)
+
+    stats['requested'] = requested
+    print(f"Batch: {requested} writes requested, {stats['pot_writes']} pot and {stats['pin_writes']} "
+          f"GPIO writes issued, {stats['measurements']} measurements in {stats['run_time']:.3f} s "
+          f"(worst dwell {stats['max_late'] * 1e3:.2f} ms late), logged to {log_path}")
+    return stats
+
+def run_all_tests(i2c, backend, gpio_bits=None):
+    test_gpio(backend, gpio_bits)
+    test_i2c(i2c, backend)
+    test_pot_old(i2c, backend)
+    test_adc(i2c, backend)
+
+def setup(backend_name=BACKEND):
+    '''
+    DESCRIPTION:
+        Opens the generator hardware through the backend and warm starts it
+        from the saved state.
+    EXPECTED:
+        dict with the backend, i2c bus, ads, GPIO outputs (G0-G3), mux buses,
+        pots by name and the generator state
+    '''
+    backend = get_backend(backend_name)
+    #I2C 
+    i2c = backend.i2c()
 
     # ADS setup
-    ads = ADS.ADS1115(i2c)
-    ads.gain = ADS_GAIN
+    ads = backend.ads1115(i2c, ADS_GAIN)
 
     # Setup GPIO
-    gpio0 = digitalio.DigitalInOut(board.G0)
-    gpio1 = digitalio.DigitalInOut(board.G1)
-    gpio2 = digitalio.DigitalInOut(board.G2)
-    gpio3 = digitalio.DigitalInOut(board.G3)
-    gpio0.direction = digitalio.Direction.OUTPUT
-    gpio1.direction = digitalio.Direction.OUTPUT
-    gpio2.direction = digitalio.Direction.OUTPUT
-    gpio3.direction = digitalio.Direction.OUTPUT
+    gpios = {pin: backend.gpio_output(pin) for pin in ('G0', 'G1', 'G2', 'G3')}
     
     # Setup mux. These are the pots that currently work
-    tca =               adafruit_tca9548a.TCA9548A(i2c)
-    sq_tri_bus =        tca[CHAN_SQR_TRI]
-    sin_bus =           tca[CHAN_SIN]
-    pot_sq_tri_rc =     adafruit_ds3502.DS3502(sq_tri_bus, address=ADDR_SQ_TRI_RC)
-    pot_sq_tri_fbk =    adafruit_ds3502.DS3502(sq_tri_bus, address=ADDR_SQ_TRI_FBK)
-    pot_sin1 =          adafruit_ds3502.DS3502(sin_bus,    address=ADDR_SIN1)
-    pot_sin2 =          adafruit_ds3502.DS3502(sin_bus,    address=ADDR_SIN2)
-    pot_sin3 =          adafruit_ds3502.DS3502(sin_bus,    address=ADDR_SIN3)
-    pot_amp  =          adafruit_ds3502.DS3502(sin_bus,    address=ADDR_AMP)
+    tca =               backend.tca9548a(i2c)
+    buses =             {CHAN_SQR_TRI: tca[CHAN_SQR_TRI], CHAN_SIN: tca[CHAN_SIN]}
+    pots =              {name: backend.ds3502(buses[chan], addr) for name, (chan, addr) in POTS.items()}
+
+    # Warm start from the last applied configuration
+    state = generator_state.load_state() if RESTORE_STATE else None
+    if state is not None:
+        restored = generator_state.restore_state(state, buses, POTS, gpios)
+        print(f"Restored last '{state['mode']}' configuration: {restored['written']} pots written, "
+              f"{restored['matched']} already matched")
+        if restored['failed']:
+            print(f"Pots did not answer, not restored: {', '.join(restored['failed'])}")
+            # Unknown wiper codes, so the next configuration writes them again
+            for name in restored['failed']:
+                del state['pots'][name]
+    else:
+        state = generator_state.new_state()
+
+    # Amplitude regulator, starting from the amplitude model and held target saved last time
+    regulator = amp_regulator.AmplitudeRegulator(pots['amp'], LockedAnalogIn(backend.analog_in(ads, ADS_CHAN_PEAK)),
+                                                 amp_regulator.AmplitudeModel(state.get('amp_model')),
+                                                 state.get('amp_target'), state['freq_mode'].get('sin'),
+                                                 on_correct=amp_regulator.print_result)
+
+    # Supply monitor, started with start_health()
+    health = health_monitor.HealthMonitor(lambda: supply_read(ads, backend), ('v_reg', 'i_reg'), HEALTH_LIMITS)
+
+    return {'backend': backend, 'i2c': i2c, 'ads': ads, 'gpios': gpios,
+            'buses': buses, 'pots': pots, 'state': state, 'amp_regulator': regulator,
+            'health': health}
+
+def start_health(gen, log_path=None):
+    if log_path is None:
+        log_path = 'health_data' + datetime.now().strftime("_%Y_%m_%d_%H_%M_%S") + '.csv'
+    gen['health'].log_path = log_path
+    gen['health'].start()
+    print(f"Health monitor running, logging to {log_path}")
+
+def stop_health(gen):
+    gen['health'].stop()
+    gen['health'].print_status()
+
+def run_sq_tri(gen):
+    pots = gen['pots']
+    config_sq_tri(pots['sq_tri_rc'], pots['sq_tri_fbk'], gen['gpios']['G2'], gen['gpios']['G3'],
+                  gen['ads'], gen['backend'], gen['state'])
+
+def run_sine(gen):
+    pots = gen['pots']
+    config_sine([pots['sin1'], pots['sin2'], pots['sin3']], pots['amp'], gen['gpios']['G0'], gen['gpios']['G1'],
+                gen['ads'], gen['backend'], gen['state'], gen['amp_regulator'])
+
+def run_amp(gen):
+    config_amp(gen['amp_regulator'], gen['gpios']['G0'], gen['gpios']['G1'], gen['state'])
+
+def main(backend_name=BACKEND):
+    # Comment this out to stop setup tests.
+    # run_all_tests(i2c, backend)
+    gen = setup(backend_name)
+    if HEALTH_MONITOR:
+        start_health(gen)
+    if AMP_HOLD:
+        gen['amp_regulator'].start()
 
     while True:
         try:
@@ -380,23 +685,49 @@ def main():
                                "\t'tests': tests initialization and connection of digital components"
                                "\n\t'sin': configures the sine wave"
                                "\n\t'sq_tri': configures the square and triangle wave"
+                               "\n\t'amp': regulates the sine amplitude to a target peak voltage"
+                               "\n\t'save_defaults': stores the current pot settings as their power-up defaults"
+                               "\n\t'batch': runs a configurator script file"
+                               "\n\t'health': starts the supply monitor, then shows its statistics and alerts"
                                "\n\t'exit': exits the program\n")
            
             if user_input.lower() == 'exit':
                 print("Exiting.")
+                if gen['health'].running:
+                    stop_health(gen)
+                gen['amp_regulator'].stop()
                 sys.exit(0)
             
             elif user_input == 'sq_tri':
-                config_sq_tri(pot_sq_tri_rc, pot_sq_tri_fbk, gpio2, gpio3, ads)
+                run_sq_tri(gen)
             elif user_input == 'sin':
-                config_sine([pot_sin1, pot_sin2, pot_sin3], pot_amp, gpio0, gpio1, ads)
+                run_sine(gen)
+            elif user_input == 'amp':
+                run_amp(gen)
+            elif user_input == 'save_defaults':
+                generator_state.commit_defaults(gen['state'], gen['pots'])
+                print(f"Saved {len(gen['state']['pots'])} pot settings as power-up defaults.")
             elif user_input == 'tests':
-                run_all_tests(i2c)
+                run_all_tests(gen['i2c'], gen['backend'])
+            elif user_input == 'health':
+                # The monitor shares the bus with the configurators, so it only runs once asked for
+                if gen['health'].running:
+                    gen['health'].print_status()
+                else:
+                    start_health(gen)
+            elif user_input == 'batch':
+                script_path = input("Script file: ").strip()
+                try:
+                    with open(script_path, 'r') as file:
+                        run_batch(gen, file.readlines())
+                except (OSError, ValueError) as err:
+                    print(err)
             else:
                 raise ValueError
         # Handle faulty output
         except ValueError:
-            print("Invalid input. Enter 'tests', 'sin', 'sq_tri', or 'exit'")
+            print("Invalid input. Enter 'tests', 'sin', 'sq_tri', 'amp', 'save_defaults', 'batch', 'health', or 'exit'")
 
 if __name__ == "__main__":
-    main()
+    # python final.py [hardware|sim]
+    main(sys.argv[1] if len(sys.argv) > 1 else BACKEND)
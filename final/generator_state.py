@@ -0,0 +1,176 @@
+'''
+    DESCRIPTION:
+        Snapshot of the last applied function generator configuration, so
+        final.py can warm start instead of the operator re-entering settings.
+
+        The snapshot holds the DS3502 wiper codes by pot name, the capacitor
+        bank GPIO bits and the last configurator mode with its frequency mode.
+        On startup the pots are read back once per mux channel and only those
+        that differ from the snapshot are written, again with one mux channel
+        select per channel. If the snapshot was also committed to the pots'
+        non-volatile IVR (commit_defaults), the pots power up already matching
+        and the restore does no pot writes at all.
+
+        Register access is raw DS3502 (WR at 0x00), see:
+            https://www.analog.com/media/en/technical-documentation/data-sheets/DS3502.pdf
+'''
+import json
+import os
+
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generator_state.json')
+STATE_VERSION = 1
+
+_DS3502_WR = 0x00
+# busio raises OSError for a NAK, the MCP2221 bridge RuntimeError
+_NAK_ERRORS = (OSError, RuntimeError)
+
+
+def new_state():
+    return {'version': STATE_VERSION, 'pots': {}, 'caps': {}, 'mode': None, 'freq_mode': {}}
+
+
+def load_state(file_path=None):
+    '''
+    Returns the saved snapshot, or None if there is none or it is unreadable.
+    file_path defaults to STATE_FILE at call time, so a process driving
+    another board can point STATE_FILE at its own snapshot.
+    '''
+    file_path = file_path or STATE_FILE
+    try:
+        with open(file_path, 'r') as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        return None
+    return state
+
+
+def save_state(state, file_path=None):
+    '''
+    Writes the snapshot, replacing the old file only once the new one is complete.
+    '''
+    file_path = file_path or STATE_FILE
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, file_path)
+
+
+def record(state, mode, freq_mode, pots=None, caps=None, file_path=None):
+    '''
+    Updates the snapshot after a configuration was applied and saves it.
+    INPUTS
+    mode: configurator that applied it, 'sin' or 'sq_tri'
+    freq_mode: 'low', 'mid' or 'high'
+    pots: {pot name: wiper code}
+    caps: {GPIO pin name: bit}
+    '''
+    state['mode'] = mode
+    state['freq_mode'][mode] = freq_mode
+    state['pots'].update(pots or {})
+    state['caps'].update(caps or {})
+    save_state(state, file_path)
+
+
+def _lock(bus):
+    while not bus.try_lock():
+        pass
+
+
+def read_wipers(buses, pot_map, names):
+    '''
+    Reads the wiper of every named pot, locking each mux channel once.
+    INPUTS
+    buses: {mux channel: bus}
+    pot_map: {pot name: (mux channel, address)}
+    RETURNS
+    {pot name: wiper code}, pots that did not answer are left out
+    '''
+    by_channel = {}
+    for name in names:
+        channel, address = pot_map[name]
+        by_channel.setdefault(channel, []).append((name, address))
+
+    codes = {}
+    buf = bytearray(1)
+    for channel, pots in by_channel.items():
+        bus = buses[channel]
+        _lock(bus)
+        try:
+            for name, address in pots:
+                try:
+                    bus.writeto_then_readfrom(address, bytes([_DS3502_WR]), buf)
+                except _NAK_ERRORS:
+                    continue
+                codes[name] = buf[0] & 0x7F
+        finally:
+            bus.unlock()
+    return codes
+
+
+def write_wipers(buses, pot_map, codes):
+    '''
+    Writes wiper codes, locking each mux channel once for all of its pots.
+    INPUTS
+    codes: {pot name: wiper code}
+    RETURNS
+    list of the pots that did not answer, as read_wipers() leaves them out
+    '''
+    by_channel = {}
+    for name, code in codes.items():
+        channel, address = pot_map[name]
+        by_channel.setdefault(channel, []).append((name, address, code))
+
+    failed = []
+    for channel, pots in by_channel.items():
+        bus = buses[channel]
+        _lock(bus)
+        try:
+            for name, address, code in pots:
+                try:
+                    bus.writeto(address, bytes([_DS3502_WR, code]))
+                except _NAK_ERRORS:
+                    failed.append(name)
+        finally:
+            bus.unlock()
+    return failed
+
+
+def restore_state(state, buses, pot_map, gpios):
+    '''
+    Brings the hardware to the snapshot, skipping pots that already match.
+    Pots that NAK the read-back or the write are skipped and reported, so a
+    transient NAK does not stop the warm start.
+    INPUTS
+    state: snapshot from load_state()
+    buses: {mux channel: bus}
+    pot_map: {pot name: (mux channel, address)}
+    gpios: {GPIO pin name: digital output}
+    RETURNS
+    dict with the pots read, written and already matching, and the list of
+    pots that failed
+    '''
+    wanted = {name: code for name, code in state['pots'].items() if name in pot_map}
+    current = read_wipers(buses, pot_map, wanted)
+    unread = [name for name in wanted if name not in current]
+    changed = {name: code for name, code in wanted.items() if name in current and current[name] != code}
+    unwritten = write_wipers(buses, pot_map, changed) if changed else []
+    # GPIO outputs cannot be read back before they are driven, always set them
+    for pin, bit in state['caps'].items():
+        if pin in gpios:
+            gpios[pin].value = bit
+    return {'read': len(current), 'written': len(changed) - len(unwritten),
+            'matched': len(current) - len(changed), 'failed': unread + unwritten}
+
+
+def commit_defaults(state, pots):
+    '''
+    Stores the snapshot's wiper codes in the pots' non-volatile IVR, so they
+    power up in this configuration.
+    INPUTS
+    pots: {pot name: DS3502 driver}
+    '''
+    for name, code in state['pots'].items():
+        if name in pots:
+            pots[name].set_default(code)
@@ -0,0 +1,190 @@
+'''
+    DESCRIPTION:
+        Background monitor of the generator supply, V_REG_IN and I_REG_IN.
+
+        A daemon thread samples the channels every HEALTH_PERIOD seconds and
+        keeps, per channel, constant-memory running statistics for the
+        current window of HEALTH_WINDOW samples and for the whole run (mean,
+        standard deviation, min, max and EWMA, see common/stream_stats.py).
+        Every sample is checked against the channel's limits, so a supply
+        droop while pots are being written is caught even if it only lasts a
+        sample or two; an alert is raised once when a channel leaves its
+        limits and cleared when it returns.
+
+    EXPECTED:
+        Log file, one CSV row per channel per closed window and one per alert:
+            Time,Event,Channel,Count,Mean,Std,Min,Max,EWMA
+        Event is 'window', 'low', 'high' or 'clear'. Alert rows hold the
+        offending sample in Mean/Min/Max.
+'''
+import os
+import sys
+import threading
+import time
+# Shared helpers live in ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from stream_stats import RunningStats
+
+HEALTH_PERIOD = 0.05    # s between samples
+HEALTH_WINDOW = 20      # samples per window, 1 s at HEALTH_PERIOD
+HEALTH_ALPHA = 0.1      # EWMA weight of a new sample
+
+# busio raises OSError for a NAK, the MCP2221 bridge RuntimeError
+_NAK_ERRORS = (OSError, RuntimeError)
+
+
+class HealthMonitor:
+    '''
+    Windowed running statistics and limit alerts for a set of channels.
+    INPUTS
+    read: function returning one value per channel, in channel order
+    channels: channel names
+    limits: {channel: (low, high)}, either bound may be None
+    log_path: CSV file written while running, or None
+    on_alert: function(message) called from the monitor thread
+    '''
+    def __init__(self, read, channels, limits=None, period=HEALTH_PERIOD, window=HEALTH_WINDOW,
+                 alpha=HEALTH_ALPHA, log_path=None, on_alert=print, clock=time.monotonic):
+        self.read = read
+        self.channels = tuple(channels)
+        self.limits = dict(limits or {})
+        self.period = period
+        self.window_size = window
+        self.log_path = log_path
+        self.on_alert = on_alert
+        self.clock = clock
+        self.window = {name: RunningStats(alpha) for name in self.channels}
+        self.total = {name: RunningStats(alpha) for name in self.channels}
+        self.alarm = {name: False for name in self.channels}
+        self.samples = 0
+        self.windows = 0
+        self.alerts = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self._log = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_time = clock()
+
+    def _log_row(self, now, event, name, count, mean, std, low, high, ewma):
+        if self._log is not None:
+            self._log.write(f"{now:.3f},{event},{name},{count},{mean:.5g},{std:.3g},{low:.5g},{high:.5g},{ewma:.5g}\n")
+
+    def _check(self, now, name, value):
+        low, high = self.limits.get(name, (None, None))
+        if low is not None and value < low:
+            event = 'low'
+        elif high is not None and value > high:
+            event = 'high'
+        else:
+            event = None
+        ewma = self.window[name].ewma
+        if event is not None and not self.alarm[name]:
+            self.alarm[name] = True
+            self.alerts += 1
+            self._log_row(now, event, name, 1, value, 0.0, value, value, ewma)
+            bound = low if event == 'low' else high
+            self.on_alert(f"[health] {name} {event}: {value:.4f} at {now:.2f} s (limit {bound})")
+        elif event is None and self.alarm[name]:
+            self.alarm[name] = False
+            self._log_row(now, 'clear', name, 1, value, 0.0, value, value, ewma)
+
+    def _close_window(self, now):
+        for name in self.channels:
+            window = self.window[name]
+            if window.count:
+                self.total[name].merge(window)
+                stats = window.summary()
+                self._log_row(now, 'window', name, stats['count'], stats['mean'], stats['std'],
+                              stats['min'], stats['max'], stats['ewma'])
+                window.reset()
+        self.windows += 1
+        if self._log is not None:
+            self._log.flush()
+
+    def sample(self):
+        '''
+        Takes one sample of every channel. Called by the monitor thread, or
+        directly to use the monitor without one.
+        '''
+        values = self.read()
+        now = self.clock() - self._start_time
+        with self.lock:
+            for name, value in zip(self.channels, values):
+                self.window[name].add(value)
+                self._check(now, name, value)
+            self.samples += 1
+            if self.window[self.channels[0]].count >= self.window_size:
+                self._close_window(now)
+
+    def _run(self):
+        next_time = self.clock()
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except _NAK_ERRORS:
+                self.errors += 1
+            next_time += self.period
+            delay = next_time - self.clock()
+            if delay < 0:
+                # Fell behind, e.g. the bus was busy, do not try to catch up
+                next_time = self.clock()
+                delay = 0
+            self._stop.wait(delay)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.log_path is not None:
+            self._log = open(self.log_path, 'w')
+            self._log.write('Time,Event,Channel,Count,Mean,Std,Min,Max,EWMA\n')
+        self._start_time = self.clock()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='health_monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        with self.lock:
+            # Partial last window
+            if self.window[self.channels[0]].count:
+                self._close_window(self.clock() - self._start_time)
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def status(self):
+        '''
+        RETURNS
+        {channel: {'window': ..., 'total': ..., 'alarm': bool}} with the
+        current window and whole-run summaries, the run including the open
+        window, plus the sample, window, alert and read error counts
+        '''
+        with self.lock:
+            status = {}
+            for name in self.channels:
+                total = RunningStats()
+                total.merge(self.total[name])
+                total.merge(self.window[name])
+                status[name] = {'window': self.window[name].summary(),
+                                'total': total.summary(),
+                                'alarm': self.alarm[name]}
+            status.update(samples=self.samples, windows=self.windows, alerts=self.alerts, errors=self.errors)
+        return status
+
+    def print_status(self):
+        status = self.status()
+        print(f"Health: {status['samples']} samples, {status['alerts']} alerts, {status['errors']} read errors")
+        for name in self.channels:
+            total = status[name]['total']
+            flag = '  ALARM' if status[name]['alarm'] else ''
+            print(f"\t{name:<6} mean {total['mean']:.4f}  std {total['std']:.4f}  "
+                  f"min {total['min']:.4f}  max {total['max']:.4f}  ewma {total['ewma']:.4f}{flag}")
@@ -0,0 +1,549 @@
+'''
+    DESCRIPTION:
+        Hardware backends for the EE 90 function generator scripts.
+
+        final.py builds every device through a backend instead of importing
+        board, digitalio and the adafruit drivers directly:
+            HardwareBackend - the real MCP2221 board, drivers imported on first use
+            SimBackend      - in-memory I2C bus with register models of the
+                              ADS1115, TCA9548A, DS3502 and CAT5132, plus GPIO pins
+
+        Both expose the same calls:
+            i2c()                       bus to hand to the other calls
+            gpio_output(pin)            digital output, pin is 'G0'...'G3'
+            ads1115(i2c, gain)          ADC
+            analog_in(ads, channel)     ADC channel with .voltage and .value
+            tca9548a(i2c)               mux, index it for the channel buses
+            ds3502(bus, address)        digipot with .wiper
+            cat5132(bus, address)       digipot with .wiper and .default_wiper
+
+        The simulated bus counts transactions per device so bus traffic of a
+        driver path can be measured without hardware.
+'''
+
+import threading
+import time
+from i2c_retry import retry
+
+BACKENDS = ('hardware', 'sim')
+
+ADDR_ADS = 0x48
+ADDR_TCA = 0x70
+ADDR_SIM_AMP = 0x2B
+
+# Simulated sine output: peak at full amplitude pot code, and the filter
+# passband gain for each capacitor bank setting (G0, G1)
+SIM_SINE_PEAK = 3.0
+SIM_SINE_GAIN = {(0, 0): 1.0, (1, 1): 0.85, (0, 1): 0.7, (1, 0): 0.6}
+
+
+class HardwareBackend:
+    name = 'hardware'
+
+    def i2c(self):
+        import board
+        return board.I2C()
+
+    def gpio_output(self, pin):
+        import board
+        import digitalio
+        gpio = digitalio.DigitalInOut(getattr(board, pin))
+        gpio.direction = digitalio.Direction.OUTPUT
+        return gpio
+
+    def ads1115(self, i2c, gain):
+        import adafruit_ads1x15.ads1115 as ADS
+        ads = ADS.ADS1115(i2c)
+        ads.gain = gain
+        return ads
+
+    def analog_in(self, ads, channel):
+        from adafruit_ads1x15.analog_in import AnalogIn
+        return AnalogIn(ads, channel)
+
+    def tca9548a(self, i2c):
+        import adafruit_tca9548a
+        return adafruit_tca9548a.TCA9548A(i2c)
+
+    def ds3502(self, bus, address):
+        import adafruit_ds3502
+        return adafruit_ds3502.DS3502(bus, address=address)
+
+    def cat5132(self, bus, address):
+        from CAT5132 import CAT5132
+        return CAT5132(bus, address)
+
+
+'''
+    Simulated bus and device register models.
+'''
+class SimDevice:
+    '''
+    Register-pointer I2C device: the first byte written sets the pointer,
+    following bytes are written from it, reads start at it.
+    '''
+    def __init__(self, address, num_regs=256):
+        self.address = address
+        self.regs = bytearray(num_regs)
+        self.pointer = 0
+        self.transactions = 0
+        # The device NAKs until this time.monotonic(), e.g. during a non-volatile write cycle
+        self.busy_until = 0.0
+
+    def write(self, data):
+        if not data:
+            return
+        self.pointer = data[0]
+        for offset, byte in enumerate(data[1:]):
+            self.write_reg(self.pointer + offset, byte)
+
+    def read(self, length):
+        return bytes(self.read_reg(self.pointer + offset) for offset in range(length))
+
+    def write_reg(self, reg, value):
+        self.regs[reg] = value
+
+    def read_reg(self, reg):
+        return self.regs[reg]
+
+
+class SimDS3502(SimDevice):
+    '''
+    DS3502: WR at 0x00 (7 bit), CR at 0x02. With CR bit 7 clear a wiper write
+    also goes to the non-volatile IVR, which is loaded into WR at power up.
+    '''
+    def __init__(self, address, ivr=64):
+        super().__init__(address)
+        self.ivr = ivr
+        self.regs[0x00] = ivr
+
+    @property
+    def wiper(self):
+        return self.regs[0x00]
+
+    def write_reg(self, reg, value):
+        if reg == 0x00:
+            self.regs[0x00] = value & 0x7F
+            if not self.regs[0x02] & 0x80:
+                self.ivr = value & 0x7F
+        else:
+            super().write_reg(reg, value)
+
+
+class SimCAT5132(SimDevice):
+    '''
+    CAT5132: the access register at 0x02 selects whether data address 0x00
+    reaches the volatile WCR (0x80) or the non-volatile DCR (0x00).
+    nv_write_time: seconds the part NAKs after a DCR write, for its write cycle
+    '''
+    def __init__(self, address, dcr=64, nv_write_time=0.0):
+        super().__init__(address)
+        self.dcr = dcr
+        self.wcr = dcr
+        self.nv_write_time = nv_write_time
+
+    @property
+    def wiper(self):
+        return self.wcr
+
+    def write_reg(self, reg, value):
+        if reg == 0x02:
+            self.regs[0x02] = value
+        elif self.regs[0x02] & 0x80:
+            self.wcr = value & 0x7F
+        else:
+            self.dcr = value & 0x7F
+            if self.nv_write_time:
+                self.busy_until = time.monotonic() + self.nv_write_time
+
+    def read_reg(self, reg):
+        if reg == 0x02:
+            return self.regs[0x02]
+        return self.wcr if self.regs[0x02] & 0x80 else self.dcr
+
+
+class SimADS1115(SimDevice):
+    '''
+    ADS1115 with 16 bit big-endian registers: conversion at 0x00, config at 0x01.
+    Writing the config register runs a conversion of the selected single-ended
+    input; input voltages are floats or callables returning a float.
+    '''
+    FULL_SCALE = {0: 6.144, 1: 4.096, 2: 2.048, 3: 1.024, 4: 0.512, 5: 0.256}
+
+    def __init__(self, address=ADDR_ADS):
+        super().__init__(address)
+        self.inputs = [0.0, 0.0, 0.0, 0.0]
+        self.config = 0x8583
+
+    def write(self, data):
+        self.pointer = data[0]
+        if self.pointer == 0x01 and len(data) >= 3:
+            self.config = (data[1] << 8) | data[2]
+            self._convert()
+
+    def read(self, length):
+        if self.pointer == 0x01:
+            value = self.config
+        else:
+            value = self.conversion
+        return bytes([(value >> 8) & 0xFF, value & 0xFF])[:length]
+
+    def _convert(self):
+        mux = (self.config >> 12) & 0x07
+        pga = (self.config >> 9) & 0x07
+        source = self.inputs[mux - 4] if mux >= 4 else 0.0
+        volts = source() if callable(source) else source
+        raw = int(volts / self.FULL_SCALE.get(pga, 0.256) * 32767)
+        self.conversion = max(-32768, min(32767, raw)) & 0xFFFF
+
+
+class SimTCA9548A(SimDevice):
+    '''
+    TCA9548A: one control byte, bit n enables downstream channel n.
+    '''
+    def __init__(self, address=ADDR_TCA):
+        super().__init__(address)
+        self.mask = 0
+        self.channels = [dict() for _ in range(8)]
+
+    def write(self, data):
+        if data:
+            self.mask = data[-1]
+
+    def read(self, length):
+        return bytes([self.mask] * length)
+
+    def attach(self, channel, device):
+        self.channels[channel][device.address] = device
+        return device
+
+
+class SimI2CBus:
+    '''
+    In-memory stand-in for busio.I2C. Devices behind a mux are reached through
+    whichever mux channels are enabled, as on the real bus. Addresses that do
+    not answer raise OSError, like a NAK.
+    '''
+    def __init__(self):
+        self.devices = {}
+        self.transactions = 0
+        # A real lock like busio's, the health monitor reads from its own thread
+        self._lock = threading.Lock()
+
+    def attach(self, device):
+        self.devices[device.address] = device
+        return device
+
+    def _visible(self):
+        found = dict(self.devices)
+        for device in self.devices.values():
+            if isinstance(device, SimTCA9548A):
+                for channel in range(8):
+                    if device.mask & (1 << channel):
+                        found.update(device.channels[channel])
+        return found
+
+    def _device(self, address):
+        device = self._visible().get(address)
+        if device is None:
+            raise OSError(f"No I2C device at address {hex(address)}")
+        if device.busy_until and time.monotonic() < device.busy_until:
+            raise OSError(f"I2C device at address {hex(address)} NAK'd")
+        self.transactions += 1
+        device.transactions += 1
+        return device
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def scan(self):
+        return sorted(self._visible())
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        self._device(address).write(bytes(buffer[start:end]))
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None):
+        end = len(buffer) if end is None else end
+        buffer[start:end] = self._device(address).read(end - start)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        device = self._device(address)
+        device.write(bytes(buffer_out[out_start:out_end]))
+        in_end = len(buffer_in) if in_end is None else in_end
+        buffer_in[in_start:in_end] = device.read(in_end - in_start)
+
+
+'''
+    Simulated drivers, same attributes as the adafruit ones final.py uses.
+'''
+class SimRegisterDriver:
+    '''
+    Locks the bus around every transfer like adafruit_bus_device.I2CDevice,
+    so mux channel selects are counted as they happen on the real bus.
+    '''
+    def __init__(self, bus, address):
+        self.bus = bus
+        self.address = address
+
+    def _lock(self):
+        while not self.bus.try_lock():
+            pass
+
+    def _write(self, reg, value):
+        self._lock()
+        try:
+            self.bus.writeto(self.address, bytes([reg, value]))
+        finally:
+            self.bus.unlock()
+
+    def _read(self, reg):
+        buf = bytearray(1)
+        self._lock()
+        try:
+            self.bus.writeto_then_readfrom(self.address, bytes([reg]), buf)
+        finally:
+            self.bus.unlock()
+        return buf[0]
+
+
+class SimDS3502Driver(SimRegisterDriver):
+    def __init__(self, bus, address):
+        super().__init__(bus, address)
+        # As adafruit_ds3502: wiper writes go to WR only
+        self._write(0x02, 0x80)
+
+    @property
+    def wiper(self):
+        return self._read(0x00)
+
+    @wiper.setter
+    def wiper(self, value):
+        if not 0 <= value <= 127:
+            raise ValueError("wiper must be from 0-127")
+        self._write(0x00, value)
+
+    def set_default(self, default):
+        self._write(0x02, 0x00)
+        self._write(0x00, default)
+        self._write(0x02, 0x80)
+
+
+class SimCAT5132Driver(SimRegisterDriver):
+    '''
+    Same register attributes as CAT5132.py, so CAT5132.bulk_program() runs on it.
+    '''
+    @property
+    def _access_register_selector(self):
+        return self._read(0x02)
+
+    @_access_register_selector.setter
+    def _access_register_selector(self, value):
+        self._write(0x02, value)
+
+    @property
+    def _wiper_register_data(self):
+        return self._read(0x00)
+
+    @_wiper_register_data.setter
+    def _wiper_register_data(self, value):
+        self._write(0x00, value)
+
+    _default_register_data = _wiper_register_data
+
+    @property
+    def wiper(self):
+        self._access_register_selector = 0x80
+        return self._wiper_register_data & 0x7F
+
+    @wiper.setter
+    def wiper(self, value):
+        if not 0 <= value <= 127:
+            raise ValueError("Wiper position value must be between 0 and 127.")
+        self._access_register_selector = 0x80
+        self._wiper_register_data = value
+
+    @property
+    def default_wiper(self):
+        self._access_register_selector = 0x00
+        return self._default_register_data & 0x7F
+
+    def set_default(self, value):
+        if not 0 <= value <= 127:
+            raise ValueError("Default value must be between 0 and 127.")
+        self._access_register_selector = 0x00
+        self._default_register_data = value
+        # The part NAKs until its non-volatile write cycle is done, retried as CAT5132.set_default() does
+        read_value = retry(lambda: self._default_register_data)
+        if read_value != value:
+            raise RuntimeError(f"Failed to set default value. Expected {value}, got {read_value}.")
+
+
+class SimADS1115Driver(SimRegisterDriver):
+    GAINS = {2 / 3: 0, 1: 1, 2: 2, 4: 3, 8: 4, 16: 5}
+
+    def __init__(self, bus, address=ADDR_ADS):
+        super().__init__(bus, address)
+        self.gain = 1
+
+    def read(self, channel):
+        # Single-shot conversion of a single-ended input, as adafruit_ads1x15 does
+        pga = self.GAINS[self.gain]
+        config = 0x8000 | ((channel + 4) << 12) | (pga << 9) | 0x0100 | 0x0083
+        buf = bytearray(2)
+        self._lock()
+        try:
+            self.bus.writeto(self.address, bytes([0x01, config >> 8, config & 0xFF]))
+            self.bus.writeto_then_readfrom(self.address, bytes([0x00]), buf)
+        finally:
+            self.bus.unlock()
+        raw = (buf[0] << 8) | buf[1]
+        return raw - 0x10000 if raw & 0x8000 else raw
+
+
+class SimAnalogIn:
+    def __init__(self, ads, channel):
+        self.ads = ads
+        self.channel = channel
+
+    @property
+    def value(self):
+        return self.ads.read(self.channel)
+
+    @property
+    def voltage(self):
+        full_scale = SimADS1115.FULL_SCALE[SimADS1115Driver.GAINS[self.ads.gain]]
+        return self.value / 32767 * full_scale
+
+
+class SimTCAChannel:
+    '''
+    One downstream mux channel, used like an I2C bus. As in adafruit_tca9548a,
+    try_lock() enables the channel and unlock() disables it again.
+    '''
+    def __init__(self, tca, channel):
+        self.tca = tca
+        self.channel = channel
+
+    def try_lock(self):
+        if self.tca.bus.try_lock():
+            self.tca.bus.writeto(self.tca.address, bytes([1 << self.channel]))
+            return True
+        return False
+
+    def unlock(self):
+        self.tca.bus.writeto(self.tca.address, b'\x00')
+        self.tca.bus.unlock()
+
+    def scan(self):
+        return self.tca.bus.scan()
+
+    def writeto(self, address, buffer, **kwargs):
+        self.tca.bus.writeto(address, buffer, **kwargs)
+
+    def readfrom_into(self, address, buffer, **kwargs):
+        self.tca.bus.readfrom_into(address, buffer, **kwargs)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, **kwargs):
+        self.tca.bus.writeto_then_readfrom(address, buffer_out, buffer_in, **kwargs)
+
+
+class SimTCA9548ADriver:
+    def __init__(self, bus, address=ADDR_TCA):
+        self.bus = bus
+        self.address = address
+        self.channels = [SimTCAChannel(self, channel) for channel in range(8)]
+
+    def __getitem__(self, channel):
+        return self.channels[channel]
+
+
+class SimPin:
+    def __init__(self, name):
+        self.name = name
+        self.direction = 'output'
+        self.value = False
+
+
+class SimBackend:
+    '''
+    Simulated generator board, wired as in the schematic:
+        MCP2221 bus: ADS1115 (0x48), TCA9548A (0x70)
+        TCA channel 0: square/triangle pots 0x28, 0x29
+        TCA channel 1: sine pots 0x28, 0x29, 0x2A and amplitude pot 0x2B
+        ADS inputs: V_REG_IN, I_REG_IN, PEAK_IN (see sine_peak()), unused
+    Set pot_type to 'cat5132' to populate the channels with CAT5132 parts instead,
+    nv_write_time makes those NAK for that many seconds after a DCR write.
+    '''
+    name = 'sim'
+
+    def __init__(self, pot_type='ds3502', sq_tri_chan=0, sin_chan=1, nv_write_time=0.0):
+        self.bus = SimI2CBus()
+        self.ads = self.bus.attach(SimADS1115())
+        self.tca = self.bus.attach(SimTCA9548A())
+        if pot_type == 'cat5132':
+            pot_model = lambda address: SimCAT5132(address, nv_write_time=nv_write_time)
+        else:
+            pot_model = SimDS3502
+        self.pots = {}
+        for address in (0x28, 0x29):
+            self.pots[(sq_tri_chan, address)] = self.tca.attach(sq_tri_chan, pot_model(address))
+        for address in (0x28, 0x29, 0x2A, 0x2B):
+            self.pots[(sin_chan, address)] = self.tca.attach(sin_chan, pot_model(address))
+        self.sin_chan = sin_chan
+        self.pins = {}
+        # V_REG_IN 5V through the /2 divider, current sensor at zero current,
+        # peak detector following the amplitude pot
+        self.ads.inputs = [2.5, 1.65, self.sine_peak, 0.0]
+
+    def sine_peak(self):
+        '''
+        PEAK_IN for the amplitude pot code and capacitor bank, with a slight
+        bow in the pot's transfer so a straight line is only an approximation.
+        '''
+        code = self.pots[(self.sin_chan, ADDR_SIM_AMP)].wiper
+        bits = tuple(int(bool(self.pins[pin].value)) if pin in self.pins else 0 for pin in ('G0', 'G1'))
+        return SIM_SINE_PEAK * SIM_SINE_GAIN.get(bits, 1.0) * (code / 127) ** 1.1
+
+    def set_input(self, channel, source):
+        '''
+        Sets an ADC input to a voltage or a callable returning one.
+        '''
+        self.ads.inputs[channel] = source
+
+    def i2c(self):
+        return self.bus
+
+    def gpio_output(self, pin):
+        gpio = self.pins.get(pin)
+        if gpio is None:
+            gpio = self.pins[pin] = SimPin(pin)
+        return gpio
+
+    def ads1115(self, i2c, gain):
+        ads = SimADS1115Driver(i2c)
+        ads.gain = gain
+        return ads
+
+    def analog_in(self, ads, channel):
+        return SimAnalogIn(ads, channel)
+
+    def tca9548a(self, i2c):
+        return SimTCA9548ADriver(i2c)
+
+    def ds3502(self, bus, address):
+        return SimDS3502Driver(bus, address)
+
+    def cat5132(self, bus, address):
+        return SimCAT5132Driver(bus, address)
+
+
+def get_backend(name='hardware', **kwargs):
+    if name == 'hardware':
+        return HardwareBackend()
+    if name == 'sim':
+        return SimBackend(**kwargs)
+    raise ValueError(f"Unknown backend '{name}', must be one of {BACKENDS}.")
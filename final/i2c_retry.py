@@ -0,0 +1,33 @@
+'''
+    DESCRIPTION:
+        NAK retry for single I2C transfers, shared by the CAT5132 driver and
+        its simulated stand-in in hw_backend.py. Nothing here imports the
+        hardware stack, so the simulator retries exactly as the driver does
+        whether or not the adafruit libraries are installed.
+'''
+from time import sleep
+
+# busio raises OSError for a NAK, the MCP2221 bridge RuntimeError
+NAK_ERRORS = (OSError, RuntimeError)
+NAK_RETRIES = 3
+NAK_RETRY_DELAY = 0.005     # Seconds between retries, the CAT5132 DCR write cycle is 5 ms max
+
+
+def retry(operation, retries=NAK_RETRIES, retry_delay=NAK_RETRY_DELAY, stats=None):
+    '''
+    Runs one I2C operation, retrying on a NAK up to retries extra times.
+    INPUTS
+    operation: function doing the transfer, its result is returned
+    stats: dict counting 'transfers' and 'retries', or None
+    '''
+    for attempt in range(retries + 1):
+        try:
+            if stats is not None:
+                stats["transfers"] += 1
+            return operation()
+        except NAK_ERRORS:
+            if attempt == retries:
+                raise
+            if stats is not None:
+                stats["retries"] += 1
+            sleep(retry_delay)
@@ -1,67 +1,97 @@
 import csv
-import matplotlib.pyplot as plt
+import os
+import sys
 import numpy as np
+# Shared helpers live in ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from result_cache import memoize
+
+# matplotlib is imported by show_non_linearity(), so the fits run without it
+CAPTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'square_tri')
 
 frequencies = [
     {'freq': 10,
-        'file_path' : './square_tri/RigolDS100.csv',
+        'file_path' : os.path.join(CAPTURE_DIR, 'RigolDS100.csv'),
         'fall_edge_start' : -0.2,
         'fall_edge_end':    -0.15,
         'rise_edge_start':  0.15,
         'rise_edge_end' :   0.2},
     {'freq': 1100,
-        'file_path' : './square_tri/sqtrik10.csv',
+        'file_path' : os.path.join(CAPTURE_DIR, 'sqtrik10.csv'),
         'fall_edge_start' : -(3.93/1100)/2,
         'fall_edge_end':    -(2.93/1100)/2,
         'rise_edge_start':  (2.93/1100)/2,
         'rise_edge_end' :   (3.93/1100)/2},
     {'freq': 10000,
-        'file_path' : './square_tri/sqtrik100.csv',
+        'file_path' : os.path.join(CAPTURE_DIR, 'sqtrik100.csv'),
         'fall_edge_start' : -(3.93/10000)/2,
         'fall_edge_end':    -(2.93/10000)/2,
         'rise_edge_start':  (3.15/10000)/2,
         'rise_edge_end' :   (3.97/10000)/2}
 ]
-def show_non_linearity(freq,file_path, fall_edge_start, fall_edge_end, rise_edge_start, rise_edge_end):
-    print(fall_edge_start)
-    print(fall_edge_end)
-
-    csv_file = file_path
+def load_capture(file_path):
+    '''
+    Loads the time and CH2 columns of a Rigol CSV capture as numpy arrays.
+    '''
     time = []
     ch2v = []
 
-    with open(csv_file, 'r') as file:
+    with open(file_path, 'r') as file:
         reader = csv.DictReader(file)
         for row in reader:
             time.append(float(row['Time(s)']))
             ch2v.append(float(row['CH2V']))
 
-    time = np.array(time)
-    ch2v = np.array(ch2v)
-    # Get the falling edge and rising edge portions of the wave
-    fall_edge_mask = (time >= fall_edge_start) & (time <=  fall_edge_end)
-    rise_edge_mask = (time >= rise_edge_start) & (time <=  rise_edge_end)
-
-    fall_time_seg = time[fall_edge_mask]
-    fall_ch2v_seg = ch2v[fall_edge_mask]
-
-    rise_time_seg = time[rise_edge_mask]
-    rise_ch2v_seg = ch2v[rise_edge_mask]
-
-    # Generate the lines of best fit and R^2 values for both edges
-    fall_slope, fall_inter = np.polyfit(fall_time_seg, fall_ch2v_seg, 1)
-    fall_fit_line = fall_slope * fall_time_seg + fall_inter
-    fall_residuals = fall_ch2v_seg - fall_fit_line
-    fall_ss_res = np.sum(fall_residuals**2)
-    fall_ss_tot = np.sum((fall_ch2v_seg - np.mean(fall_ch2v_seg))**2)
-    fall_r_squared = 1 - (fall_ss_res / fall_ss_tot)
-
-    rise_slope, rise_inter = np.polyfit(rise_time_seg, rise_ch2v_seg, 1)
-    rise_fit_line = rise_slope * rise_time_seg + rise_inter
-    rise_residuals = rise_ch2v_seg - rise_fit_line
-    rise_ss_res = np.sum(rise_residuals**2)
-    rise_ss_tot = np.sum((rise_ch2v_seg - np.mean(rise_ch2v_seg))**2)
-    rise_r_squared = 1 - (rise_ss_res / rise_ss_tot)
+    return np.array(time), np.array(ch2v)
+
+def fit_edge(time, ch2v, edge_start, edge_end):
+    '''
+    Linear fit of the part of the wave between edge_start and edge_end.
+    Returns the segment times and voltages, slope, intercept, fit line and R^2.
+    '''
+    edge_mask = (time >= edge_start) & (time <=  edge_end)
+    time_seg = time[edge_mask]
+    ch2v_seg = ch2v[edge_mask]
+
+    slope, inter = np.polyfit(time_seg, ch2v_seg, 1)
+    fit_line = slope * time_seg + inter
+    residuals = ch2v_seg - fit_line
+    ss_res = np.sum(residuals**2)
+    ss_tot = np.sum((ch2v_seg - np.mean(ch2v_seg))**2)
+    r_squared = 1 - (ss_res / ss_tot)
+    return time_seg, ch2v_seg, slope, inter, fit_line, r_squared
+
+def analyze_capture(file_path, fall_edge_start, fall_edge_end, rise_edge_start, rise_edge_end):
+    '''
+    Loads a capture and fits both edges, cached on the file contents and edge windows.
+    Returns time, ch2v and the fit_edge() results for the falling and rising edge.
+    '''
+    def compute():
+        time, ch2v = load_capture(file_path)
+        return (time, ch2v, fit_edge(time, ch2v, fall_edge_start, fall_edge_end),
+                fit_edge(time, ch2v, rise_edge_start, rise_edge_end))
+    windows = [fall_edge_start, fall_edge_end, rise_edge_start, rise_edge_end]
+    return memoize('nonlinear.edges', compute, files=[file_path], params={'windows': windows, 'order': 1})
+
+def print_non_linearity(freq, file_path, fall_edge_start, fall_edge_end, rise_edge_start, rise_edge_end):
+    '''
+    Prints the edge fits without plotting.
+    '''
+    _, _, fall_fit, rise_fit = analyze_capture(file_path, fall_edge_start, fall_edge_end, rise_edge_start, rise_edge_end)
+    for edge, fit in (('fall', fall_fit), ('rise', rise_fit)):
+        _, _, slope, inter, _, r_squared = fit
+        print(f"{freq}Hz {edge}: y = {slope:.3f}x + {inter:.3f}, R^2 = {r_squared:.4f}")
+
+def show_non_linearity(freq,file_path, fall_edge_start, fall_edge_end, rise_edge_start, rise_edge_end):
+    import matplotlib.pyplot as plt
+    print(fall_edge_start)
+    print(fall_edge_end)
+
+    # Generate the lines of best fit and R^2 values for the falling and rising edges
+    time, ch2v, fall_fit, rise_fit = analyze_capture(
+        file_path, fall_edge_start, fall_edge_end, rise_edge_start, rise_edge_end)
+    fall_time_seg, fall_ch2v_seg, fall_slope, fall_inter, fall_fit_line, fall_r_squared = fall_fit
+    rise_time_seg, rise_ch2v_seg, rise_slope, rise_inter, rise_fit_line, rise_r_squared = rise_fit
 
     # Plot full waveform
     plt.plot(time, ch2v, label='Waveform')
@@ -88,9 +118,10 @@ def show_non_linearity(freq,file_path, fall_edge_start, fall_edge_end, rise_edge
     plt.tight_layout()
     plt.show()
 
-def main():
+def main(plot=True):
+    show = show_non_linearity if plot else print_non_linearity
     for frequency in frequencies:
-        show_non_linearity(frequency['freq'], frequency['file_path'], frequency['fall_edge_start'],frequency['fall_edge_end'], frequency['rise_edge_start'], frequency['rise_edge_end'])
+        show(frequency['freq'], frequency['file_path'], frequency['fall_edge_start'],frequency['fall_edge_end'], frequency['rise_edge_start'], frequency['rise_edge_end'])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
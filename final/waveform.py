@@ -0,0 +1,296 @@
+'''
+    DESCRIPTION:
+        Waveform measurements from Rigol CSV captures, in place of reading
+        them off the scope screen:
+            freq        from interpolated mid-level crossings, debounced with
+                        hysteresis; captures with fewer than two edges fall
+                        back to the FFT peak
+            freq_fft    Hann windowed FFT peak, refined by parabolic
+                        interpolation between bins
+            duty        fraction of the whole periods spent above mid-level
+            rise, fall  mean 10%-90% transition times
+            vpp, vmin, vmax
+
+        Everything is computed on 2D arrays, one capture per row, so a stack
+        of same-length captures is measured in one pass with no Python loop
+        over samples or edges.
+
+        Both Rigol CSV layouts are read:
+            Time(s),CH1V,CH2V               time column per sample
+            X,CH1,CH2,Start,Increment       sample number, start and increment
+                                            in the units row below the header
+
+    EXPECTED:
+        python waveform.py [captures or folders] [-o table.csv]
+        rebuilds the calibration table from the stored captures.
+'''
+import argparse
+import csv
+import os
+import sys
+import numpy as np
+# Shared helpers live in ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from result_cache import default_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The square/triangle generator captures; data/ holds FFT and noise captures with no edges
+CAPTURE_DIRS = [os.path.join(ROOT, 'final', 'square_tri')]
+TABLE_FILE = os.path.join(ROOT, 'final', 'square_tri', 'calibration.csv')
+
+LEVEL_PERCENTILES = (1, 99)     # low and high levels, robust to spikes
+EDGE_LOW = 0.1                  # transition levels as a fraction of low-high
+EDGE_MID = 0.5
+EDGE_HIGH = 0.9
+MIN_SWING = 0.05                # V, smaller swings are treated as DC, no edges
+FEATURES = ('freq', 'freq_fft', 'duty', 'rise', 'fall', 'vpp', 'vmin', 'vmax')
+# Settings the results depend on, part of the cache key
+CACHE_PARAMS = {'levels': LEVEL_PERCENTILES, 'edges': (EDGE_LOW, EDGE_MID, EDGE_HIGH), 'min_swing': MIN_SWING}
+CACHE_VERSION = 1
+
+
+def load_rigol(file_path):
+    '''
+    Loads a Rigol CSV capture.
+    RETURNS
+    dt: sample interval in s
+    channels: {channel name ('CH1', 'CH2'): numpy array of volts}
+    '''
+    with open(file_path, 'r') as file:
+        header = [field.strip() for field in file.readline().split(',')]
+        if header[0] == 'X':
+            names = [name for name in header[1:] if name.startswith('CH')]
+            units = file.readline().split(',')
+            dt = float(units[header.index('Increment')])
+        else:
+            names = [name for name in header[1:] if name]
+            dt = None
+        data = np.loadtxt(file, delimiter=',', ndmin=2, usecols=range(len(names) + 1))
+    if dt is None:
+        dt = (data[-1, 0] - data[0, 0]) / (len(data) - 1)
+    # 'CH1V' -> 'CH1'
+    return dt, {name.rstrip('V'): data[:, index + 1] for index, name in enumerate(names)}
+
+
+def _crossings(x, level):
+    '''
+    Rising crossings of level, per row.
+    RETURNS
+    rows and crossing positions in samples, linearly interpolated
+    '''
+    above = x >= level[:, None]
+    rows, cols = np.nonzero(~above[:, :-1] & above[:, 1:])
+    x0 = x[rows, cols]
+    x1 = x[rows, cols + 1]
+    return rows, cols + (level[rows] - x0) / (x1 - x0)
+
+
+def _transitions(x, level_from, level_to):
+    '''
+    Rising transitions from level_from to level_to: each first crossing of
+    level_to after a crossing of level_from. Noise re-crossing either level
+    does not add transitions, the start is the last crossing of level_from.
+    RETURNS
+    rows, start and end positions in samples
+    '''
+    rows_from, pos_from = _crossings(x, level_from)
+    rows_to, pos_to = _crossings(x, level_to)
+    rows = np.concatenate((rows_from, rows_to))
+    pos = np.concatenate((pos_from, pos_to))
+    is_to = np.concatenate((np.zeros(len(rows_from), bool), np.ones(len(rows_to), bool)))
+    order = np.lexsort((pos, rows))
+    rows, pos, is_to = rows[order], pos[order], is_to[order]
+    keep = is_to[1:] & ~is_to[:-1] & (rows[1:] == rows[:-1])
+    return rows[1:][keep], pos[:-1][keep], pos[1:][keep]
+
+
+def _row_mean(rows, values, num_rows):
+    counts = np.bincount(rows, minlength=num_rows)
+    sums = np.bincount(rows, weights=values, minlength=num_rows)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def fft_frequency(x, dt):
+    '''
+    Frequency of the largest spectral peak of each row, in Hz.
+    '''
+    num_rows, num_samples = x.shape
+    spectrum = np.abs(np.fft.rfft((x - x.mean(axis=1, keepdims=True)) * np.hanning(num_samples), axis=1))
+    spectrum[:, 0] = 0.0
+    peak = np.clip(spectrum.argmax(axis=1), 1, spectrum.shape[1] - 2)
+    rows = np.arange(num_rows)
+    # Parabola through the log magnitudes around the peak bin
+    tiny = np.finfo(float).tiny
+    left = np.log(spectrum[rows, peak - 1] + tiny)
+    centre = np.log(spectrum[rows, peak] + tiny)
+    right = np.log(spectrum[rows, peak + 1] + tiny)
+    curve = left - 2 * centre + right
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offset = np.where(curve != 0, 0.5 * (left - right) / curve, 0.0)
+    return (peak + offset) / (num_samples * dt)
+
+
+def features(x, dt):
+    '''
+    Measures a stack of captures.
+    INPUTS
+    x: 2D array, one capture per row, all the same length
+    dt: sample interval in s, scalar or one per row
+    RETURNS
+    {feature: array with one value per row}, NaN where a feature is undefined
+    (e.g. no edges in a DC channel)
+    '''
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    num_rows, num_samples = x.shape
+    dt = np.broadcast_to(np.asarray(dt, dtype=float), (num_rows,))
+
+    vmin = x.min(axis=1)
+    vmax = x.max(axis=1)
+    low, high = np.percentile(x, LEVEL_PERCENTILES, axis=1)
+    swing = np.where(high - low >= MIN_SWING, high - low, np.nan)
+    level_low = low + EDGE_LOW * swing
+    level_mid = low + EDGE_MID * swing
+    level_high = low + EDGE_HIGH * swing
+
+    # Period from the first and last debounced mid-level rising crossing
+    rows, _, edges = _transitions(x, level_low, level_mid)
+    index = np.arange(num_rows)
+    first = np.searchsorted(rows, index, 'left')
+    last = np.searchsorted(rows, index, 'right') - 1
+    count = last - first + 1
+    valid = count >= 2
+    first_pos = np.where(valid, edges[np.minimum(first, len(edges) - 1)] if len(edges) else 0.0, np.nan)
+    last_pos = np.where(valid, edges[np.maximum(last, 0)] if len(edges) else 0.0, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        freq_zc = (count - 1) / ((last_pos - first_pos) * dt)
+
+    # Duty cycle over the whole periods between those crossings
+    cols = np.arange(num_samples)
+    window = (cols >= np.ceil(first_pos)[:, None]) & (cols < np.ceil(last_pos)[:, None])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        duty = (window & (x >= level_mid[:, None])).sum(axis=1) / window.sum(axis=1)
+    duty = np.where(valid, duty, np.nan)
+
+    rows, start, end = _transitions(x, level_low, level_high)
+    rise = _row_mean(rows, (end - start) * dt[rows], num_rows)
+    rows, start, end = _transitions(-x, -level_high, -level_low)
+    fall = _row_mean(rows, (end - start) * dt[rows], num_rows)
+
+    freq_fft = np.where(np.isnan(swing), np.nan, fft_frequency(x, dt))
+    return {
+        'freq': np.where(valid, freq_zc, freq_fft),
+        'freq_fft': freq_fft,
+        'duty': duty,
+        'rise': rise,
+        'fall': fall,
+        'vpp': vmax - vmin,
+        'vmin': vmin,
+        'vmax': vmax,
+    }
+
+
+def _measure(file_paths):
+    groups = {}
+    for file_path in file_paths:
+        dt, channels = load_rigol(file_path)
+        for name, x in channels.items():
+            group = groups.setdefault(len(x), ([], [], []))
+            group[0].append((file_path, name))
+            group[1].append(x)
+            group[2].append(dt)
+
+    measured = {file_path: {} for file_path in file_paths}
+    for keys, rows, dts in groups.values():
+        result = features(np.vstack(rows), np.array(dts))
+        for row, (file_path, channel) in enumerate(keys):
+            measured[file_path][channel] = {name: float(values[row]) for name, values in result.items()}
+    return measured
+
+
+def extract(file_path, cache=default_cache):
+    '''
+    RETURNS
+    {channel: {feature: value}} for one capture
+    '''
+    return extract_many([file_path], cache)[0][1]
+
+
+def extract_many(file_paths, cache=default_cache):
+    '''
+    Measures many captures. Captures measured before with the same settings
+    come from the result cache, the rest are loaded and all their channels of
+    the same length stacked into one features() call.
+    RETURNS
+    list of (file path, {channel: {feature: value}}) in file order
+    '''
+    results = {}
+    keys = {}
+    for file_path in file_paths:
+        if cache is not None and cache.enabled:
+            keys[file_path] = cache.key('waveform.features', [file_path], CACHE_PARAMS, CACHE_VERSION)
+            hit, value = cache.get(keys[file_path])
+            if hit:
+                results[file_path] = value
+    missing = [file_path for file_path in file_paths if file_path not in results]
+    if missing:
+        for file_path, value in _measure(missing).items():
+            results[file_path] = value
+            if file_path in keys:
+                cache.put(keys[file_path], value)
+    return [(file_path, results[file_path]) for file_path in file_paths]
+
+
+def find_captures(paths):
+    '''
+    Expands folders to the CSV files in them.
+    '''
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith('.csv')
+                            and name != os.path.basename(TABLE_FILE))
+        else:
+            found.append(path)
+    return found
+
+
+def write_table(results, file_path=TABLE_FILE):
+    '''
+    Writes the measurements as a CSV calibration table, file paths relative to the repo.
+    Channels with no measurable frequency (DC or noise) are left out.
+    '''
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['File', 'Channel', 'Freq(Hz)', 'FreqFFT(Hz)', 'Duty', 'Rise(s)', 'Fall(s)',
+                         'Vpp(V)', 'Vmin(V)', 'Vmax(V)'])
+        for capture, channels in results:
+            name = os.path.relpath(capture, ROOT).replace(os.sep, '/')
+            for channel, values in channels.items():
+                if np.isnan(values['freq']):
+                    continue
+                writer.writerow([name, channel] + [f"{values[key]:.6g}" for key in FEATURES])
+
+
+def print_table(results):
+    print(f"{'capture':<32}{'ch':<5}{'freq Hz':>11}{'fft Hz':>11}{'duty':>7}{'rise s':>11}{'fall s':>11}{'Vpp':>7}")
+    for capture, channels in results:
+        for channel, values in channels.items():
+            print(f"{os.path.basename(capture):<32}{channel:<5}{values['freq']:>11.5g}{values['freq_fft']:>11.5g}"
+                  f"{values['duty']:>7.3f}{values['rise']:>11.3g}{values['fall']:>11.3g}{values['vpp']:>7.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Rigol CSV captures and rebuild the calibration table")
+    parser.add_argument('paths', nargs='*', default=CAPTURE_DIRS, help="captures or folders of captures")
+    parser.add_argument('-o', '--output', default=TABLE_FILE, help="calibration table CSV (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = extract_many(find_captures(args.paths))
+    print_table(results)
+    write_table(results, args.output)
+    print(f"Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+'''
+    DESCRIPTION:
+        Runs one characterization campaign on several boards at once, one
+        worker process per board:
+            sweep SCRIPT    configurator script (final/batch_script.py) on generator boards
+            pid             thermal PID run (lab2.py run_profile) on thermal boards
+
+        Boards are the MCP2221 bridges found on USB (VID 0x04D8, PID 0x00DD),
+        or simulated boards with --sim N. blinka drives the first MCP2221 it
+        opens, so every worker is a freshly spawned process that pins hidapi
+        to its own bridge's HID path before board is imported.
+
+        Workers open their board and wait, then all start the campaign
+        together. Each writes its usual CSV and console log to the run folder
+        (fleet/runs/fleet_<date>/). The measurements of all boards are merged
+        into one store, telemetry.csv:
+            Time,Board,Channel,Value
+        sorted by Time, in seconds from the common start. Simulated thermal
+        boards run on virtual clocks, all at 0 at the common start.
+        fleet.json holds the boards, per-board results and timing.
+
+    USAGE:
+        python fleet/fleet.py --list                            boards found
+        python fleet/fleet.py sweep final/scripts/sq_tri_sweep.txt [--sim 4]
+        python fleet/fleet.py pid [--profile FILE | --long] [--model] [--sim 4] [--boards NAME,...]
+'''
+import argparse
+import contextlib
+import csv
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('final', 'lab2', 'common'):
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.append(path)
+
+RUNS_DIR = os.path.join(ROOT, 'fleet', 'runs')
+MCP2221_VID = 0x04D8
+MCP2221_PID = 0x00DD
+TASKS = ('sweep', 'pid')
+SETUP_TIMEOUT = 30.0    # s for every worker to open its board
+POLL_TIME = 1.0         # s between checks for workers that died without reporting
+SIM_NOISE = 0.0005      # V thermistor noise of the simulated thermal boards, seeded per board
+
+
+def find_bridges():
+    '''
+    RETURNS
+    list of boards {'name', 'backend', 'path'} for the MCP2221 bridges on USB,
+    named by serial number. Unprogrammed MCP2221s share the factory serial,
+    so repeated serials get the enumeration index appended.
+    '''
+    try:
+        import hid
+    except ImportError:
+        return []
+    devices = hid.enumerate(MCP2221_VID, MCP2221_PID)
+    serials = [device.get('serial_number') or 'mcp2221' for device in devices]
+    boards = []
+    for index, (device, serial) in enumerate(zip(devices, serials)):
+        name = serial if serials.count(serial) == 1 else f'{serial}_{index}'
+        boards.append({'name': name, 'backend': 'hardware', 'path': device['path']})
+    return boards
+
+
+def sim_boards(count):
+    return [{'name': f'sim{index}', 'backend': 'sim', 'path': None, 'seed': index} for index in range(count)]
+
+
+def _pin_bridge(path):
+    '''
+    Makes every hidapi open, whatever VID/PID it asks for, open the bridge at
+    path. blinka's MCP2221 opens the first VID/PID match when board is imported.
+    '''
+    import hid
+    device_class = hid.device
+
+    class PinnedDevice:
+        def __init__(self):
+            self._device = device_class()
+
+        def open(self, vendor_id=0, product_id=0, serial_number=None):
+            self._device.open_path(path)
+
+        def __getattr__(self, name):
+            return getattr(self._device, name)
+
+    hid.device = PinnedDevice
+    os.environ['BLINKA_MCP2221'] = '1'
+
+
+def _read_columns(file_path, time_column, channels):
+    '''
+    RETURNS
+    [(time, channel, value)] from a CSV log, in file order
+    '''
+    records = []
+    with open(file_path, 'r') as file:
+        for row in csv.DictReader(file):
+            time_s = float(row[time_column])
+            records += [(time_s, channel, float(row[channel])) for channel in channels]
+    return records
+
+
+def _setup_sweep(board, options, run_dir):
+    '''
+    Opens a generator board. Each board starts from a fresh state, kept in
+    the run folder so the workers do not share final/generator_state.json.
+    RETURNS
+    function running the sweep, returning (batch stats, records)
+    '''
+    import final
+    import generator_state
+    final.RESTORE_STATE = False
+    generator_state.STATE_FILE = os.path.join(run_dir, f"{board['name']}_state.json")
+    gen = final.setup(board['backend'])
+    data_path = os.path.join(run_dir, f"{board['name']}_sweep.csv")
+
+    def run():
+        stats = final.run_batch(gen, options['lines'], data_path)
+        return stats, _read_columns(data_path, 'Time', ('V_REG_IN', 'I_REG_IN', 'PEAK_IN'))
+    return run
+
+
+def _setup_pid(board, options, run_dir):
+    '''
+    Opens a thermal board, or a simulated plant.
+    RETURNS
+    function running the profile, returning (pid_log metrics, records)
+    '''
+    import lab2
+    import pid_log
+    import thermal_sim
+    from setpoint_profile import SetpointProfile, load_profile
+    if options.get('profile'):
+        profile = load_profile(options['profile'], lab2.DT, start=lab2.SETPOINT)
+    elif options.get('long'):
+        profile = SetpointProfile(lab2.LONG_TEST_PROFILE, lab2.DT)
+    else:
+        profile = SetpointProfile.constant(lab2.SETPOINT, lab2.RUN_TIME * 60, lab2.DT)
+    if board['backend'] == 'sim':
+        hardware = thermal_sim.SimulatedHardware(noise=SIM_NOISE, seed=board['seed'])
+    else:
+        hardware = lab2.Hardware()
+
+    def run():
+        data_path = lab2.run_profile(profile, hardware, os.path.join(run_dir, f"{board['name']}_pid"),
+                                     options.get('mode'))
+        metrics = pid_log.log_metrics(pid_log.load_log(data_path))
+        return metrics, _read_columns(data_path, 'Time', ('Temperature', 'DAC', 'Error', 'Setpoint'))
+    return run
+
+
+TASK_SETUP = {'sweep': _setup_sweep, 'pid': _setup_pid}
+
+
+def _worker(board, task, options, run_dir, start, start_time, messages):
+    '''
+    Worker process: opens the board, reports ready, waits for the common
+    start, runs the campaign and sends back the result and its records with
+    times from the common start. Console output goes to <board>.log.
+    '''
+    name = board['name']
+    try:
+        with open(os.path.join(run_dir, f'{name}.log'), 'w') as log, contextlib.redirect_stdout(log):
+            if board['backend'] == 'hardware':
+                _pin_bridge(board['path'])
+            run = TASK_SETUP[task](board, options, run_dir)
+            messages.put(('ready', name))
+            start.wait()
+            # Simulated thermal boards keep their own virtual time
+            offset = 0.0 if (task == 'pid' and board['backend'] == 'sim') else time.time() - start_time.value
+            begin = time.perf_counter()
+            result, records = run()
+            run_time = time.perf_counter() - begin
+        messages.put(('done', name, result, run_time,
+                      [(offset + time_s, name, channel, value) for time_s, channel, value in records]))
+    except Exception:
+        messages.put(('error', name, traceback.format_exc()))
+
+
+def run_fleet(jobs, run_dir=None):
+    '''
+    Runs the jobs concurrently, one process per board.
+    INPUTS
+    jobs: list of (board, task, options), board from find_bridges() or sim_boards(),
+          task 'sweep' (options {'lines': script lines}) or 'pid'
+          (options {'profile': file} or {'long': True}, default the 30 min hold,
+          and {'mode': 'model'} for model-based control)
+    run_dir: folder for the logs and the store (default: fleet/runs/fleet_<date>)
+    RETURNS
+    dict with the run folder, per-board results and timing, also saved as fleet.json
+    '''
+    if run_dir is None:
+        run_dir = os.path.join(RUNS_DIR, 'fleet' + datetime.now().strftime("_%Y_%m_%d_%H_%M_%S"))
+    run_dir = os.path.abspath(run_dir)
+    os.makedirs(run_dir, exist_ok=True)
+
+    # Spawned, not forked: each worker imports board, and with it its bridge, itself
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    start_time = context.Value('d', 0.0)
+    messages = context.Queue()
+    workers = {}
+    for board, task, options in jobs:
+        workers[board['name']] = context.Process(
+            target=_worker, args=(board, task, options, run_dir, start, start_time, messages),
+            name=f"fleet_{board['name']}", daemon=True)
+
+    begin = time.perf_counter()
+    for worker in workers.values():
+        worker.start()
+
+    results = {}
+    streams = {}
+    ready = set()
+
+    def receive(timeout):
+        message = messages.get(timeout=timeout)
+        if message[0] == 'ready':
+            ready.add(message[1])
+        elif message[0] == 'done':
+            _, name, result, run_time, records = message
+            results[name] = {'status': 'ok', 'result': result, 'run_time': run_time, 'records': len(records)}
+            streams[name] = records
+        else:
+            results[message[1]] = {'status': 'error', 'error': message[2]}
+
+    try:
+        while len(ready | set(results)) < len(workers):
+            receive(SETUP_TIMEOUT)
+    except queue.Empty:
+        for worker in workers.values():
+            worker.terminate()
+        missing = sorted(set(workers) - ready - set(results))
+        raise RuntimeError(f"Boards not ready after {SETUP_TIMEOUT:.0f} s: {', '.join(missing)}")
+    setup_time = time.perf_counter() - begin
+    start_time.value = time.time()
+    start.set()
+    campaign_begin = time.perf_counter()
+
+    while len(results) < len(workers):
+        try:
+            receive(POLL_TIME)
+        except queue.Empty:
+            for name, worker in workers.items():
+                if name not in results and not worker.is_alive():
+                    results[name] = {'status': 'error', 'error': f"worker exited with code {worker.exitcode}"}
+    campaign_time = time.perf_counter() - campaign_begin
+    for worker in workers.values():
+        worker.join()
+
+    store_path = os.path.join(run_dir, 'telemetry.csv')
+    num_records = write_telemetry(streams.values(), store_path)
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'run_dir': run_dir,
+        'telemetry': store_path,
+        'records': num_records,
+        'setup_time': setup_time,
+        'campaign_time': campaign_time,
+        'boards': [],
+    }
+    for board, task, options in jobs:
+        entry = {'name': board['name'], 'backend': board['backend'], 'task': task}
+        if board.get('path') is not None:
+            entry['path'] = board['path'].decode(errors='replace') if isinstance(board['path'], bytes) else board['path']
+        entry.update(results[board['name']])
+        report['boards'].append(entry)
+    with open(os.path.join(run_dir, 'fleet.json'), 'w') as file:
+        json.dump(report, file, indent=2, default=str)
+    return report
+
+
+def write_telemetry(streams, file_path):
+    '''
+    Merges per-board record streams, each already in time order, into one
+    time-sorted CSV store.
+    RETURNS
+    number of records written
+    '''
+    count = 0
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Time', 'Board', 'Channel', 'Value'])
+        for time_s, board, channel, value in heapq.merge(*streams, key=lambda record: record[0]):
+            writer.writerow([f'{time_s:.6f}', board, channel, value])
+            count += 1
+    return count
+
+
+def load_telemetry(file_path, boards=None, channels=None):
+    '''
+    Reads a telemetry store.
+    INPUTS
+    boards, channels: names to keep, None for all
+    RETURNS
+    {(board, channel): (list of times, list of values)}
+    '''
+    series = {}
+    with open(file_path, 'r') as file:
+        reader = csv.reader(file)
+        next(reader)
+        for time_s, board, channel, value in reader:
+            if (boards is not None and board not in boards) or (channels is not None and channel not in channels):
+                continue
+            times, values = series.setdefault((board, channel), ([], []))
+            times.append(float(time_s))
+            values.append(float(value))
+    return series
+
+
+def _describe(entry):
+    if entry['status'] != 'ok':
+        return entry['error'].strip().splitlines()[-1]
+    result = entry['result']
+    if entry['task'] == 'pid':
+        return (f"RMS error {result['rms_error']:.4f} K, worst {result['max_error']:+.3f} K, "
+                f"{result['in_band'] * 100:.1f}% in band")
+    return (f"{result['pot_writes']} pot writes, {result['measurements']} measurements, "
+            f"worst dwell {result['max_late'] * 1e3:.2f} ms late")
+
+
+def print_report(report):
+    print(f"{'board':<16}{'task':<7}{'status':<8}{'run s':>8}  result")
+    board_time = 0.0
+    for entry in report['boards']:
+        run_time = entry.get('run_time', float('nan'))
+        if entry['status'] == 'ok':
+            board_time += run_time
+        print(f"{entry['name']:<16}{entry['task']:<7}{entry['status']:<8}{run_time:>8.2f}  {_describe(entry)}")
+    print(f"Setup {report['setup_time']:.2f} s, campaign {report['campaign_time']:.2f} s for "
+          f"{len(report['boards'])} boards ({board_time:.2f} s of board time)")
+    print(f"{report['records']} records merged into {report['telemetry']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a campaign on several boards concurrently")
+    parser.add_argument('task', nargs='?', choices=TASKS, help="campaign to run")
+    parser.add_argument('script', nargs='?', help="sweep: configurator script, '-' reads stdin")
+    parser.add_argument('--sim', type=int, default=0, metavar='N', help="use N simulated boards instead of bridges")
+    parser.add_argument('--boards', help="comma separated board names to use (default: all)")
+    parser.add_argument('--profile', help="pid: setpoint profile file, see lab2/profiles")
+    parser.add_argument('--long', action='store_true', help="pid: built-in 2 hour two-step test")
+    parser.add_argument('--model', action='store_true', help="pid: model-based control (lab2/thermal_model.py)")
+    parser.add_argument('-o', '--output', help="run folder (default: fleet/runs/fleet_<date>)")
+    parser.add_argument('--list', action='store_true', help="list the boards found and exit")
+    args = parser.parse_args(argv)
+
+    boards = sim_boards(args.sim) if args.sim else find_bridges()
+    if args.boards:
+        names = args.boards.split(',')
+        unknown = [name for name in names if name not in [board['name'] for board in boards]]
+        if unknown:
+            parser.error(f"unknown boards: {', '.join(unknown)}")
+        boards = [board for board in boards if board['name'] in names]
+    if args.list:
+        for board in boards:
+            print(f"{board['name']:<16}{board['backend']:<10}{board['path'] or ''}")
+        return
+    if args.task is None:
+        parser.error("a task is required unless --list is given")
+    if not boards:
+        sys.exit("No MCP2221 bridges found (is hidapi installed?), use --sim N for simulated boards.")
+
+    options = {}
+    if args.task == 'sweep':
+        if args.script is None:
+            parser.error("sweep needs a script")
+        import batch_script
+        import final
+        if args.script == '-':
+            lines = sys.stdin.readlines()
+        else:
+            with open(args.script, 'r') as file:
+                lines = file.readlines()
+        # Check the script once here rather than failing in every worker
+        try:
+            batch_script.parse_script(lines, list(final.POTS), final.BATCH_CONFIGURATORS, final.BATCH_FREQ_PINS,
+                                      final.POT_MIN_BIT, final.POT_MAX_BIT)
+        except ValueError as err:
+            sys.exit(str(err))
+        options['lines'] = lines
+    else:
+        if args.profile and not os.path.isfile(args.profile):
+            sys.exit(f"No profile file {args.profile}")
+        options['profile'] = os.path.abspath(args.profile) if args.profile else None
+        options['long'] = args.long
+        options['mode'] = 'model' if args.model else None
+
+    report = run_fleet([(board, args.task, options) for board in boards], args.output)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+'''
+    DESCRIPTION:
+        Bode sweep metrics for the lab1 PID stage measurements.
+
+        Reads the Rigol Bode CSVs, either bare rows of
+            frequency (Hz), gain (dB), phase (degrees)
+        or the same columns under a 'RIGOL Bode Data' parameter header, and
+        reports the peak gain, the -3 dB band edges, the 0 dB crossover and
+        the phase there. Crossings are interpolated on a log frequency axis.
+        Results are cached on the file contents (common/result_cache.py).
+
+    EXPECTED:
+        python bode.py [files or folders]
+'''
+import argparse
+import os
+import sys
+import numpy as np
+# Shared helpers live in ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from result_cache import memoize
+
+LAB1_DIR = os.path.dirname(os.path.abspath(__file__))
+BAND_DB = 3.0   # band edges are this far below the peak gain
+CACHE_VERSION = 1
+
+
+def load_bode(file_path):
+    '''
+    RETURNS
+    freq, gain, phase as numpy arrays
+    '''
+    with open(file_path, 'r') as file:
+        lines = file.read().splitlines()
+    # Skip the parameter header, if any, up to the first all-numeric row
+    for start, line in enumerate(lines):
+        try:
+            [float(field) for field in line.split(',')[:3]]
+            break
+        except ValueError:
+            continue
+    data = np.loadtxt(lines[start:], delimiter=',', ndmin=2, usecols=(0, 1, 2))
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def _log_crossings(freq, values, level):
+    '''
+    Frequencies where values cross level, interpolated on log frequency.
+    '''
+    shifted = values - level
+    index = np.nonzero(np.signbit(shifted[:-1]) != np.signbit(shifted[1:]))[0]
+    frac = shifted[index] / (shifted[index] - shifted[index + 1])
+    log_freq = np.log10(freq)
+    return 10 ** (log_freq[index] + frac * (log_freq[index + 1] - log_freq[index]))
+
+
+def bode_metrics(freq, gain, phase, band_db=BAND_DB):
+    '''
+    RETURNS
+    dict with the peak gain and its frequency, the lower and upper band
+    edges band_db below the peak, the first 0 dB crossover and the phase
+    there (NaN where the sweep does not reach them)
+    '''
+    peak = int(np.argmax(gain))
+    edges = _log_crossings(freq, gain, gain[peak] - band_db)
+    below = edges[edges < freq[peak]]
+    above = edges[edges > freq[peak]]
+    crossover = _log_crossings(freq, gain, 0.0)
+    f_0db = crossover[0] if len(crossover) else np.nan
+    phase_0db = np.interp(np.log10(f_0db), np.log10(freq), phase) if len(crossover) else np.nan
+    return {
+        'gain_max': float(gain[peak]),
+        'f_gain_max': float(freq[peak]),
+        'f_low': float(below[-1]) if len(below) else np.nan,
+        'f_high': float(above[0]) if len(above) else np.nan,
+        'f_0db': float(f_0db),
+        'phase_0db': float(phase_0db),
+    }
+
+
+def analyze(file_path, band_db=BAND_DB):
+    '''
+    Cached bode_metrics() of a sweep file.
+    '''
+    return memoize('bode.metrics', lambda: bode_metrics(*load_bode(file_path), band_db=band_db),
+                   files=[file_path], params={'band_db': band_db}, version=CACHE_VERSION)
+
+
+def find_sweeps(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith('.csv'))
+        else:
+            found.append(path)
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bode sweep metrics")
+    parser.add_argument('paths', nargs='*', default=[LAB1_DIR], help="sweep files or folders")
+    args = parser.parse_args(argv)
+
+    print(f"{'sweep':<24}{'max dB':>8}{'at Hz':>10}{'-3dB lo':>10}{'-3dB hi':>10}{'0dB Hz':>10}{'phase':>8}")
+    for file_path in find_sweeps(args.paths):
+        metrics = analyze(file_path)
+        print(f"{os.path.basename(file_path):<24}{metrics['gain_max']:>8.2f}{metrics['f_gain_max']:>10.4g}"
+              f"{metrics['f_low']:>10.4g}{metrics['f_high']:>10.4g}{metrics['f_0db']:>10.4g}{metrics['phase_0db']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# adc_filter.py
+#
+# Oversampling and digital filtering for ADC readings, Lab2 EE90
+#
+# FilteredChannel wraps an AnalogIn (or thermal_sim.SimChannel) and takes a
+# burst of samples every time .voltage is read, so it drops into the
+# control loops in place of the raw channel.
+#
+# Filter modes:
+#   mean            average of the burst
+#   median          median of the burst, rejects single-sample spikes
+#   ema             exponential moving average over every sample taken
+#   moving_average  mean of the last `window` samples, kept in a ring buffer
+
+from time import perf_counter
+
+FILTER_MODES = ('mean', 'median', 'ema', 'moving_average')
+
+
+class FilteredChannel:
+    '''
+    Burst-sampled, filtered ADC channel.
+    '''
+    def __init__(self, channel, samples=4, mode='median', alpha=0.25, window=16):
+        '''
+        INPUTS
+        channel: object with a .voltage property (AnalogIn)
+        samples: number of ADC reads per .voltage call
+        mode: one of FILTER_MODES
+        alpha: EMA weight of a new sample, 0-1
+        window: moving average length, in samples
+        '''
+        if mode not in FILTER_MODES:
+            raise ValueError(f"Unknown filter mode '{mode}', must be one of {FILTER_MODES}.")
+        if samples < 1:
+            raise ValueError("Need at least one sample per read.")
+        if not 0 < alpha <= 1:
+            raise ValueError("EMA alpha must be between 0 and 1.")
+        if window < 1:
+            raise ValueError("Moving average window must be at least 1.")
+        self.channel = channel
+        self.samples = samples
+        self.mode = mode
+        self.alpha = alpha
+        self.window = window
+        # Filter state
+        self._ema = None
+        self._ring = [0.0] * window
+        self._ring_pos = 0
+        self._ring_fill = 0
+        self._ring_sum = 0.0
+        # Latency bookkeeping
+        self.reads = 0
+        self.read_time = 0.0
+        self.last_read_time = 0.0
+
+    @property
+    def value(self):
+        # Raw code passthrough, unfiltered
+        return self.channel.value
+
+    @property
+    def voltage(self):
+        start = perf_counter()
+        burst = [self.channel.voltage for _ in range(self.samples)]
+        if self.mode == 'mean':
+            result = sum(burst) / self.samples
+        elif self.mode == 'median':
+            burst.sort()
+            mid = self.samples // 2
+            if self.samples % 2:
+                result = burst[mid]
+            else:
+                result = (burst[mid - 1] + burst[mid]) / 2
+        elif self.mode == 'ema':
+            ema = self._ema
+            for sample in burst:
+                ema = sample if ema is None else ema + self.alpha * (sample - ema)
+            self._ema = result = ema
+        else:
+            for sample in burst:
+                # Running sum, O(1) per sample
+                self._ring_sum += sample - self._ring[self._ring_pos]
+                self._ring[self._ring_pos] = sample
+                self._ring_pos = (self._ring_pos + 1) % self.window
+                if self._ring_fill < self.window:
+                    self._ring_fill += 1
+            result = self._ring_sum / self._ring_fill
+        self.last_read_time = perf_counter() - start
+        self.read_time += self.last_read_time
+        self.reads += 1
+        return result
+
+    def reset(self):
+        self._ema = None
+        self._ring = [0.0] * self.window
+        self._ring_pos = 0
+        self._ring_fill = 0
+        self._ring_sum = 0.0
+
+    def group_delay(self):
+        '''
+        Delay of the filter output behind the newest sample, in samples.
+        '''
+        if self.mode in ('mean', 'median'):
+            return (self.samples - 1) / 2
+        if self.mode == 'ema':
+            return (1 - self.alpha) / self.alpha
+        return (self.window - 1) / 2
+
+    def latency(self, period=None):
+        '''
+        INPUTS
+        period: time between .voltage calls in seconds, needed for the
+                ema and moving_average delay since they span several calls
+        RETURNS
+        dict with the mean time spent per filtered read and the filter
+        group delay, both in seconds
+        '''
+        mean_read = self.read_time / self.reads if self.reads else 0.0
+        if self.mode in ('mean', 'median') or period is None:
+            sample_spacing = mean_read / self.samples
+        else:
+            sample_spacing = period / self.samples
+        return {
+            'mode': self.mode,
+            'samples': self.samples,
+            'reads': self.reads,
+            'read_time': mean_read,
+            'group_delay': self.group_delay() * sample_spacing,
+        }
+
+    def print_latency(self, name='channel', period=None):
+        stats = self.latency(period)
+        print(f"{name}: {stats['mode']} of {stats['samples']} samples, "
+              f"{stats['read_time'] * 1e3:.3f} ms per read, "
+              f"{stats['group_delay'] * 1e3:.3f} ms group delay")
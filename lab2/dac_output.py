@@ -0,0 +1,132 @@
+# dac_output.py
+#
+# MCP4728 output layer with multi-channel writes and change suppression, Lab2 EE90
+#
+# See datasheet: https://ww1.microchip.com/downloads/en/DeviceDoc/22187E.pdf
+#   Fast Write (5.6.1): all four channels in one transaction, 2 bytes each
+#       [0 0 PD1 PD0 D11 D10 D9 D8] [D7 ... D0]
+#   Multi-Write (5.6.2): any set of channels in one transaction, 3 bytes each
+#       [0 1 0 0 0 DAC1 DAC0 UDAC] [VREF PD1 PD0 Gx D11 D10 D9 D8] [D7 ... D0]
+#
+# Codes are taken in the adafruit 16 bit scale (0-65535) like channel_x.value,
+# and compared after reduction to the 12 bit code the DAC actually holds, so
+# requests that land on the same output code never reach the bus.
+
+import time
+
+CHANNELS = ('a', 'b', 'c', 'd')
+_FAST_WRITE = 0x00
+_MULTI_WRITE = 0x40
+
+
+def to_dac12(value):
+    '''
+    Converts an adafruit 16 bit value to the 12 bit MCP4728 code.
+    '''
+    return min(max(int(value), 0), 65535) >> 4
+
+
+class DacOutput:
+    '''
+    Writes MCP4728 channels in as few I2C transactions as possible.
+    Unchanged codes are skipped, and optionally:
+        hysteresis: 12 bit codes a channel must move before it is rewritten
+        min_interval: seconds between rewrites of the same channel
+    Drivers without an i2c_device (thermal_sim.SimDac) are written channel by channel.
+    '''
+    def __init__(self, mcp4728, hysteresis=0, min_interval=0.0, clock=time.monotonic):
+        self.mcp4728 = mcp4728
+        self.hysteresis = hysteresis
+        self.min_interval = min_interval
+        self.clock = clock
+        self.codes = {name: None for name in CHANNELS}
+        self.last_write = {name: None for name in CHANNELS}
+        # Bus traffic counters
+        self.transactions = 0
+        self.channel_writes = 0
+        self.skipped = 0
+
+    def _channel(self, name):
+        return getattr(self.mcp4728, 'channel_' + name)
+
+    def _wanted(self, name, code, now, force):
+        last = self.codes[name]
+        if force or last is None:
+            return True
+        if abs(code - last) <= self.hysteresis:
+            return False
+        if self.min_interval and now - self.last_write[name] < self.min_interval:
+            return False
+        return True
+
+    def _control_bits(self, name):
+        # VREF and gain bits as configured in the driver, PD bits always normal mode
+        channel = self._channel(name)
+        vref = getattr(channel, 'vref', 0) & 0x01
+        gain = 1 if getattr(channel, 'gain', 1) == 2 else 0
+        return (vref << 7) | (gain << 4)
+
+    def _fast_write(self, codes):
+        buf = bytearray(8)
+        for index, name in enumerate(CHANNELS):
+            code = codes[name]
+            buf[2 * index] = _FAST_WRITE | (code >> 8)
+            buf[2 * index + 1] = code & 0xFF
+        with self.mcp4728.i2c_device as i2c:
+            i2c.write(buf)
+
+    def _multi_write(self, codes):
+        buf = bytearray()
+        for name, code in codes.items():
+            index = CHANNELS.index(name)
+            # UDAC = 0, output updates as soon as the channel is received
+            buf.append(_MULTI_WRITE | (index << 1))
+            buf.append(self._control_bits(name) | (code >> 8))
+            buf.append(code & 0xFF)
+        with self.mcp4728.i2c_device as i2c:
+            i2c.write(buf)
+
+    def write(self, a=None, b=None, c=None, d=None, force=False):
+        '''
+        Sets any of the four channels, adafruit 16 bit scale.
+        INPUTS
+        a, b, c, d: channel values, None leaves a channel alone
+        force: write even if the code is unchanged
+        RETURNS
+        True if anything was sent to the DAC
+        '''
+        now = self.clock()
+        changed = {}
+        for name, value in zip(CHANNELS, (a, b, c, d)):
+            if value is None:
+                continue
+            code = to_dac12(value)
+            if self._wanted(name, code, now, force):
+                changed[name] = code
+            else:
+                self.skipped += 1
+        if not changed:
+            return False
+
+        if not hasattr(self.mcp4728, 'i2c_device'):
+            for name, code in changed.items():
+                self._channel(name).value = code << 4
+                self.transactions += 1
+        elif len(changed) == len(CHANNELS):
+            # Fast write keeps the VREF/gain bits already in the DAC
+            self._fast_write(changed)
+            self.transactions += 1
+        else:
+            self._multi_write(changed)
+            self.transactions += 1
+
+        for name, code in changed.items():
+            self.codes[name] = code
+            self.last_write[name] = now
+        self.channel_writes += len(changed)
+        return True
+
+    def print_stats(self):
+        requested = self.channel_writes + self.skipped
+        print(f"DAC: {requested} channel updates requested, {self.channel_writes} written "
+              f"in {self.transactions} transactions, {self.skipped} suppressed")
@@ -17,13 +17,23 @@
 # AIN2 = Ground reference
 # AIN3 = Test
 
-import board
-import adafruit_mcp4728
-import numpy as np
+# The board and adafruit drivers are imported where the hardware is opened,
+# so the conversion and control functions load without the MCP2221 stack.
+import math
+import os
+import sys
 import time
-import adafruit_ads1x15.ads1015 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
 from datetime import datetime
+import pid_log
+import thermal_model
+import thermal_sim
+from adc_filter import FilteredChannel
+from dac_output import DacOutput
+from setpoint_profile import ProfileSegment, SetpointProfile, load_profile
+# Shared helpers live in ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from loop_profiler import LoopProfiler
+from summary_pyramid import SummaryPyramid
 
 
 # Thermistor constants, 
@@ -43,6 +53,15 @@ DT = 1                  # Time step, seconds
 RUN_TIME = 30           # PID run time, adjust as necessary,  minutes
 INTEGRAL_BOUND = 250.0  # Max integral bound
 DEADBAND = 0.075        # PID error is 0 if within this deadband range
+CONTROL_MODE = 'pid'    # 'pid', or 'model' for feedforward plus Smith predictor (thermal_model.py)
+MODEL_FILE = None       # Identified plant model for 'model', e.g. 'model.json', None for thermal_model defaults
+SIMULATE = False        # Run the control loops against thermal_sim instead of the board
+PROFILE_FILE = None     # Setpoint profile for long_test, e.g. 'profiles/long_test.txt'
+PROFILE_LOOP = True     # Time each stage of the control loop, report at the end of a run
+ADC_SAMPLES = 4         # ADC reads per channel per control step
+ADC_FILTER = 'median'   # Decimation: 'mean', 'median', 'ema' or 'moving_average'
+DAC_HYSTERESIS = 0      # 12 bit codes the output must move before the DAC is rewritten
+DAC_MIN_INTERVAL = 0.0  # Minimum seconds between DAC rewrites
 
 # DAC Parameters
 DAC_BITS = 16  # all adafruit circuit python is 16 bit, even though MCP4728 is 12 bit, bits
@@ -70,13 +89,27 @@ def calc_temperature(rb, rt0, t0_c, br, vcc, vt):
     t0_c: is the thermistor reference temperature in C
     br: is the thermistor beta term
     vcc: is the splitter excitation voltage in V
-    vt: is the sampled thermistor voltage in V
+    vt: is the sampled thermistor voltage in V, a single reading or an array
+        of readings (vcc may be an array too)
     RETURNS
-    t_therm: the temperature of the thermistor in Kelvin
+    t_therm: the temperature of the thermistor in Kelvin, nan if vt is not
+    between 0 and vcc (bad read, open or shorted thermistor), an array for
+    array inputs
     '''
-    rt = rb * vt / (vcc - vt)
     t0_k = t0_c + 273.15
-    t_therm = 1.0 / ((1.0 / t0_k) + (1.0 / br) * np.log(rt / rt0))
+    if not isinstance(vt, (int, float)) or not isinstance(vcc, (int, float)):
+        # Array path, NumPy is only imported for it
+        import numpy as np
+        vt = np.asarray(vt, dtype=float)
+        vcc = np.asarray(vcc, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rt = rb * vt / (vcc - vt)
+            t_therm = 1.0 / ((1.0 / t0_k) + (1.0 / br) * np.log(rt / rt0))
+        return np.where((vt > 0.0) & (vt < vcc), t_therm, np.nan)
+    if not 0.0 < vt < vcc:
+        return math.nan
+    rt = rb * vt / (vcc - vt)
+    t_therm = 1.0 / ((1.0 / t0_k) + (1.0 / br) * math.log(rt / rt0))
     return t_therm
 
 
@@ -140,6 +173,9 @@ def cond_dac_control(set_point, dac_limit, dac_bits):
         C3 - ADC3
 '''
 def test_adc():
+    import board
+    import adafruit_ads1x15.ads1015 as ADS
+    from adafruit_ads1x15.analog_in import AnalogIn
     i2c = board.I2C()
     ads = ADS.ADS1015(i2c)
     chan0 = AnalogIn(ads, ADS.P0)
@@ -157,6 +193,8 @@ def test_adc():
         0V     on VD - TP5 (DAC3)
 '''
 def test_dac():
+    import board
+    import adafruit_mcp4728
     # open-up communications with USB, ADC, and DAC
     i2c = board.I2C()  # uses board.SCL and board.SDA
     mcp4728 = adafruit_mcp4728.MCP4728(i2c, adafruit_mcp4728.MCP4728_DEFAULT_ADDRESS)
@@ -166,6 +204,10 @@ def test_dac():
     mcp4728.channel_d.value = 0
 
 def test_on_off():
+    import board
+    import adafruit_mcp4728
+    import adafruit_ads1x15.ads1015 as ADS
+    from adafruit_ads1x15.analog_in import AnalogIn
     # H/W Setup
     i2c = board.I2C()  # uses board.SCL and board.SDA
     ads = ADS.ADS1015(i2c)
@@ -202,70 +244,174 @@ def test_on_off():
         time.sleep(DT)
 
     on_off_data.close()
-# 30 min PID test
-def pid_test():
-    # Setup hardware
-    i2c = board.I2C()  # uses board.SCL and board.SDA
-    ads = ADS.ADS1015(i2c)
-    chan0 = AnalogIn(ads, ADS.P0)
-    chan1 = AnalogIn(ads, ADS.P1)
-    mcp4728 = adafruit_mcp4728.MCP4728(i2c, adafruit_mcp4728.MCP4728_DEFAULT_ADDRESS)
+class Hardware:
+    '''
+    Board connections used by the control loops: ADC channels, DAC and clock.
+    thermal_sim.SimulatedHardware has the same attributes, so a loop can be
+    pointed at either one.
+    '''
+    def __init__(self):
+        import board
+        import adafruit_mcp4728
+        import adafruit_ads1x15.ads1015 as ADS
+        from adafruit_ads1x15.analog_in import AnalogIn
+        i2c = board.I2C()  # uses board.SCL and board.SDA
+        ads = ADS.ADS1015(i2c)
+        self.chan0 = AnalogIn(ads, ADS.P0)
+        self.chan1 = AnalogIn(ads, ADS.P1)
+        self.mcp4728 = adafruit_mcp4728.MCP4728(i2c, adafruit_mcp4728.MCP4728_DEFAULT_ADDRESS)
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+def get_hardware():
+    '''
+    Returns the simulated plant if SIMULATE is set, otherwise the board.
+    '''
+    if SIMULATE:
+        return thermal_sim.SimulatedHardware()
+    return Hardware()
+
+def get_model():
+    '''
+    Plant model for the 'model' control mode: MODEL_FILE if set, otherwise
+    the thermal_model defaults. The simulator gets the same model as the
+    board, so runs against a SimulatedHardware with other parameters show
+    how the controller copes with model error.
+    '''
+    if MODEL_FILE:
+        return thermal_model.load_model(MODEL_FILE)
+    return thermal_model.FOPDTModel()
+
+def run_profile(profile, hardware, file_prefix='temp_data_pid', mode=None):
+    '''
+    PID or model-based loop following a setpoint profile
+    INPUTS
+    profile: SetpointProfile, one setpoint per DT tick
+    hardware: Hardware or thermal_sim.SimulatedHardware
+    file_prefix: name of the data file, timestamp is appended
+    mode: 'pid' or 'model', None for CONTROL_MODE. The Error column is the
+          controller's error, after the deadband in 'pid' mode, and in 'model'
+          mode the Integral column holds the disturbance estimate. Setpoint is
+          the profile setpoint, for pid_log.py.
+    RETURNS
+    path of the data file
+    '''
+    # Oversample and filter both channels before they reach the controller
+    chan0 = FilteredChannel(hardware.chan0, ADC_SAMPLES, ADC_FILTER)
+    chan1 = FilteredChannel(hardware.chan1, ADC_SAMPLES, ADC_FILTER)
+    dac = DacOutput(hardware.mcp4728, DAC_HYSTERESIS, DAC_MIN_INTERVAL, clock=hardware.time)
     # Make sure to set channel B (DAC1 on Alium ) to VCC 
-    mcp4728.channel_b.value = int(2 ** DAC_BITS - 1)
-    mcp4728.channel_c.value = 0
-    mcp4728.channel_d.value = 0
+    dac.write(b=int(2 ** DAC_BITS - 1), c=0, d=0, force=True)
     
     # Set up PID parameters
     PREVIOUS_ERROR = 0.0
     INTEGRAL = 0.0
+    mode = mode or CONTROL_MODE
+    if mode not in ('pid', 'model'):
+        raise ValueError(f"Unknown control mode '{mode}', must be 'pid' or 'model'.")
+    controller = None
+    if mode == 'model':
+        # Feedforward and correction terms are precomputed for every tick of the profile
+        model = get_model()
+        controller = thermal_model.ModelController(model, profile.setpoints, DT)
+        print(f"Model control with {model}")
     
     # Timing parameters
     now_date = datetime.now()
     current_time = now_date.strftime("_%Y_%m_%d_%H_%M_%S")
-    plot_start_time = time.time()
-    now_time = time.time()
-    last_time = time.time()
+    plot_start_time = hardware.time()
+    now_time = hardware.time()
+    # First step counts as a full period, dt must never be zero
+    last_time = now_time - DT
     
     # Create file to analyze performance of loop
-    data_file_pid = open('temp_data_pid' + current_time + '.csv', 'w')
-    data_file_pid.write('Time,Temperature,DAC,Error,Integral\n')
+    data_path = file_prefix + current_time + '.csv'
+    data_file_pid = open(data_path, 'w')
+    data_file_pid.write('Time,Temperature,DAC,Error,Integral,Setpoint\n')
+    # Summaries for band and zoom queries on the log, built as it is written
+    pyramids = {'Temperature': SummaryPyramid(), 'Error': SummaryPyramid()}
     
     # Determine run time
-    num_steps = int(RUN_TIME * 60 / DT)
+    num_steps = profile.num_steps
+    profiler = LoopProfiler(period=DT, enabled=PROFILE_LOOP)
 
     for step in range(num_steps):
+        profiler.start()
         # Update time parameters
-        now_time = time.time()
+        now_time = hardware.time()
         plot_time_now = now_time - plot_start_time
         dt = now_time - last_time
-        last_time = now_time
 
         # Calculate the temperature
         vcc = chan0.voltage
+        profiler.lap('adc_vcc')
         vt = chan1.voltage
+        profiler.lap('adc_vt')
         current_temp = calc_temperature(RB, RT0, T0_C, BR, vcc, vt)
+        profiler.lap('calc_temperature')
+        if math.isnan(current_temp):
+            # Bad read, hold the DAC and skip the tick, the next dt spans it
+            print(f"Bad thermistor read, vcc {vcc:.3f} V vt {vt:.3f} V, tick skipped")
+            profiler.end()
+            hardware.sleep(DT)
+            continue
+        last_time = now_time
         
+        # Setpoint lookup is precomputed in the profile
+        setpoint = profile.at(step)
         # Get controller output 
-        control_output, PREVIOUS_ERROR, INTEGRAL = pid_controller(
-            SETPOINT, current_temp, KP, KI, KD, PREVIOUS_ERROR, INTEGRAL, dt
-        )
-        dac_value = cond_dac_control(control_output, DAC_LIMIT, DAC_BITS)
+        if controller is None:
+            control_output, PREVIOUS_ERROR, INTEGRAL = pid_controller(
+                setpoint, current_temp, KP, KI, KD, PREVIOUS_ERROR, INTEGRAL, dt
+            )
+            dac_value = cond_dac_control(control_output, DAC_LIMIT, DAC_BITS)
+        else:
+            dac_value, _ = controller.update(step, current_temp, dt)
+            PREVIOUS_ERROR = setpoint - current_temp
+            INTEGRAL = controller.disturbance
+        profiler.lap('pid')
         
-        # And set DAC
-        mcp4728.channel_a.value = dac_value
+        # And set DAC, skipped if the code has not changed
+        dac.write(a=dac_value)
+        profiler.lap('dac_write')
         
         # Write to file
-        data_file_pid.write(f'{plot_time_now},{current_temp},{dac_value},{PREVIOUS_ERROR},{INTEGRAL}\n')
-        time.sleep(DT)
+        data_file_pid.write(f'{plot_time_now},{current_temp},{dac_value},{PREVIOUS_ERROR},{INTEGRAL},{setpoint}\n')
+        pyramids['Temperature'].append(plot_time_now, current_temp)
+        pyramids['Error'].append(plot_time_now, setpoint - current_temp)
+        profiler.lap('file')
         
         # Debug print
         print(f"vt value {chan1.value}, vcc value {chan0.value}")
-        print(f"Temperature is {current_temp:.3f} K against {SETPOINT} K setpoint")
+        print(f"Temperature is {current_temp:.3f} K against {setpoint:.3f} K setpoint")
         print(f"Dt is {dt}")
-        print(f"Error is {PREVIOUS_ERROR:.3f} kP * Error is {KP * PREVIOUS_ERROR:.3f} Integral is {INTEGRAL:.3f}, KI *INT is {KI * INTEGRAL:.3f}")
+        if controller is None:
+            print(f"Error is {PREVIOUS_ERROR:.3f} kP * Error is {KP * PREVIOUS_ERROR:.3f} Integral is {INTEGRAL:.3f}, KI *INT is {KI * INTEGRAL:.3f}")
+        else:
+            print(f"Error is {PREVIOUS_ERROR:.3f} Drive is {controller.drive:.3f} Disturbance is {INTEGRAL:.3f}")
         print(f"DAC setting is {dac_value * DAC_LIMIT / ((2**DAC_BITS)-1):.3f} V")
+        profiler.lap('print')
+        profiler.end()
+        hardware.sleep(DT)
 
     data_file_pid.close()
+    pid_log.store_pyramids(data_path, pyramids)
+    if PROFILE_LOOP:
+        profiler.print_report()
+        profiler.save(file_prefix + current_time + '_timing.json')
+        chan0.print_latency('VCC (AIN0)', DT)
+        chan1.print_latency('VT (AIN1)', DT)
+        dac.print_stats()
+    return data_path
+
+# 30 min PID test
+def pid_test(hardware=None, mode=None):
+    profile = SetpointProfile.constant(SETPOINT, RUN_TIME * 60, DT)
+    return run_profile(profile, hardware or get_hardware(), mode=mode)
 
 # 2 hour test
 # Change setpoint
@@ -275,76 +421,18 @@ LONG_RUN_TIME = 120 # in mins
 MAX_TEMP = 313.547
 MAX_75_VALUE = (MAX_TEMP - SETPOINT )* .75 + SETPOINT
 MAX_25_VALUE = (MAX_TEMP - SETPOINT )* .25 + SETPOINT
-# 2 hour long test
-def long_test():
-    # Setup hardware
-    i2c = board.I2C()  # uses board.SCL and board.SDA
-    ads = ADS.ADS1015(i2c)
-    chan0 = AnalogIn(ads, ADS.P0)
-    chan1 = AnalogIn(ads, ADS.P1)
-    mcp4728 = adafruit_mcp4728.MCP4728(i2c, adafruit_mcp4728.MCP4728_DEFAULT_ADDRESS)
-    # Make sure to set channel B (DAC1 on Alium ) to VCC 
-    mcp4728.channel_b.value = int(2 ** DAC_BITS - 1)
-    mcp4728.channel_c.value = 0
-    mcp4728.channel_d.value = 0
-    
-    # Set up PID parameters
-    PREVIOUS_ERROR = 0.0
-    INTEGRAL = 0.0
-    
-    # Timing parameters
-    now_date = datetime.now()
-    current_time = now_date.strftime("_%Y_%m_%d_%H_%M_%S")
-    plot_start_time = time.time()
-    now_time = time.time()
-    last_time = time.time()
-    
-    # Create file to analyze performance of loop
-    data_file_pid = open('temp_data_pid' + current_time + '.csv', 'w')
-    data_file_pid.write('Time,Temperature,DAC,Error,Integral\n')
-    
-    # Determine run time
-    num_steps = int(LONG_RUN_TIME * 60 / DT)
-
-    for step in range(num_steps):
-        # Update time parameters
-        now_time = time.time()
-        plot_time_now = now_time - plot_start_time
-        dt = now_time - last_time
-        last_time = now_time
-
-        # Calculate the temperature
-        vcc = chan0.voltage
-        vt = chan1.voltage
-        current_temp = calc_temperature(RB, RT0, T0_C, BR, vcc, vt)
-        
-        setpoint = 0
-        # first half we want setopint to be 75 % max
-        if (step <= num_steps / 2) :
-            setpoint = MAX_75_VALUE
-        else:
-            setpoint = MAX_25_VALUE
-        # Get controller output 
-        control_output, PREVIOUS_ERROR, INTEGRAL = pid_controller(
-            setpoint, current_temp, KP, KI, KD, PREVIOUS_ERROR, INTEGRAL, dt
-        )
-        dac_value = cond_dac_control(control_output, DAC_LIMIT, DAC_BITS)
-        
-        # And set DAC
-        mcp4728.channel_a.value = dac_value
-        
-        # Write to file
-        data_file_pid.write(f'{plot_time_now},{current_temp},{dac_value},{PREVIOUS_ERROR},{INTEGRAL}\n')
-        time.sleep(DT)
-        
-        # Debug print
-        # print(f"vt value {chan1.value}, vcc value {chan0.value}")
-        print(f"Temperature is {current_temp:.3f} K against {setpoint} K setpoint")
-        print(f"Dt is {dt}")
-        print(f"Error is {PREVIOUS_ERROR:.3f} kP * Error is {KP * PREVIOUS_ERROR:.3f} Integral is {INTEGRAL:.3f}, KI *INT is {KI * INTEGRAL:.3f}")
-        print(f"DAC setting is {dac_value * DAC_LIMIT / ((2**DAC_BITS)-1):.3f} V")
+LONG_TEST_PROFILE = [
+    ProfileSegment('step', LONG_RUN_TIME * 60 / 2, MAX_75_VALUE),
+    ProfileSegment('step', LONG_RUN_TIME * 60 / 2, MAX_25_VALUE),
+]
+# 2 hour long test, or any schedule loaded from a profile file
+def long_test(profile_file=PROFILE_FILE, hardware=None, mode=None):
+    if profile_file:
+        profile = load_profile(profile_file, DT, start=SETPOINT)
+    else:
+        profile = SetpointProfile(LONG_TEST_PROFILE, DT)
+    return run_profile(profile, hardware or get_hardware(), mode=mode)
 
-    data_file_pid.close()
 def main():
     # test_dac()
     # test_adc()
@@ -0,0 +1,238 @@
+# pid_log.py
+#
+# Tracking metrics of the thermal control logs, Lab2 EE90
+#
+# Reads the Time,Temperature[,DAC,Error,Integral,Setpoint] CSVs written by
+# lab2.py and reports, for a time window, how well the temperature held the
+# setpoint: mean, min/max, RMS and worst error, the fraction of samples
+# within +-band of the setpoint and when it last entered the band.
+#
+# The error is setpoint - T, with the setpoint from the Setpoint column, so
+# schedules that change setpoint are handled; a fixed setpoint can be given
+# instead. Logs from before the Setpoint column fall back to the Error
+# column, which in PID mode is the controller's error after the deadband,
+# 0 within lab2.DEADBAND of the setpoint, so their RMS error reads low and
+# bands narrower than the deadband mean nothing. Results are cached on the
+# log contents and the window, band and setpoint (common/result_cache.py).
+#
+# For band and zoom queries the temperature and error are kept as
+# summary pyramids (common/summary_pyramid.py), cached per log and built by
+# lab2.run_profile() while it logs, so listing the out-of-band intervals or
+# decimating a multi-day log for a plot does not touch every sample.
+#
+# Usage:
+#   python pid_log.py pid_good_2hr.csv --start 3300 --end 3600
+#   python pid_log.py pid_good_2hr.csv --violations
+#   python pid_log.py pid_good_2hr.csv --zoom 40
+
+import argparse
+import csv
+import math
+import os
+import sys
+# Shared helpers live in ../common
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from result_cache import default_cache, memoize
+from summary_pyramid import SummaryPyramid
+
+BAND = 0.1      # K, the lab's settling requirement
+CACHE_VERSION = 2
+
+
+def load_log(file_path):
+    '''
+    RETURNS
+    {column name: list of floats}
+    '''
+    with open(file_path, 'r') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        columns = [[] for _ in header]
+        for row in reader:
+            for column, value in zip(columns, row):
+                column.append(float(value))
+    return dict(zip(header, columns))
+
+
+def log_errors(log, setpoint=None):
+    '''
+    RETURNS
+    setpoint - temperature per sample of a load_log() log, from the fixed
+    setpoint, else the Setpoint column, else the Error column of older logs
+    '''
+    temps = log['Temperature']
+    if setpoint is not None:
+        return [setpoint - temp for temp in temps]
+    if 'Setpoint' in log:
+        return [target - temp for target, temp in zip(log['Setpoint'], temps)]
+    if 'Error' in log:
+        return log['Error']
+    raise ValueError("Log has no Setpoint or Error column, give a setpoint.")
+
+
+def log_metrics(log, setpoint=None, start=None, end=None, band=BAND):
+    '''
+    INPUTS
+    log: columns from load_log()
+    setpoint: fixed setpoint in K, None to use the log's setpoint, see log_errors()
+    start, end: time window in s, None for the whole log
+    band: allowed error in K
+    RETURNS
+    dict of tracking metrics over the window
+    '''
+    times = log['Time']
+    temps = log['Temperature']
+    errors = log_errors(log, setpoint)
+
+    count = 0
+    total = 0.0
+    square = 0.0
+    worst = 0.0
+    in_band = 0
+    low = math.inf
+    high = -math.inf
+    entered = None
+    first = last = None
+    for time, temp, error in zip(times, temps, errors):
+        if (start is not None and time < start) or (end is not None and time > end):
+            continue
+        if first is None:
+            first = time
+        last = time
+        count += 1
+        total += temp
+        square += error * error
+        low = min(low, temp)
+        high = max(high, temp)
+        if abs(error) > abs(worst):
+            worst = error
+        if abs(error) <= band:
+            in_band += 1
+            if entered is None:
+                entered = time
+        else:
+            entered = None
+    if not count:
+        raise ValueError("No samples in the time window.")
+    return {
+        'samples': count,
+        'duration': last - first,
+        'mean': total / count,
+        'min': low,
+        'max': high,
+        'rms_error': math.sqrt(square / count),
+        'max_error': worst,
+        'in_band': in_band / count,
+        # Time the temperature entered the band for good, None if it left it at the end
+        'settled_at': entered,
+    }
+
+
+def analyze(file_path, setpoint=None, start=None, end=None, band=BAND):
+    '''
+    Cached log_metrics() of a log file.
+    '''
+    return memoize('pid_log.metrics', lambda: log_metrics(load_log(file_path), setpoint, start, end, band),
+                   files=[file_path], params={'setpoint': setpoint, 'start': start, 'end': end, 'band': band},
+                   version=CACHE_VERSION)
+
+
+def build_pyramids(log):
+    '''
+    RETURNS
+    {'Temperature': SummaryPyramid, 'Error': SummaryPyramid of log_errors()},
+    no 'Error' if the log has no setpoint
+    '''
+    built = {'Temperature': SummaryPyramid(log['Time'], log['Temperature'])}
+    if 'Setpoint' in log or 'Error' in log:
+        built['Error'] = SummaryPyramid(log['Time'], log_errors(log))
+    return built
+
+
+def _pyramid_key(file_path):
+    return default_cache.key('pid_log.pyramids', [file_path], None, CACHE_VERSION)
+
+
+def pyramids(file_path):
+    '''
+    Cached build_pyramids() of a log file.
+    '''
+    return memoize('pid_log.pyramids', lambda: build_pyramids(load_log(file_path)),
+                   files=[file_path], version=CACHE_VERSION)
+
+
+def store_pyramids(file_path, built):
+    '''
+    Caches pyramids built while file_path was logged, once the file is closed.
+    '''
+    if default_cache.enabled:
+        default_cache.put(_pyramid_key(file_path), built)
+
+
+def band_violations(file_path, setpoint=None, start=None, end=None, band=BAND):
+    '''
+    INPUTS
+    setpoint: fixed setpoint in K, None to use the log's setpoint, see log_errors()
+    start, end: time window in s, None for the whole log
+    band: allowed error in K
+    RETURNS
+    list of (first time, last time, worst error) the temperature was out of
+    band, error as setpoint - temperature
+    '''
+    built = pyramids(file_path)
+    if setpoint is None:
+        if 'Error' not in built:
+            raise ValueError("Log has no Setpoint or Error column, give a setpoint.")
+        return built['Error'].violations(-band, band, start, end)
+    return [(first, last, setpoint - worst) for first, last, worst
+            in built['Temperature'].violations(setpoint - band, setpoint + band, start, end)]
+
+
+def zoom(file_path, start=None, end=None, pixels=1000, column='Temperature'):
+    '''
+    RETURNS
+    list of (time, min, max, mean) of column, one per pixel, see SummaryPyramid.zoom()
+    '''
+    return pyramids(file_path)[column].zoom(start, end, pixels)
+
+
+def print_metrics(file_path, metrics):
+    settled = 'never' if metrics['settled_at'] is None else f"{metrics['settled_at']:.0f} s"
+    print(f"{os.path.basename(file_path)}: {metrics['samples']} samples over {metrics['duration']:.0f} s\n"
+          f"\tmean {metrics['mean']:.3f} K, min {metrics['min']:.3f} K, max {metrics['max']:.3f} K\n"
+          f"\tRMS error {metrics['rms_error']:.4f} K, worst {metrics['max_error']:+.4f} K, "
+          f"{metrics['in_band'] * 100:.1f}% in band, settled at {settled}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Thermal control log metrics")
+    parser.add_argument('logs', nargs='+', help="lab2 log CSVs")
+    parser.add_argument('--setpoint', type=float, help="fixed setpoint in K (default: from the log)")
+    parser.add_argument('--start', type=float, help="window start in s")
+    parser.add_argument('--end', type=float, help="window end in s")
+    parser.add_argument('--band', type=float, default=BAND, help="allowed error in K (default: %(default)s)")
+    parser.add_argument('--violations', action='store_true', help="list the intervals out of band")
+    parser.add_argument('--zoom', type=int, metavar='PIXELS', help="print the temperature decimated to PIXELS rows")
+    args = parser.parse_args(argv)
+
+    for file_path in args.logs:
+        try:
+            metrics = analyze(file_path, args.setpoint, args.start, args.end, args.band)
+            intervals = band_violations(file_path, args.setpoint, args.start, args.end, args.band) \
+                if args.violations else []
+        except ValueError as err:
+            print(f"{os.path.basename(file_path)}: {err}")
+            continue
+        print_metrics(file_path, metrics)
+        if args.violations:
+            print(f"\t{len(intervals)} intervals out of +-{args.band} K")
+            for first, last, worst in intervals:
+                print(f"\t\t{first:9.1f} s - {last:9.1f} s ({last - first:7.1f} s), worst {worst:+.4f} K")
+        if args.zoom:
+            print(f"\t{'time s':>9}{'min K':>10}{'max K':>10}{'mean K':>10}")
+            for time_s, low, high, mean in zoom(file_path, args.start, args.end, args.zoom):
+                print(f"\t{time_s:9.1f}{low:10.3f}{high:10.3f}{mean:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
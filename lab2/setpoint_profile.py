@@ -0,0 +1,150 @@
+# setpoint_profile.py
+#
+# Setpoint schedules for the thermal control loop, Lab2 EE90
+#
+# A profile is a list of segments, run one after another:
+#   step  <duration_s> <target_K>   jump to target, hold for duration
+#   ramp  <duration_s> <target_K>   move linearly from the previous value to target
+#   soak  <duration_s>              hold the previous value for duration
+#
+# Profile files use one segment per line, comma or space separated.
+# Blank lines and anything after '#' are ignored, e.g.
+#   # 2 hour test, see long_test()
+#   step, 3600, 310.160
+#   step, 3600, 303.387
+
+SEGMENT_KINDS = ('step', 'ramp', 'soak')
+
+
+class ProfileSegment:
+    '''
+    One piece of a setpoint profile.
+    kind: 'step', 'ramp' or 'soak'
+    duration: segment length, seconds
+    target: end value of the segment in Kelvin (None for soak)
+    '''
+    def __init__(self, kind, duration, target=None):
+        if kind not in SEGMENT_KINDS:
+            raise ValueError(f"Unknown segment kind '{kind}', must be one of {SEGMENT_KINDS}.")
+        if duration <= 0:
+            raise ValueError("Segment duration must be positive.")
+        if kind != 'soak' and target is None:
+            raise ValueError(f"A {kind} segment needs a target temperature.")
+        self.kind = kind
+        self.duration = float(duration)
+        self.target = None if target is None else float(target)
+
+    def __repr__(self):
+        return f"ProfileSegment({self.kind!r}, {self.duration}, {self.target})"
+
+
+class SetpointProfile:
+    '''
+    Precomputed setpoint schedule.
+    The segments are expanded once into a table with one entry per control tick,
+    so the lookup done inside the control loop is a single list index.
+    '''
+    def __init__(self, segments, dt, start=None):
+        '''
+        INPUTS
+        segments: list of ProfileSegment
+        dt: control loop time step, seconds
+        start: starting value for a leading ramp/soak, Kelvin
+        '''
+        if not segments:
+            raise ValueError("A profile needs at least one segment.")
+        if dt <= 0:
+            raise ValueError("Time step must be positive.")
+        self.segments = list(segments)
+        self.dt = dt
+        self.start = start
+        # Indexed segment table: segment and setpoint for every tick
+        self.segment_index = []
+        self.setpoints = []
+        self._build(start)
+
+    def _build(self, start):
+        value = start
+        for index, segment in enumerate(self.segments):
+            ticks = max(1, int(round(segment.duration / self.dt)))
+            if segment.kind == 'step':
+                value = segment.target
+                self.setpoints.extend([value] * ticks)
+            elif segment.kind == 'ramp':
+                if value is None:
+                    raise ValueError("A leading ramp needs a start value.")
+                slope = (segment.target - value) / ticks
+                self.setpoints.extend(value + slope * (tick + 1) for tick in range(ticks))
+                value = segment.target
+            else:
+                if value is None:
+                    raise ValueError("A leading soak needs a start value.")
+                self.setpoints.extend([value] * ticks)
+            self.segment_index.extend([index] * ticks)
+
+    @property
+    def num_steps(self):
+        return len(self.setpoints)
+
+    @property
+    def duration(self):
+        return self.num_steps * self.dt
+
+    def at(self, step):
+        '''
+        Setpoint for a control tick. Ticks past the end hold the final value.
+        '''
+        if step >= len(self.setpoints):
+            return self.setpoints[-1]
+        return self.setpoints[step]
+
+    def segment_at(self, step):
+        '''
+        Segment in effect at a control tick.
+        '''
+        return self.segments[self.segment_index[min(step, len(self.segment_index) - 1)]]
+
+    @classmethod
+    def constant(cls, setpoint, run_time, dt):
+        '''
+        Single hold at setpoint for run_time seconds, as used by pid_test().
+        '''
+        return cls([ProfileSegment('step', run_time, setpoint)], dt)
+
+
+def parse_profile(lines):
+    '''
+    Parse profile text lines into a list of ProfileSegment.
+    Raises ValueError with the line number on bad input.
+    '''
+    segments = []
+    for line_num, line in enumerate(lines, start=1):
+        text = line.split('#', 1)[0].replace(',', ' ').strip()
+        if not text:
+            continue
+        parts = text.split()
+        try:
+            kind = parts[0].lower()
+            duration = float(parts[1])
+            target = float(parts[2]) if len(parts) > 2 else None
+            if len(parts) > 3:
+                raise ValueError("too many fields")
+            segments.append(ProfileSegment(kind, duration, target))
+        except (IndexError, ValueError) as err:
+            raise ValueError(f"Profile line {line_num} '{line.strip()}': {err}") from None
+    return segments
+
+
+def load_profile(file_path, dt, start=None):
+    '''
+    Load a profile file and precompute its setpoint table.
+    INPUTS
+    file_path: path to the profile file
+    dt: control loop time step, seconds
+    start: starting value for a leading ramp/soak, Kelvin
+    RETURNS
+    profile: SetpointProfile
+    '''
+    with open(file_path, 'r') as file:
+        segments = parse_profile(file)
+    return SetpointProfile(segments, dt, start)
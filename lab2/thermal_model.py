@@ -0,0 +1,263 @@
+# thermal_model.py
+#
+# Plant model and model-based controller for the thermal loop, Lab2 EE90
+#
+# The heater/thermistor board is modelled first order plus dead time (FOPDT):
+#   TAU dT/dt = T_AMBIENT + GAIN * u(t - DEAD_TIME) - T
+# with heater drive u = 1 - DAC / DAC_MAX, as the BJT heater is fully ON at 0V.
+# identify_model() fits the model to a logged run, either a run_profile() log
+# (Time,Temperature,DAC,...) or a test_on_off() log (Time,Temperature, heater
+# on for the first half).
+#
+# ModelController uses the model in two ways:
+#   feedforward  the DAC code that holds a temperature in steady state
+#   correction   internal model control with a Smith predictor: the model runs
+#                alongside the plant both without and with the dead time, the
+#                gap between the measurement and the delayed model is the
+#                disturbance estimate, and the drive is the constant drive that
+#                brings the undelayed model plus that disturbance onto the
+#                setpoint HORIZON seconds ahead
+# The correction has a closed form whose setpoint term is precomputed for every
+# tick of the profile, so a tick is one table lookup, a few multiply-adds and
+# one exp. As the profile is known in advance, the entry for tick k aims at the
+# setpoint of tick k + HORIZON, so ramps are tracked without a lag and steps
+# are started early. The model is fed the clamped drive, so a saturated step
+# does not wind up, and any constant model error is taken up by the
+# disturbance estimate.
+#
+# Usage:
+#   python thermal_model.py on_off_good.csv -o model.json
+
+import argparse
+import json
+import math
+from collections import deque
+from pid_log import load_log
+
+# Identified from on_off_good.csv (python thermal_model.py on_off_good.csv)
+GAIN = 16.65            # Temperature rise at full heater drive, Kelvin
+TAU = 173.8             # Plant time constant, seconds
+T_AMBIENT = 297.05      # Temperature with the heater off, Kelvin
+DEAD_TIME = 10.0        # Transport delay from DAC to thermistor, seconds
+DAC_MAX = 65535         # DAC full scale code (adafruit 16 bit)
+
+HORIZON = 30.0          # Seconds ahead the correction puts the model on the setpoint
+SMOOTHING = 0.2         # Weight of a new sample in the disturbance estimate
+FIT_STEP = 5.0          # Resampling step for identification, seconds
+MAX_DEAD_TIME = 60.0    # Longest dead time tried by identification, seconds
+
+
+class FOPDTModel:
+    '''
+    First order plus dead time plant: gain and ambient in Kelvin, tau and
+    dead_time in seconds.
+    '''
+    def __init__(self, gain=GAIN, tau=TAU, t_ambient=T_AMBIENT, dead_time=DEAD_TIME):
+        if gain <= 0 or tau <= 0 or dead_time < 0:
+            raise ValueError("Model needs a positive gain and time constant and no negative dead time.")
+        self.gain = gain
+        self.tau = tau
+        self.t_ambient = t_ambient
+        self.dead_time = dead_time
+
+    def __repr__(self):
+        return (f"FOPDTModel(gain={self.gain:.3f}, tau={self.tau:.1f}, t_ambient={self.t_ambient:.2f}, "
+                f"dead_time={self.dead_time:.1f})")
+
+    def drive_for(self, temperature):
+        '''
+        Heater drive 0..1 holding temperature in steady state, clamped.
+        '''
+        return min(max((temperature - self.t_ambient) / self.gain, 0.0), 1.0)
+
+    def to_dict(self):
+        return {'gain': self.gain, 'tau': self.tau, 't_ambient': self.t_ambient, 'dead_time': self.dead_time}
+
+
+def drive_to_code(drive):
+    return int(round((1.0 - drive) * DAC_MAX))
+
+
+def feedforward_code(model, temperature):
+    '''
+    DAC code that holds temperature in steady state.
+    '''
+    return drive_to_code(model.drive_for(temperature))
+
+
+def save_model(model, file_path):
+    with open(file_path, 'w') as file:
+        json.dump(model.to_dict(), file, indent=2)
+
+
+def load_model(file_path):
+    with open(file_path, 'r') as file:
+        return FOPDTModel(**json.load(file))
+
+
+def log_drives(log):
+    '''
+    Heater drive per sample of a load_log() log: from the DAC column, or for
+    a test_on_off() log heater on for the first half of the samples.
+    '''
+    if 'DAC' in log:
+        return [1.0 - code / DAC_MAX for code in log['DAC']]
+    half = len(log['Temperature']) // 2
+    return [1.0 if index <= half else 0.0 for index in range(len(log['Temperature']))]
+
+
+def _resample(times, temps, drives, step):
+    '''
+    Temperature linearly interpolated, drive held, on a uniform time grid.
+    '''
+    grid_temps = []
+    grid_drives = []
+    index = 0
+    now = times[0]
+    while now <= times[-1]:
+        while index < len(times) - 2 and times[index + 1] < now:
+            index += 1
+        span = times[index + 1] - times[index]
+        frac = (now - times[index]) / span if span > 0 else 0.0
+        grid_temps.append(temps[index] + frac * (temps[index + 1] - temps[index]))
+        grid_drives.append(drives[index])
+        now += step
+    return grid_temps, grid_drives
+
+
+def _solve3(matrix, vector):
+    '''
+    Solves a 3x3 linear system by Gaussian elimination with partial pivoting.
+    '''
+    rows = [row[:] + [value] for row, value in zip(matrix, vector)]
+    for col in range(3):
+        pivot = max(range(col, 3), key=lambda row: abs(rows[row][col]))
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        if rows[col][col] == 0:
+            raise ValueError("Log does not excite the plant, cannot identify a model.")
+        for row in range(3):
+            if row != col:
+                factor = rows[row][col] / rows[col][col]
+                rows[row] = [value - factor * pivot_value for value, pivot_value in zip(rows[row], rows[col])]
+    return [rows[index][3] / rows[index][index] for index in range(3)]
+
+
+def identify_model(times, temps, drives, step=FIT_STEP, max_dead_time=MAX_DEAD_TIME):
+    '''
+    Least squares FOPDT fit of a logged run.
+    The log is resampled to step seconds and T[k+1] = a T[k] + b u[k-d] + c
+    fitted for every whole-step dead time d up to max_dead_time, keeping the
+    best fit. Then tau = -step / ln(a), gain = b / (1 - a), ambient = c / (1 - a).
+    RETURNS
+    model: FOPDTModel
+    rms: one step ahead prediction error of the fit, Kelvin
+    '''
+    grid_temps, grid_drives = _resample(times, temps, drives, step)
+    best = None
+    for delay in range(int(max_dead_time / step) + 1):
+        samples = [(grid_temps[k], grid_drives[k - delay], grid_temps[k + 1])
+                   for k in range(delay, len(grid_temps) - 1)]
+        if len(samples) < 3:
+            break
+        matrix = [[0.0] * 3 for _ in range(3)]
+        vector = [0.0] * 3
+        for temp, drive, next_temp in samples:
+            regressors = (temp, drive, 1.0)
+            for i in range(3):
+                vector[i] += regressors[i] * next_temp
+                for j in range(3):
+                    matrix[i][j] += regressors[i] * regressors[j]
+        a, b, c = _solve3(matrix, vector)
+        residual = sum((next_temp - a * temp - b * drive - c) ** 2 for temp, drive, next_temp in samples)
+        rms = math.sqrt(residual / len(samples))
+        if best is None or rms < best[0]:
+            best = (rms, delay, a, b, c)
+    if best is None or not 0.0 < best[2] < 1.0 or best[3] <= 0:
+        raise ValueError("Log does not fit a stable heater model.")
+    rms, delay, a, b, c = best
+    model = FOPDTModel(gain=b / (1.0 - a), tau=-step / math.log(a), t_ambient=c / (1.0 - a), dead_time=delay * step)
+    return model, rms
+
+
+class ModelController:
+    '''
+    Feedforward plus Smith predictor / internal model control, see the top of the file.
+    INPUTS
+    model: FOPDTModel
+    setpoints: setpoint per control tick (SetpointProfile.setpoints)
+    dt: control loop time step, seconds, sets the dead time in ticks
+    horizon: seconds ahead the model is put on the setpoint, shorter is faster
+             but passes more measurement noise to the DAC
+    smoothing: weight of a new sample in the disturbance estimate
+    '''
+    def __init__(self, model, setpoints, dt, horizon=HORIZON, smoothing=SMOOTHING):
+        self.model = model
+        self.smoothing = smoothing
+        # The drive putting the model at x plus disturbance onto r after the horizon:
+        #   T_ss = (r - dist - a_h x) / (1 - a_h), u = (T_ss - T_AMBIENT) / GAIN
+        self.a_h = math.exp(-horizon / model.tau)
+        self.gain_h = 1.0 / ((1.0 - self.a_h) * model.gain)
+        # Each tick aims at the setpoint the horizon ahead, held at the end of the profile
+        ahead = int(round(horizon / dt))
+        last = len(setpoints) - 1
+        self.table = [setpoints[min(step + ahead, last)] * self.gain_h - model.t_ambient / model.gain
+                      for step in range(len(setpoints))]
+        self.delay_ticks = int(round(model.dead_time / dt))
+        self.model_temp = None
+        self.delayed_temp = None
+        self.delay_line = None
+        self.disturbance = 0.0
+        self.drive = 0.0
+
+    def _advance(self, temp, drive, decay):
+        steady = self.model.t_ambient + self.model.gain * drive
+        return steady + (temp - steady) * decay
+
+    def update(self, step, temperature, dt):
+        '''
+        One control tick.
+        INPUTS
+        step: control tick, indexes the setpoint table
+        temperature: measured temperature, Kelvin
+        dt: seconds since the last tick
+        RETURNS
+        code: DAC code
+        drive: heater drive 0..1
+        '''
+        if self.model_temp is None:
+            # Start from rest at the measured temperature
+            self.model_temp = self.delayed_temp = temperature
+            self.delay_line = deque([self.model.drive_for(temperature)] * self.delay_ticks)
+        self.disturbance += self.smoothing * (temperature - self.delayed_temp - self.disturbance)
+
+        drive = self.table[min(step, len(self.table) - 1)] - self.gain_h * (self.disturbance + self.a_h * self.model_temp)
+        drive = min(max(drive, 0.0), 1.0)
+        self.drive = drive
+
+        # Advance the undelayed and delayed models with the drive actually applied
+        decay = math.exp(-dt / self.model.tau)
+        self.model_temp = self._advance(self.model_temp, drive, decay)
+        self.delay_line.append(drive)
+        self.delayed_temp = self._advance(self.delayed_temp, self.delay_line.popleft(), decay)
+        return drive_to_code(drive), drive
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Identify the thermal plant model from a logged run")
+    parser.add_argument('log', help="run_profile() or test_on_off() log CSV")
+    parser.add_argument('-o', '--output', help="save the model as JSON, for lab2.MODEL_FILE")
+    parser.add_argument('--step', type=float, default=FIT_STEP, help="resampling step in s (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    log = load_log(args.log)
+    model, rms = identify_model(log['Time'], log['Temperature'], log_drives(log), args.step)
+    print(f"{model}, one step RMS error {rms:.4f} K")
+    print("Feedforward codes: " +", ".join(f"{temp:.0f} K -> {feedforward_code(model, temp)}"
+                                             for temp in (300.0, 303.0, 306.0, 310.0)))
+    if args.output:
+        save_model(model, args.output)
+        print(f"Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
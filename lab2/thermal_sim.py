@@ -0,0 +1,128 @@
+# thermal_sim.py
+#
+# Simulated thermal plant for the Lab2 control loop, EE90
+#
+# Stands in for the ADS1015, MCP4728 and heater/thermistor board so the
+# control loops in lab2.py can be run without hardware. The plant is first
+# order plus dead time: the heater drive, DEAD_TIME seconds late, pulls the
+# temperature towards
+#   T_ss = T_AMBIENT + GAIN * (1 - V_dac / DAC_LIMIT)
+# with time constant TAU. As on the board, the BJT heater is fully ON at 0V.
+
+import math
+
+# Fitted to on_off_good.csv (python thermal_model.py on_off_good.csv)
+T_AMBIENT = 297.05      # Ambient temperature, Kelvin
+GAIN = 16.65            # Temperature rise at full heater drive, Kelvin
+TAU = 173.8             # Plant time constant, seconds
+DEAD_TIME = 10.0        # Transport delay from DAC to thermistor, seconds
+VCC = 3.287             # Splitter excitation, Volts
+DAC_MAX = 65535         # DAC full scale code (adafruit 16 bit)
+READ_TIME = 0.001       # Time taken by one ADC read over I2C, seconds
+
+# Thermistor, must match lab2.py so calc_temperature() inverts it
+RB = 10000.0
+RT0 = 10000.0
+T0_C = 25.0
+BR = 3600.0
+
+
+class SimChannel:
+    '''
+    Mimics adafruit_ads1x15 AnalogIn: exposes .voltage and .value
+    '''
+    def __init__(self, read):
+        self._read = read
+
+    @property
+    def voltage(self):
+        return self._read()
+
+    @property
+    def value(self):
+        return int(self._read() / 4.096 * 32767)
+
+
+class SimDacChannel:
+    '''
+    Mimics one adafruit_mcp4728 channel: exposes .value (16 bit code)
+    '''
+    def __init__(self):
+        self.value = 0
+
+
+class SimDac:
+    '''
+    Mimics adafruit_mcp4728.MCP4728 with four channels.
+    '''
+    def __init__(self):
+        self.channel_a = SimDacChannel()
+        self.channel_b = SimDacChannel()
+        self.channel_c = SimDacChannel()
+        self.channel_d = SimDacChannel()
+
+
+class SimulatedHardware:
+    '''
+    Simulated thermal board with a virtual clock.
+    Has the same attributes as lab2.Hardware (chan0, chan1, mcp4728, time(), sleep())
+    so the control loops run unchanged. sleep() advances the plant instead of waiting,
+    and every ADC read advances it by READ_TIME.
+    '''
+    def __init__(self, t_start=T_AMBIENT, t_ambient=T_AMBIENT, gain=GAIN, tau=TAU,
+                 dead_time=DEAD_TIME, noise=0.0, sub_step=0.1, seed=None):
+        self.t_ambient = t_ambient
+        self.gain = gain
+        self.tau = tau
+        self.dead_time = dead_time
+        self.noise = noise
+        self.sub_step = sub_step
+        self.temperature = t_start
+        self.now = 0.0
+        self.mcp4728 = SimDac()
+        self.mcp4728.channel_a.value = DAC_MAX
+        self.chan0 = SimChannel(self._excitation_voltage)
+        self.chan1 = SimChannel(self._thermistor_voltage)
+        # Delay line of (time, heater drive) for the dead time
+        self._history = []
+        self._rng = None
+        if noise:
+            import random
+            self._rng = random.Random(seed)
+
+    def _excitation_voltage(self):
+        self.sleep(READ_TIME)
+        return VCC
+
+    def _thermistor_voltage(self):
+        self.sleep(READ_TIME)
+        rt = RT0 * math.exp(BR * (1.0 / self.temperature - 1.0 / (T0_C + 273.15)))
+        vt = VCC * rt / (RB + rt)
+        if self._rng is not None:
+            vt += self._rng.gauss(0.0, self.noise)
+        return vt
+
+    def _drive(self):
+        # Heater drive 0..1 seen by the plant after the dead time
+        drive = 1.0 - min(max(self.mcp4728.channel_a.value, 0), DAC_MAX) / DAC_MAX
+        if self.dead_time <= 0:
+            return drive
+        self._history.append((self.now, drive))
+        while len(self._history) > 1 and self._history[1][0] <= self.now - self.dead_time:
+            self._history.pop(0)
+        if self._history[0][0] <= self.now - self.dead_time:
+            return self._history[0][1]
+        return 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # Integrate the plant over the sleep with exact first order steps
+        remaining = seconds
+        while remaining > 1e-12:
+            h = min(self.sub_step, remaining)
+            t_ss = self.t_ambient + self.gain * self._drive()
+            self.temperature = t_ss + (self.temperature - t_ss) * math.exp(-h / self.tau)
+            self.now += h
+            remaining -= h
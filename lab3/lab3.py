@@ -1,7 +1,3 @@
-import board
-import busio
-import adafruit_ds3502
-import digitalio
 import time
 import sys
 # pip install adafruit-circuitpython-ds3502
@@ -101,6 +97,11 @@ def square_tri_test(sw_pot, fdbk_pot, gpio0, gpio1):
         except ValueError:
             print("Invalid input. Format: <wiper 0–127> <bit0 0/1> <bit1 0/1> or choose sweep option.")
 def main():
+    # Hardware stack is only needed to run the tests, not to import this file
+    import board
+    import busio
+    import adafruit_ds3502
+    import digitalio
     # Setup I2C connection
     i2c = busio.I2C(board.SCL, board.SDA)
     # Setup potentiometer connection